@@ -0,0 +1 @@
+"""Offline benchmarks of the plot_agent hot paths. Run with `python -m benchmarks --help`."""
@@ -0,0 +1,138 @@
+"""
+Run the benchmarks, optionally saving them as the baseline or comparing them against it.
+
+    python -m benchmarks                    # run and print timings
+    python -m benchmarks --save             # run and store timings as the baseline
+    python -m benchmarks --compare          # run and fail on regressions past --threshold
+    python -m benchmarks -k execute_code    # only benchmarks whose name contains a pattern
+
+Timings are the best of `--repeat` rounds, per call, so they are only comparable
+with a baseline recorded on the same machine.
+"""
+import argparse
+import json
+import platform
+import sys
+import timeit
+from pathlib import Path
+
+from benchmarks.suite import BENCHMARKS
+
+
+DEFAULT_BASELINE = Path(__file__).parent / "baseline.json"
+
+
+def _environment() -> dict:
+    """Describe what the timings were recorded on."""
+    import numpy
+    import pandas
+    import plotly
+
+    return {
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "python": platform.python_version(),
+        "numpy": numpy.__version__,
+        "pandas": pandas.__version__,
+        "plotly": plotly.__version__,
+    }
+
+
+def _format_seconds(seconds: float) -> str:
+    """Format a duration with a readable unit."""
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.3g} {unit}"
+    return f"{seconds / 1e-9:.3g} ns"
+
+
+def measure(setup, repeat: int) -> float:
+    """
+    Time a benchmark.
+
+    Args:
+        setup: The benchmark, returning the callable to time.
+        repeat (int): Number of rounds; the fastest is kept, as it is the least disturbed by noise.
+
+    Returns:
+        float: Seconds per call.
+    """
+    timer = timeit.Timer(setup())
+    # Enough calls per round to take at least 0.2 seconds
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """
+    Compare timings to a baseline.
+
+    Args:
+        results (dict): Seconds per call, by benchmark name.
+        baseline (dict): Baseline seconds per call, by benchmark name.
+        threshold (float): Allowed slowdown, as a fraction of the baseline.
+
+    Returns:
+        list: The names of the benchmarks slower than the baseline by more than the threshold.
+    """
+    return [
+        name
+        for name, seconds in results.items()
+        if name in baseline and seconds > baseline[name] * (1 + threshold)
+    ]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "-k", "--filter", action="append", default=[], help="only run benchmarks whose name contains this"
+    )
+    parser.add_argument("--repeat", type=int, default=7, help="rounds per benchmark (default: 7)")
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE, help="baseline file")
+    parser.add_argument("--save", action="store_true", help="store the timings in the baseline file")
+    parser.add_argument("--compare", action="store_true", help="fail on regressions against the baseline")
+    parser.add_argument(
+        "--threshold", type=float, default=0.3, help="allowed slowdown before failing (default: 0.3)"
+    )
+    args = parser.parse_args(argv)
+
+    names = [name for name in BENCHMARKS if not args.filter or any(k in name for k in args.filter)]
+    if not names:
+        parser.error("no benchmark matches the filter")
+
+    stored = json.loads(args.baseline.read_text()) if args.baseline.exists() else {}
+    baseline = stored.get("results", {})
+    if args.compare:
+        if not baseline:
+            parser.error(f"no baseline in {args.baseline}, record one with --save")
+        if stored.get("environment") != _environment():
+            print(f"Warning: the baseline was recorded on a different setup: {stored.get('environment')}")
+
+    results = {}
+    width = max(len(name) for name in names)
+    for name in names:
+        results[name] = seconds = measure(BENCHMARKS[name], args.repeat)
+        line = f"{name:<{width}}  {_format_seconds(seconds):>10}"
+        if name in baseline:
+            line += f"  baseline {_format_seconds(baseline[name]):>10}  {seconds / baseline[name]:6.2f}x"
+        print(line, flush=True)
+
+    if args.save:
+        stored = {"environment": _environment(), "results": {**baseline, **results}}
+        args.baseline.write_text(json.dumps(stored, indent=2, sort_keys=True) + "\n")
+        print(f"Saved {len(results)} timings to {args.baseline}")
+
+    if args.compare:
+        regressions = compare(results, baseline, args.threshold)
+        missing = [name for name in results if name not in baseline]
+        if missing:
+            print(f"No baseline for: {', '.join(missing)}")
+        if regressions:
+            print(f"Regressions past {args.threshold:.0%}: {', '.join(regressions)}")
+            return 1
+        print(f"No regressions past {args.threshold:.0%}.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
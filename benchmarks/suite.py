@@ -0,0 +1,177 @@
+"""
+Benchmarks of the execution and setup hot paths.
+
+Each benchmark is a function that does its setup and returns the callable to time,
+so only the hot path itself is measured. Benchmarks run offline: no LLM is called.
+"""
+import ast
+import os
+from typing import Callable, Dict
+
+import numpy as np
+import pandas as pd
+
+# set_df builds the agent, which needs an API key but never calls the API
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmarks")
+
+from plot_agent.agent import PlotAgent  # noqa: E402
+from plot_agent.execution import PlotAgentExecutionEnvironment  # noqa: E402
+from plot_agent.serialization import figure_to_json  # noqa: E402
+
+
+# Benchmarks by name, in the order they run
+BENCHMARKS: Dict[str, Callable[[], Callable[[], object]]] = {}
+
+# Data sizes the chart benchmarks run at
+SIZES = (1_000, 10_000, 100_000)
+
+
+def benchmark(name: str):
+    """Register a benchmark under `name`."""
+
+    def register(setup):
+        assert name not in BENCHMARKS, f"Duplicate benchmark {name!r}."
+        BENCHMARKS[name] = setup
+        return setup
+
+    return register
+
+
+def _frame(n_rows: int, seed: int = 0) -> pd.DataFrame:
+    """A frame with dates, numbers and a low-cardinality category, like typical chart input."""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame(
+        {
+            "date": pd.date_range("2020-01-01", periods=n_rows, freq="min"),
+            "x": np.arange(n_rows, dtype=float),
+            "y": rng.normal(size=n_rows).cumsum(),
+            "z": rng.random(n_rows),
+            "category": rng.choice(["alpha", "beta", "gamma", "delta"], n_rows),
+        }
+    )
+
+
+# set_df
+
+
+def _set_df(df: pd.DataFrame):
+    agent = PlotAgent(verbose=False)
+    # Build the shared agent once, so only per-frame work is timed
+    agent.set_df(df.head(10))
+    return lambda: agent.set_df(df)
+
+
+@benchmark("set_df/tall")
+def _set_df_tall():
+    return _set_df(_frame(1_000_000))
+
+
+@benchmark("set_df/wide")
+def _set_df_wide():
+    rng = np.random.default_rng(0)
+    return _set_df(pd.DataFrame(rng.random((1_000, 500)), columns=[f"col_{i}" for i in range(500)]))
+
+
+@benchmark("set_df/text")
+def _set_df_text():
+    rng = np.random.default_rng(0)
+    words = np.array("the quick brown fox jumps over a lazy dog while plotting data".split())
+    n_rows = 100_000
+    return _set_df(
+        pd.DataFrame(
+            {
+                f"text_{i}": [" ".join(rng.choice(words, 20)) for _ in range(n_rows)]
+                for i in range(5)
+            }
+        )
+    )
+
+
+# _validate_ast
+
+
+def _snippet(n_lines: int) -> str:
+    """A long but realistic plotting snippet."""
+    lines = ["import plotly.graph_objects as go", "fig = go.Figure()"]
+    for i in range(n_lines // 3):
+        lines.append(f"subset_{i} = df[df['category'] == 'alpha'].groupby('x')['y'].mean().reset_index()")
+        lines.append(f"fig.add_trace(go.Scatter(x=subset_{i}['x'], y=subset_{i}['y'], name='trace {i}'))")
+        lines.append(f"fig.update_layout(title=dict(text='Trace {i}'), xaxis=dict(title='x'))")
+    return "\n".join(lines)
+
+
+def _validate(n_lines: int):
+    env = PlotAgentExecutionEnvironment(_frame(10))
+    tree = ast.parse(_snippet(n_lines))
+    return lambda: env._validate_ast(tree)
+
+
+@benchmark("validate_ast/300_lines")
+def _validate_small():
+    return _validate(300)
+
+
+@benchmark("validate_ast/3000_lines")
+def _validate_large():
+    return _validate(3_000)
+
+
+# execute_code
+
+CHARTS = {
+    "px.scatter": "fig = px.scatter(df, x='x', y='y', color='category')",
+    "px.line": "fig = px.line(df, x='date', y='y')",
+    "px.bar": "fig = px.bar(df.groupby('category', as_index=False)['y'].sum(), x='category', y='y')",
+    "px.histogram": "fig = px.histogram(df, x='y', nbins=50)",
+    "go.Scatter": "fig = go.Figure(go.Scatter(x=df['x'], y=df['y'], mode='lines'))",
+    "go.Heatmap": (
+        "pivot = df.assign(bucket=(df['z'] * 20).astype(int))"
+        ".pivot_table(index='category', columns='bucket', values='y', aggfunc='mean')\n"
+        "fig = go.Figure(go.Heatmap(z=pivot.values, x=pivot.columns, y=pivot.index))"
+    ),
+    # The sandbox aggregation helpers, against the raw-row charts above
+    "bin_histogram": "fig = px.bar(bin_histogram(df, 'y', bins=50), x='bin_center', y='count')",
+    "density_grid": "fig = px.imshow(density_grid(df, 'x', 'y', bins=50), origin='lower', aspect='auto')",
+    "resample_timeseries": "fig = px.line(resample_timeseries(df, 'date', 'y', max_points=500), x='date', y='y')",
+}
+
+
+def _execute(code: str, n_rows: int):
+    env = PlotAgentExecutionEnvironment(_frame(n_rows))
+    # Warm the compiled-code cache and plotting imports, as in a long-running service
+    result = env.execute_code(code)
+    assert result["success"], result["error"]
+    return lambda: env.execute_code(code)
+
+
+for _chart, _code in CHARTS.items():
+    for _size in SIZES:
+        benchmark(f"execute_code/{_chart}/{_size}")(
+            lambda code=_code, size=_size: _execute(code, size)
+        )
+
+
+# Serialization
+
+
+def _line_figure(n_rows: int):
+    env = PlotAgentExecutionEnvironment(_frame(n_rows))
+    return env.execute_code(CHARTS["go.Scatter"])["fig"]
+
+
+@benchmark("serialize/to_json/100000")
+def _serialize_plotly():
+    fig = _line_figure(100_000)
+    return fig.to_json
+
+
+@benchmark("serialize/figure_to_json/100000")
+def _serialize_compact():
+    fig = _line_figure(100_000)
+    return lambda: figure_to_json(fig)
+
+
+@benchmark("serialize/figure_to_json_float32/100000")
+def _serialize_float32():
+    fig = _line_figure(100_000)
+    return lambda: figure_to_json(fig, float32=True)
@@ -1,24 +1,108 @@
 """
 This module contains the PlotAgent class, which is used to generate Plotly code based on a user's plot description.
+
+LangChain and the OpenAI client are only imported once an agent is actually
+built, so importing this module stays cheap for serverless cold starts and
+worker forks.
 """
 
+import asyncio
+import functools
+import queue
+import threading
+import warnings
 import pandas as pd
-from io import StringIO
-from typing import Optional
-
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_core.messages import AIMessage, HumanMessage
-from langchain_core.tools import Tool, StructuredTool
-from langchain.agents import AgentExecutor, create_openai_tools_agent
-from langchain_openai import ChatOpenAI
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import AsyncIterator, Iterable, Iterator, List, Optional, Union
 
 from plot_agent.prompt import DEFAULT_SYSTEM_PROMPT
-from plot_agent.models import (
-    GeneratedCodeInput,
-    DoesFigExistInput,
-    ViewGeneratedCodeInput,
-)
-from plot_agent.execution import PlotAgentExecutionEnvironment
+from plot_agent.cache import FigureCache, code_hash
+from plot_agent.history import compact_history
+from plot_agent.instrumentation import MessageMetrics
+from plot_agent.execution import CANCELLED_ERROR, PlotAgentExecutionEnvironment
+from plot_agent.profiling import profile_dataframe, profile_source
+from plot_agent.pool import PlotAgentWorkerPool, PooledExecutionEnvironment
+from plot_agent.matplotlib_figures import figure_to_png, is_matplotlib_figure
+from plot_agent.sources import QueryCache, SqlSource, open_source
+from plot_agent.serialization import figure_to_json, write_bytes, write_figure
+from plot_agent.streaming import figure_event, streaming_callback_handler
+
+
+def _unpack_job(job):
+    """Return the dataframe, message and SQL query of a batch job given as a tuple or dict."""
+    if isinstance(job, dict):
+        return job["df"], job["message"], job.get("sql_query")
+    df, message, *rest = job
+    return df, message, (rest[0] if rest else None)
+
+
+def _job_result(index: int, agent=None, response: Optional[str] = None, error: str = "") -> dict:
+    """Build the result of a batch job from the agent that ran it, or from an error."""
+    fig = agent.get_figure() if agent is not None else None
+    if fig is None and not error:
+        error = "No figure was created."
+    # The code that produced the figure, or else the last code tried
+    code = None
+    if agent is not None:
+        code = agent.figure_code if fig is not None else agent.generated_code
+    return {
+        "index": index,
+        "response": response,
+        "fig": fig,
+        "generated_code": code,
+        "metrics": agent.last_metrics if agent is not None else None,
+        "error": error,
+        "success": fig is not None,
+    }
+
+
+# Prepared openai-tools agents, keyed by system prompt and LLM, least recently used first.
+# Their tools only contribute schemas, so agents with the same LLM and prompt can share them
+_PREPARED_AGENTS = OrderedDict()
+_PREPARED_AGENTS_LOCK = threading.Lock()
+_MAX_PREPARED_AGENTS = 32
+
+
+def _prepared_agent(llm, tools: list, system_prompt: str):
+    """
+    Return the openai-tools agent for an LLM and system prompt, building it on first use.
+
+    Args:
+        llm: The chat model.
+        tools (list): The tools the agent can call.
+        system_prompt (str): The system prompt, with df_info, df_head and sql_context placeholders.
+
+    Returns:
+        The agent runnable.
+    """
+    from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+    from langchain.agents import create_openai_tools_agent
+
+    key = (system_prompt, id(llm), tuple(tool.name for tool in tools))
+    with _PREPARED_AGENTS_LOCK:
+        entry = _PREPARED_AGENTS.get(key)
+        # Check the LLM too, since ids are reused once an object is freed
+        if entry is not None and entry[0] is llm:
+            _PREPARED_AGENTS.move_to_end(key)
+            return entry[1]
+
+    prompt = ChatPromptTemplate.from_messages(
+        [
+            ("system", system_prompt),
+            MessagesPlaceholder(variable_name="chat_history"),
+            ("human", "{input}"),
+            MessagesPlaceholder(variable_name="agent_scratchpad"),
+        ]
+    )
+    agent = create_openai_tools_agent(llm, tools, prompt)
+
+    with _PREPARED_AGENTS_LOCK:
+        _PREPARED_AGENTS[key] = (llm, agent)
+        _PREPARED_AGENTS.move_to_end(key)
+        while len(_PREPARED_AGENTS) > _MAX_PREPARED_AGENTS:
+            _PREPARED_AGENTS.popitem(last=False)
+    return agent
 
 
 class PlotAgent:
@@ -34,6 +118,18 @@ class PlotAgent:
         max_iterations: int = 10,
         early_stopping_method: str = "force",
         handle_parsing_errors: bool = True,
+        execution_pool: Optional[PlotAgentWorkerPool] = None,
+        figure_cache: Optional[FigureCache] = None,
+        prompt_token_budget: int = 2000,
+        preview_rows: Optional[int] = None,
+        preview_stratify_by: Optional[Union[str, List[str]]] = None,
+        figure_max_points: Optional[int] = None,
+        history_token_budget: Optional[int] = None,
+        history_recent_turns: int = 2,
+        metrics_callbacks: Optional[list] = None,
+        track_memory: bool = False,
+        isolate_df: Optional[bool] = None,
+        llm=None,
     ):
         """
         Initialize the PlotAgent.
@@ -45,21 +141,86 @@ class PlotAgent:
             max_iterations (int): Maximum number of iterations for the agent to take.
             early_stopping_method (str): Method to use for early stopping.
             handle_parsing_errors (bool): Whether to handle parsing errors gracefully.
+            execution_pool (Optional[PlotAgentWorkerPool]): A pool of worker processes to run
+                generated code on. If not provided, code runs in this process.
+            figure_cache (Optional[FigureCache]): A cache of figures keyed by code and dataframe,
+                so re-running identical code returns the cached figure.
+            prompt_token_budget (int): Approximate number of tokens the dataframe description
+                in the system prompt may use.
+            preview_rows (Optional[int]): If set, code the agent tries out is run against a
+                sample of this many rows, and only the final code is run on the full dataframe.
+            preview_stratify_by (Optional[Union[str, List[str]]]): Column(s) whose groups must
+                all be represented in the preview sample.
+            figure_max_points (Optional[int]): If set, scatter and line traces with more points
+                than this are downsampled, and large traces are switched to WebGL.
+            history_token_budget (Optional[int]): If set, the chat history sent to the LLM is
+                compacted to about this many tokens: older turns are summarized and only the
+                latest code is kept.
+            history_recent_turns (int): Number of most recent turns kept verbatim when compacting.
+            metrics_callbacks (Optional[list]): Callables called with the metrics of every
+                process_message call, as returned by MessageMetrics.to_dict().
+            track_memory (bool): Record the peak memory of each code execution in the metrics.
+                This uses tracemalloc, which slows executions down.
+            isolate_df (Optional[bool]): Give each execution its own copy-on-write view of the
+                dataframe, so in-place changes made by generated code are discarded after it runs.
+                By default only if pandas has copy-on-write, since otherwise each execution copies
+                the whole dataframe.
+            llm: The chat model to use instead of an OpenAI one for `model`, for example a
+                plot_agent.testing.ScriptedChatModel to run offline.
         """
-        self.llm = ChatOpenAI(model=model)
+        self.model = model
+        self._llm = llm
         self.df = None
+        # The data source, when set with set_source() instead of a dataframe
+        self.source = None
         self.df_info = None
         self.df_head = None
         self.sql_query = None
         self.execution_env = None
         self.chat_history = []
         self.agent_executor = None
+        # Tools and the key of the LLM and prompt the agent executor was built for
+        self._tools = None
+        self._agent_key = None
         self.generated_code = None
+        # The code that produced the current figure
+        self.figure_code = None
         self.system_prompt = system_prompt or DEFAULT_SYSTEM_PROMPT
         self.verbose = verbose
         self.max_iterations = max_iterations
         self.early_stopping_method = early_stopping_method
         self.handle_parsing_errors = handle_parsing_errors
+        self.execution_pool = execution_pool
+        self.figure_cache = figure_cache
+        self.prompt_token_budget = prompt_token_budget
+        self.preview_rows = preview_rows
+        self.preview_stratify_by = preview_stratify_by
+        self.figure_max_points = figure_max_points
+        self.history_token_budget = history_token_budget
+        self.history_recent_turns = history_recent_turns
+        self.metrics_callbacks = list(metrics_callbacks or [])
+        self.track_memory = track_memory
+        self.isolate_df = isolate_df
+        # Metrics of the last process_message call, and of the one in progress
+        self.last_metrics = None
+        self._metrics = None
+        # Results of the code executed during the process_message call in progress, by code hash
+        self._outcomes = None
+        # Called with progress events while a message is being streamed
+        self._event_sink = None
+
+    @property
+    def llm(self):
+        """The chat model, created on first use."""
+        if self._llm is None:
+            from langchain_openai import ChatOpenAI
+
+            self._llm = ChatOpenAI(model=self.model)
+        return self._llm
+
+    @llm.setter
+    def llm(self, llm):
+        self._llm = llm
 
     def set_df(self, df: pd.DataFrame, sql_query: Optional[str] = None):
         """
@@ -81,30 +242,103 @@ class PlotAgent:
             assert isinstance(sql_query, str), "The SQL query must be a string."
 
         self.df = df
+        self.source = None
 
-        # Capture df.info() output
-        buffer = StringIO()
-        df.info(buf=buffer)
-        self.df_info = buffer.getvalue()
-
-        # Capture df.head() as string representation
-        self.df_head = df.head().to_string()
+        # Capture a df.info()-like summary and a df.head()-like preview, within the token budget
+        self.df_info, self.df_head = profile_dataframe(df, token_budget=self.prompt_token_budget)
 
         # Store SQL query if provided
         self.sql_query = sql_query
 
-        # Initialize execution environment
-        self.execution_env = PlotAgentExecutionEnvironment(df)
+        self._initialize_environment(df)
+
+    def set_source(self, source, file_format: Optional[str] = None, sql_query: Optional[str] = None):
+        """
+        Set a data source, like a Parquet or Feather file, instead of a dataframe.
+
+        Only the source's metadata is read here. Generated code still sees the data as `df`,
+        but each execution reads just the columns its code uses.
+
+        Args:
+            source: A DataSource, or the path of a Parquet, Feather or Arrow IPC file.
+            file_format (Optional[str]): The format of the file, if it cannot be told from its name.
+            sql_query (Optional[str]): The SQL query used to generate the data.
+
+        Returns:
+            None
+        """
+        source = open_source(source, file_format=file_format)
+        assert len(source) > 0 and source.columns, "The data source must not be empty."
+
+        if sql_query:
+            assert isinstance(sql_query, str), "The SQL query must be a string."
+
+        self.df = None
+        self.source = source
+
+        # Profile from the metadata and the first rows, without reading the data
+        self.df_info, self.df_head = profile_source(source, token_budget=self.prompt_token_budget)
+
+        self.sql_query = sql_query
+
+        self._initialize_environment(source)
+
+    def set_sql(
+        self,
+        connection,
+        sql_query: str,
+        name: Optional[str] = None,
+        query_cache: Optional[QueryCache] = None,
+        statistics: bool = False,
+    ):
+        """
+        Set the result of a SQL query on a database as the data, instead of a dataframe.
+
+        Generated code still sees the data as `df`. Each execution queries just the columns
+        its code uses, or runs its aggregations in the database, and query results are cached.
+
+        Args:
+            connection: A DB-API connection, like a sqlite3 one, or a function that opens one.
+            sql_query (str): The SELECT query whose result is the data.
+            name (Optional[str]): Identifies the database in cache keys, like its URL.
+            query_cache (Optional[QueryCache]): A cache of query results to share, for example
+                between the sessions of a SessionManager.
+            statistics (bool): Describe the nulls and value range of each column to the LLM.
+                This scans every row of the query result.
+
+        Returns:
+            None
+        """
+        source = SqlSource(connection, sql_query, name=name, query_cache=query_cache, statistics=statistics)
+        self.set_source(source, sql_query=sql_query)
+
+    def _initialize_environment(self, data):
+        """Create the execution environment for a dataframe or data source, and the agent."""
+        # Initialize execution environment, on the worker pool if one was given
+        env_options = dict(
+            cache=self.figure_cache,
+            preview_rows=self.preview_rows,
+            preview_stratify_by=self.preview_stratify_by,
+            figure_max_points=self.figure_max_points,
+            track_memory=self.track_memory,
+            isolate_df=self.isolate_df,
+        )
+        if self.execution_pool is not None:
+            self.execution_env = PooledExecutionEnvironment(data, self.execution_pool, **env_options)
+        else:
+            self.execution_env = PlotAgentExecutionEnvironment(data, **env_options)
+        self.figure_code = None
 
         # Initialize the agent with tools
         self._initialize_agent()
 
-    def execute_plotly_code(self, generated_code: str) -> str:
+    def execute_plotly_code(self, generated_code: str, preview: bool = False) -> str:
         """
         Execute the provided Plotly code and return the result.
 
         Args:
             generated_code (str): The Plotly code to execute.
+            preview (bool): Run against the preview sample, if preview mode is on.
 
         Returns:
             str: The result of the execution.
@@ -117,8 +351,8 @@ class PlotAgent:
         # Store this as the last generated code
         self.generated_code = generated_code
 
-        # Execute the generated code
-        code_execution_result = self.execution_env.execute_code(generated_code)
+        # Execute the generated code, unless it already ran during this message
+        code_execution_result = self._execute_once(generated_code, preview=preview)
 
         # Extract the results from the code execution
         code_execution_success = code_execution_result.get("success", False)
@@ -131,6 +365,24 @@ class PlotAgent:
         else:
             return f"Error: {code_execution_error}\n{code_execution_output}"
 
+    async def aexecute_plotly_code(self, generated_code: str, preview: bool = False) -> str:
+        """
+        Async version of execute_plotly_code.
+
+        The sandboxed execution runs in the default executor so the event loop is never blocked.
+
+        Args:
+            generated_code (str): The Plotly code to execute.
+            preview (bool): Run against the preview sample, if preview mode is on.
+
+        Returns:
+            str: The result of the execution.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None, functools.partial(self.execute_plotly_code, generated_code, preview=preview)
+        )
+
     def does_fig_exist(self, *args, **kwargs) -> str:
         """
         Check if a figure object is available for display.
@@ -145,7 +397,7 @@ class PlotAgent:
         if not self.execution_env:
             return "No execution environment has been initialized. Please set a dataframe first."
 
-        if self.execution_env.fig is not None:
+        if self.execution_env.fig is not None or self.execution_env.accepted_code is not None:
             return "A figure is available for display."
         else:
             return "No figure has been created yet."
@@ -156,13 +408,21 @@ class PlotAgent:
         """
         return self.generated_code
 
-    def _initialize_agent(self):
-        """Initialize the LangChain agent with the necessary tools and prompt."""
+    def _build_tools(self) -> list:
+        """Build the tools the agent can call, bound to this PlotAgent."""
+        from langchain_core.tools import Tool, StructuredTool
 
-        # Initialize the tools
-        tools = [
+        from plot_agent.models import (
+            GeneratedCodeInput,
+            DoesFigExistInput,
+            ViewGeneratedCodeInput,
+        )
+
+        # Code the agent tries out runs on the preview sample, if there is one
+        return [
             Tool.from_function(
-                func=self.execute_plotly_code,
+                func=functools.partial(self.execute_plotly_code, preview=True),
+                coroutine=functools.partial(self.aexecute_plotly_code, preview=True),
                 name="execute_plotly_code",
                 description=(
                     "Execute the provided Plotly code and return a result indicating "
@@ -191,39 +451,162 @@ class PlotAgent:
             ),
         ]
 
-        # Create system prompt with dataframe information
-        sql_context = ""
-        if self.sql_query:
-            sql_context = f"In case it is useful to help with the data understanding, the df was generated using the following SQL query:\n```sql\n{self.sql_query}\n```"
+    def _initialize_agent(self):
+        """
+        Initialize the LangChain agent with the necessary tools and prompt.
 
-        prompt = ChatPromptTemplate.from_messages(
-            [
-                (
-                    "system",
-                    self.system_prompt.format(
-                        df_info=self.df_info,
-                        df_head=self.df_head,
-                        sql_context=sql_context,
-                    ),
-                ),
-                MessagesPlaceholder(variable_name="chat_history"),
-                ("human", "{input}"),
-                MessagesPlaceholder(variable_name="agent_scratchpad"),
-            ]
-        )
+        The dataframe description is bound when the agent is invoked, not baked into the
+        prompt, so the agent only needs rebuilding if the LLM or system prompt change.
+        Swapping in a new dataframe just rebinds the data.
+        """
+        from langchain.agents import AgentExecutor
+
+        key = (self.system_prompt, id(self.llm))
+        if self.agent_executor is not None and self._agent_key == key:
+            return
+
+        # The tools look up the current execution environment when called, so they are built once
+        if self._tools is None:
+            self._tools = self._build_tools()
 
-        agent = create_openai_tools_agent(self.llm, tools, prompt)
         self.agent_executor = AgentExecutor(
-            agent=agent,
-            tools=tools,
+            agent=_prepared_agent(self.llm, self._tools, self.system_prompt),
+            tools=self._tools,
             verbose=self.verbose,
             max_iterations=self.max_iterations,
             early_stopping_method=self.early_stopping_method,
             handle_parsing_errors=self.handle_parsing_errors,
         )
+        self._agent_key = key
+
+    def _agent_inputs(self, user_message: str, latest_code: Optional[str] = None) -> dict:
+        """Build the inputs the agent is invoked with, including the dataframe description."""
+        # Keep the history within its token budget, if there is one
+        chat_history = self.chat_history
+        if self.history_token_budget is not None:
+            chat_history = compact_history(
+                self.chat_history,
+                self.history_token_budget,
+                recent_turns=self.history_recent_turns,
+                latest_code=latest_code,
+            )
+
+        sql_context = ""
+        if self.sql_query:
+            sql_context = f"In case it is useful to help with the data understanding, the df was generated using the following SQL query:\n```sql\n{self.sql_query}\n```"
+
+        return {
+            "input": user_message,
+            "chat_history": chat_history,
+            "df_info": self.df_info,
+            "df_head": self.df_head,
+            "sql_context": sql_context,
+        }
+
+    def _run_fallback_executions(self, output: str):
+        """
+        Execute code directly if the agent produced code but no figure.
+
+        Args:
+            output (str): The agent's final response.
+        """
+        # Render the code the agent settled on in preview mode on the full dataframe
+        accepted_code, self.execution_env.accepted_code = self.execution_env.accepted_code, None
+        if accepted_code is not None and self._execute_once(accepted_code)["success"]:
+            # The figure comes from the accepted code, even if the agent tried more code after it
+            self.generated_code = accepted_code
+
+        # If the agent didn't execute the code, but did generate code, execute it directly.
+        # Code whose outcome is already known is not run again
+        if self.execution_env.fig is None and self.generated_code is not None:
+            self._execute_once(self.generated_code)
+
+        # If we can extract code from the response when no code was executed, try that too
+        if self.execution_env.fig is None and "```python" in output:
+            code_blocks = output.split("```python")
+            if len(code_blocks) > 1:
+                generated_code = code_blocks[1].split("```")[0].strip()
+                self._execute_once(generated_code)
+
+        # Report which code produced the figure
+        self.figure_code = self.execution_env.fig_code if self.execution_env.fig is not None else None
+        if self._metrics is not None and self.figure_code is not None:
+            self._metrics.figure_code_hash = code_hash(self.figure_code)
+
+    def _execute_once(self, generated_code: str, preview: bool = False) -> dict:
+        """
+        Execute code, unless its outcome is already known from earlier in the same message.
+
+        Code that failed is never run again. Code that succeeded is only run again if
+        other code has replaced its figure since.
+
+        Args:
+            generated_code (str): The code to execute.
+            preview (bool): Run against the preview sample, if preview mode is on.
+
+        Returns:
+            dict: The execution result.
+        """
+        if self._outcomes is None:
+            # Not processing a message, so there is nothing to reuse
+            result = self.execution_env.execute_code(generated_code, preview=preview)
+            self._record_execution(result)
+            return result
+
+        key = code_hash(generated_code)
+        known = self._outcomes.get(key)
+        if known is not None and (not known["success"] or self._is_current(key, preview)):
+            if self._metrics is not None:
+                self._metrics.record_skipped_execution()
+            return known
+
+        result = self.execution_env.execute_code(generated_code, preview=preview)
+        result.setdefault("metrics", {})["code_hash"] = key
+        self._record_execution(result)
+        # A cancellation says nothing about the code itself
+        if result["error"] != CANCELLED_ERROR:
+            self._outcomes[key] = result
+        # Show the figure as soon as there is one, when streaming
+        if result["success"] and self._event_sink is not None:
+            self._event_sink(figure_event(result["fig"], generated_code, preview=result["metrics"]["preview"]))
+        return result
+
+    def _is_current(self, key: str, preview: bool) -> bool:
+        """Check if the current figure, or the accepted preview, came from the code with this hash."""
+        env = self.execution_env
+        if env.fig is not None and env.fig_code is not None and code_hash(env.fig_code) == key:
+            return True
+        return preview and env.accepted_code is not None and code_hash(env.accepted_code) == key
+
+    def _record_execution(self, result: Optional[dict]):
+        """Add the metrics of an execution to those of the process_message call in progress."""
+        if result is not None and self._metrics is not None:
+            self._metrics.record_execution(result.get("metrics", {}))
+
+    def _publish_metrics(self, metrics: MessageMetrics, error: Optional[BaseException] = None):
+        """Finish the metrics of a process_message call and pass them to the callbacks."""
+        metrics.finish(error)
+        self._metrics = None
+        self._outcomes = None
+        self.last_metrics = metrics.to_dict()
+        for callback in self.metrics_callbacks:
+            try:
+                callback(self.last_metrics)
+            except Exception as e:
+                # A broken exporter must not break the request
+                warnings.warn(f"Metrics callback {callback!r} failed: {e!r}")
+
+    def _run_config(self, metrics: MessageMetrics) -> dict:
+        """Build the run config of the agent executor, with the callbacks of the message in progress."""
+        callbacks = [metrics.callback_handler()]
+        if self._event_sink is not None:
+            callbacks.append(streaming_callback_handler(self._event_sink))
+        return {"callbacks": callbacks}
 
     def process_message(self, user_message: str) -> str:
         """Process a user message and return the agent's response."""
+        from langchain_core.messages import AIMessage, HumanMessage
+
         assert isinstance(user_message, str), "The user message must be a string."
 
         if not self.agent_executor:
@@ -232,37 +615,309 @@ class PlotAgent:
         # Add user message to chat history
         self.chat_history.append(HumanMessage(content=user_message))
 
-        # Reset generated_code
-        self.generated_code = None
+        # Reset generated_code and any code accepted in preview mode. The history keeps the code
+        # that built the current figure, not the last code tried, which may have failed
+        latest_code, self.generated_code = self.figure_code, None
+        self.execution_env.accepted_code = None
+
+        # Track the outcome of every execution, so no code is run twice
+        self._outcomes = {}
+
+        # Time each stage, and record LLM calls through a callback
+        metrics = self._metrics = MessageMetrics()
+        config = self._run_config(metrics)
+        try:
+            # Get response from agent
+            with metrics.stage("agent"):
+                response = self.agent_executor.invoke(
+                    self._agent_inputs(user_message, latest_code), config=config
+                )
+
+            # Add agent response to chat history
+            self.chat_history.append(AIMessage(content=response["output"]))
+
+            # Make sure a figure exists if the agent produced any code
+            with metrics.stage("fallback"):
+                self._run_fallback_executions(response["output"])
+        except BaseException as e:
+            self._publish_metrics(metrics, e)
+            raise
+        self._publish_metrics(metrics)
 
-        # Get response from agent
-        response = self.agent_executor.invoke(
-            {"input": user_message, "chat_history": self.chat_history}
-        )
+        # Return the agent's response
+        return response["output"]
 
-        # Add agent response to chat history
-        self.chat_history.append(AIMessage(content=response["output"]))
+    async def aprocess_message(self, user_message: str) -> str:
+        """
+        Async version of process_message.
 
-        # If the agent didn't execute the code, but did generate code, execute it directly
-        if self.execution_env.fig is None and self.generated_code is not None:
-            self.execution_env.execute_code(self.generated_code)
+        LLM calls are awaited and sandboxed executions run in the default executor,
+        so many sessions can be served concurrently from one event loop.
+        """
+        from langchain_core.messages import AIMessage, HumanMessage
 
-        # If we can extract code from the response when no code was executed, try that too
-        if self.execution_env.fig is None and "```python" in response["output"]:
-            code_blocks = response["output"].split("```python")
-            if len(code_blocks) > 1:
-                generated_code = code_blocks[1].split("```")[0].strip()
-                self.execution_env.execute_code(generated_code)
+        assert isinstance(user_message, str), "The user message must be a string."
+
+        if not self.agent_executor:
+            return "Please set a dataframe first using set_df() method."
+
+        # Add user message to chat history
+        self.chat_history.append(HumanMessage(content=user_message))
+
+        # Reset generated_code and any code accepted in preview mode. The history keeps the code
+        # that built the current figure, not the last code tried, which may have failed
+        latest_code, self.generated_code = self.figure_code, None
+        self.execution_env.accepted_code = None
+
+        # Track the outcome of every execution, so no code is run twice
+        self._outcomes = {}
+
+        # Time each stage, and record LLM calls through a callback
+        metrics = self._metrics = MessageMetrics()
+        config = self._run_config(metrics)
+        try:
+            # Get response from agent
+            with metrics.stage("agent"):
+                response = await self.agent_executor.ainvoke(
+                    self._agent_inputs(user_message, latest_code), config=config
+                )
+
+            # Add agent response to chat history
+            self.chat_history.append(AIMessage(content=response["output"]))
+
+            # Make sure a figure exists if the agent produced any code, off the event loop
+            with metrics.stage("fallback"):
+                loop = asyncio.get_running_loop()
+                await loop.run_in_executor(None, self._run_fallback_executions, response["output"])
+        except BaseException as e:
+            self._publish_metrics(metrics, e)
+            raise
+        self._publish_metrics(metrics)
 
         # Return the agent's response
         return response["output"]
 
+    def stream_message(self, user_message: str) -> Iterator[dict]:
+        """
+        Process a user message like process_message, yielding progress events as they happen.
+
+        LLM tokens, tool calls and figures are yielded while the agent is still working, and
+        a figure event as soon as code first produces a figure. See plot_agent.streaming for
+        the events. If the generator is closed early, the message is still processed to the end
+        in the background.
+
+        Args:
+            user_message (str): The user message.
+
+        Yields:
+            dict: Progress events, ending with a "response" event with the agent's response.
+        """
+        events = queue.Queue()
+        done = object()
+        outcome = {}
+
+        def run():
+            try:
+                outcome["output"] = self.process_message(user_message)
+            except BaseException as e:
+                outcome["error"] = e
+            finally:
+                self._event_sink = None
+                events.put(done)
+
+        self._event_sink = events.put
+        threading.Thread(target=run, name="plot-agent-stream", daemon=True).start()
+        while True:
+            event = events.get()
+            if event is done:
+                break
+            yield event
+
+        if "error" in outcome:
+            raise outcome["error"]
+        yield {"type": "response", "output": outcome["output"]}
+
+    async def astream_message(self, user_message: str) -> AsyncIterator[dict]:
+        """
+        Async version of stream_message. If the generator is closed early, the message is cancelled.
+
+        Args:
+            user_message (str): The user message.
+
+        Yields:
+            dict: Progress events, ending with a "response" event with the agent's response.
+        """
+        loop = asyncio.get_running_loop()
+        events = asyncio.Queue()
+        done = object()
+
+        # Tools run on executor threads, so events are handed over to the event loop
+        self._event_sink = lambda event: loop.call_soon_threadsafe(events.put_nowait, event)
+        task = asyncio.ensure_future(self.aprocess_message(user_message))
+        # Scheduled after any event sent before the task finished
+        task.add_done_callback(lambda _: events.put_nowait(done))
+        try:
+            while True:
+                event = await events.get()
+                if event is done:
+                    break
+                yield event
+            yield {"type": "response", "output": task.result()}
+        finally:
+            task.cancel()
+            self._event_sink = None
+
+    def _spawn(self) -> "PlotAgent":
+        """Create an agent with the same configuration, sharing the LLM client, pool and cache."""
+        agent = PlotAgent(
+            model=self.model,
+            system_prompt=self.system_prompt,
+            verbose=self.verbose,
+            max_iterations=self.max_iterations,
+            early_stopping_method=self.early_stopping_method,
+            handle_parsing_errors=self.handle_parsing_errors,
+            execution_pool=self.execution_pool,
+            figure_cache=self.figure_cache,
+            prompt_token_budget=self.prompt_token_budget,
+            preview_rows=self.preview_rows,
+            preview_stratify_by=self.preview_stratify_by,
+            figure_max_points=self.figure_max_points,
+            history_token_budget=self.history_token_budget,
+            history_recent_turns=self.history_recent_turns,
+            metrics_callbacks=self.metrics_callbacks,
+            track_memory=self.track_memory,
+            isolate_df=self.isolate_df,
+        )
+        agent.llm = self.llm
+        return agent
+
+    def _run_job(self, index: int, job) -> dict:
+        """Run a single batch job on a fresh agent, capturing any error in the result."""
+        try:
+            df, message, sql_query = _unpack_job(job)
+            agent = self._spawn()
+            agent.set_df(df, sql_query=sql_query)
+            response = agent.process_message(message)
+        except Exception as e:
+            return _job_result(index, error=f"{type(e).__name__}: {e}")
+        return _job_result(index, agent, response)
+
+    def process_batch(self, jobs: Iterable, max_concurrency: int = 8) -> Iterator[dict]:
+        """
+        Process many (dataframe, message) jobs concurrently, yielding results as they finish.
+
+        Each job runs on its own agent with this agent's configuration, so jobs do not share
+        chat history. They do share the LLM client, the execution pool and the figure cache.
+        Jobs are only pulled from `jobs` as capacity frees up, so it can be a lazy generator.
+
+        Args:
+            jobs (Iterable): Jobs as (df, message) or (df, message, sql_query) tuples,
+                or dicts with "df", "message" and optionally "sql_query" keys.
+            max_concurrency (int): Maximum number of jobs in flight at once.
+
+        Yields:
+            dict: One result per job, in completion order, with:
+              - index: The position of the job in `jobs`
+              - response: The agent's response, if it got that far
+              - fig: The figure if created, else None
+              - generated_code: The code that produced the figure, or the last code tried
+              - metrics: The metrics of the job, as in last_metrics
+              - error: The error, if the job failed
+              - success: True if a figure was produced
+        """
+        assert max_concurrency > 0, "max_concurrency must be positive."
+
+        jobs = enumerate(jobs)
+        executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="plot-agent-batch")
+        in_flight = set()
+        try:
+            while True:
+                # Top up to the concurrency limit
+                for index, job in jobs:
+                    in_flight.add(executor.submit(self._run_job, index, job))
+                    if len(in_flight) >= max_concurrency:
+                        break
+                if not in_flight:
+                    return
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        finally:
+            # Stop early if the caller stops consuming results
+            for future in in_flight:
+                future.cancel()
+            executor.shutdown(wait=True)
+
+    async def _arun_job(self, index: int, job) -> dict:
+        """Async version of _run_job."""
+        try:
+            df, message, sql_query = _unpack_job(job)
+            agent = self._spawn()
+            # Profiling the dataframe can take a moment, so keep it off the event loop
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, functools.partial(agent.set_df, df, sql_query=sql_query))
+            response = await agent.aprocess_message(message)
+        except Exception as e:
+            return _job_result(index, error=f"{type(e).__name__}: {e}")
+        return _job_result(index, agent, response)
+
+    async def aprocess_batch(self, jobs: Iterable, max_concurrency: int = 8) -> AsyncIterator[dict]:
+        """
+        Async version of process_batch.
+
+        LLM calls are awaited, so up to `max_concurrency` jobs wait on the network at once
+        without a thread each.
+        """
+        assert max_concurrency > 0, "max_concurrency must be positive."
+
+        jobs = enumerate(jobs)
+        in_flight = set()
+        try:
+            while True:
+                # Top up to the concurrency limit
+                for index, job in jobs:
+                    in_flight.add(asyncio.ensure_future(self._arun_job(index, job)))
+                    if len(in_flight) >= max_concurrency:
+                        break
+                if not in_flight:
+                    return
+                done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+        finally:
+            for task in in_flight:
+                task.cancel()
+
     def get_figure(self):
         """Return the current figure if one exists."""
         if self.execution_env and self.execution_env.fig:
             return self.execution_env.fig
         return None
 
+    def export_figure(self, target=None, float32: bool = False):
+        """
+        Export the current figure as compact JSON, with numeric arrays as base64 typed arrays.
+
+        Matplotlib figures are exported as PNG images instead.
+
+        Args:
+            target: If given, a path, binary file-like object or socket to stream the export to.
+            float32 (bool): Write float64 arrays as float32, trading precision for size.
+
+        Returns:
+            The JSON (or PNG) as bytes, or the number of bytes written if `target` was given.
+            None if no figure exists.
+        """
+        fig = self.get_figure()
+        if fig is None:
+            return None
+        if is_matplotlib_figure(fig):
+            png = figure_to_png(fig)
+            return png if target is None else write_bytes(png, target)
+        if target is None:
+            return figure_to_json(fig, float32=float32)
+        return write_figure(fig, target, float32=float32)
+
     def reset_conversation(self):
         """Reset the conversation history."""
         self.chat_history = []
@@ -0,0 +1,300 @@
+"""
+This module contains the aggregation helpers offered to generated code in the sandbox.
+
+Plotting raw rows makes Plotly do slow per-row work and embeds every row in the
+figure. These helpers aggregate with vectorized NumPy and pandas operations first,
+and return small dataframes ready to plot:
+  • bin_histogram: counts (or sums) per bin of a numeric or datetime column
+  • density_grid: counts per cell of a 2-D grid, for heatmaps instead of dense scatters
+  • resample_timeseries: values aggregated per time bucket, sized to a number of points
+  • top_k_groups: the k largest groups by an aggregate, with the rest lumped together
+  • aggregate: an aggregate per group
+
+Given a data source instead of a dataframe, bin_histogram, top_k_groups and aggregate
+run in the source, which for SQL sources means in the database, as SQL.
+"""
+from typing import List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from plot_agent.sources import DataSource
+
+
+# Bucket sizes resample_timeseries picks from, smallest first, with their approximate length
+_FREQUENCIES = [
+    ("1s", pd.Timedelta(seconds=1)),
+    ("10s", pd.Timedelta(seconds=10)),
+    ("1min", pd.Timedelta(minutes=1)),
+    ("5min", pd.Timedelta(minutes=5)),
+    ("15min", pd.Timedelta(minutes=15)),
+    ("1h", pd.Timedelta(hours=1)),
+    ("6h", pd.Timedelta(hours=6)),
+    ("1D", pd.Timedelta(days=1)),
+    ("7D", pd.Timedelta(days=7)),
+    ("MS", pd.Timedelta(days=30)),
+    ("QS", pd.Timedelta(days=91)),
+    ("YS", pd.Timedelta(days=365)),
+]
+
+
+def _column(df: pd.DataFrame, column: str) -> np.ndarray:
+    """Return the values of a column as a NumPy array, with datetimes as datetime64[ns]."""
+    assert column in df.columns, f"Column {column!r} is not in the dataframe."
+    values = df[column]
+    if isinstance(values.dtype, pd.DatetimeTZDtype):
+        # Bin in UTC, which is what the underlying timestamps are
+        values = values.dt.tz_convert(None)
+    if values.dtype.kind == "M":
+        return values.to_numpy(dtype="datetime64[ns]")
+    assert pd.api.types.is_numeric_dtype(values), f"Column {column!r} must be numeric or datetime."
+    return values.to_numpy(dtype=float, na_value=np.nan)
+
+
+def _as_numbers(values: np.ndarray) -> np.ndarray:
+    """View datetimes as float nanoseconds, with NaN for missing ones, so they can be binned."""
+    if values.dtype.kind == "M":
+        numbers = values.view("int64").astype(float)
+        numbers[np.isnat(values)] = np.nan
+        return numbers
+    return values
+
+
+def _as_original(edges: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """Convert bin edges back to datetimes if the binned values were datetimes."""
+    if values.dtype.kind == "M":
+        return edges.astype("int64").astype("datetime64[ns]")
+    return edges
+
+
+def bin_histogram(
+    df: pd.DataFrame,
+    column: str,
+    bins: int = 50,
+    range: Optional[Tuple[float, float]] = None,
+    weights: Optional[str] = None,
+) -> pd.DataFrame:
+    """
+    Count the rows per bin of a numeric or datetime column.
+
+    Plot with px.bar(result, x="bin_center", y="count"), instead of px.histogram on raw rows.
+
+    Args:
+        df (pd.DataFrame): The dataframe.
+        column (str): The column to bin. Missing values are left out.
+        bins (int): The number of equal-width bins.
+        range (Optional[Tuple[float, float]]): The lowest and highest values binned.
+            Defaults to the range of the column.
+        weights (Optional[str]): A numeric column to sum per bin instead of counting rows.
+
+    Returns:
+        pd.DataFrame: One row per bin, with bin_start, bin_end, bin_center and count.
+    """
+    assert bins > 0, "bins must be positive."
+    if isinstance(df, DataSource):
+        return df.bin_histogram(column, bins=bins, range=range, weights=weights)
+    values = _column(df, column)
+    numbers = _as_numbers(values)
+    keep = ~np.isnan(numbers)
+    weight_values = _column(df, weights)[keep] if weights is not None else None
+    if range is not None and values.dtype.kind == "M":
+        range = tuple(float(pd.Timestamp(bound).value) for bound in range)
+    counts, edges = np.histogram(numbers[keep], bins=bins, range=range, weights=weight_values)
+
+    edges = _as_original(edges, values)
+    return pd.DataFrame(
+        {
+            "bin_start": edges[:-1],
+            "bin_end": edges[1:],
+            "bin_center": edges[:-1] + (edges[1:] - edges[:-1]) / 2,
+            "count": counts,
+        }
+    )
+
+
+def density_grid(
+    df: pd.DataFrame,
+    x: str,
+    y: str,
+    bins: Union[int, Tuple[int, int]] = 100,
+    weights: Optional[str] = None,
+) -> pd.DataFrame:
+    """
+    Count the rows per cell of a 2-D grid over two numeric or datetime columns.
+
+    Plot with px.imshow(result, origin="lower", aspect="auto"), or
+    go.Heatmap(z=result.values, x=result.columns, y=result.index), instead of a dense scatter.
+
+    Args:
+        df (pd.DataFrame): The dataframe.
+        x (str): The column along the grid's columns.
+        y (str): The column along the grid's rows.
+        bins (Union[int, Tuple[int, int]]): The number of bins along both axes, or along x and y.
+        weights (Optional[str]): A numeric column to sum per cell instead of counting rows.
+
+    Returns:
+        pd.DataFrame: The grid, indexed by the bin centers of y, with the bin centers of x as columns.
+    """
+    x_values, y_values = _column(df, x), _column(df, y)
+    x_numbers, y_numbers = _as_numbers(x_values), _as_numbers(y_values)
+    keep = ~(np.isnan(x_numbers) | np.isnan(y_numbers))
+    weight_values = _column(df, weights)[keep] if weights is not None else None
+    counts, x_edges, y_edges = np.histogram2d(
+        x_numbers[keep], y_numbers[keep], bins=bins, weights=weight_values
+    )
+
+    x_edges, y_edges = _as_original(x_edges, x_values), _as_original(y_edges, y_values)
+    # histogram2d puts x along the first axis, and grids are read with y along the rows
+    return pd.DataFrame(
+        counts.T,
+        index=pd.Index(y_edges[:-1] + (y_edges[1:] - y_edges[:-1]) / 2, name=y),
+        columns=pd.Index(x_edges[:-1] + (x_edges[1:] - x_edges[:-1]) / 2, name=x),
+    )
+
+
+def _pick_frequency(times: pd.Series, max_points: int) -> str:
+    """Pick the smallest bucket size that gives at most `max_points` buckets."""
+    span = times.max() - times.min()
+    if pd.isna(span):
+        return _FREQUENCIES[0][0]
+    for freq, length in _FREQUENCIES:
+        if span / length < max_points:
+            return freq
+    return _FREQUENCIES[-1][0]
+
+
+def resample_timeseries(
+    df: pd.DataFrame,
+    time: str,
+    values: Optional[Union[str, List[str]]] = None,
+    freq: Optional[str] = None,
+    agg: str = "mean",
+    by: Optional[str] = None,
+    max_points: int = 1000,
+) -> pd.DataFrame:
+    """
+    Aggregate values per time bucket, per group if `by` is given.
+
+    Plot with px.line(result, x=time, y=values, color=by), instead of px.line on raw rows.
+
+    Args:
+        df (pd.DataFrame): The dataframe.
+        time (str): The datetime column (or one that pd.to_datetime can parse).
+        values (Optional[Union[str, List[str]]]): The column(s) to aggregate. Defaults to
+            every numeric column.
+        freq (Optional[str]): The bucket size, as a pandas frequency like "1h" or "1D".
+            Defaults to the smallest common one that gives at most max_points buckets.
+        agg (str): The aggregation, like "mean", "sum", "min", "max", "median" or "count".
+        by (Optional[str]): A column whose groups are resampled separately.
+        max_points (int): The most buckets to create per group when freq is not given.
+
+    Returns:
+        pd.DataFrame: One row per bucket (and group), with the bucket start in the time column.
+    """
+    assert max_points > 0, "max_points must be positive."
+    assert time in df.columns, f"Column {time!r} is not in the dataframe."
+    if df[time].dtype.kind != "M":
+        df = df.assign(**{time: pd.to_datetime(df[time])})
+    if values is None:
+        values = [
+            column
+            for column in df.select_dtypes("number").columns
+            if column not in (time, by)
+        ]
+    freq = freq or _pick_frequency(df[time], max_points)
+
+    keys = [pd.Grouper(key=time, freq=freq)]
+    if by is not None:
+        keys.insert(0, by)
+    return df.groupby(keys, observed=True)[values].agg(agg).reset_index()
+
+
+def top_k_groups(
+    df: pd.DataFrame,
+    by: str,
+    value: Optional[str] = None,
+    k: int = 10,
+    agg: str = "sum",
+    other: Optional[str] = "Other",
+) -> pd.DataFrame:
+    """
+    Aggregate a column per group, keeping the k largest groups.
+
+    Plot with px.bar(result, x=by, y=value or "count"), instead of a bar per raw row or
+    hundreds of tiny bars.
+
+    Args:
+        df (pd.DataFrame): The dataframe.
+        by (str): The column to group by.
+        value (Optional[str]): The column to aggregate. Defaults to counting rows.
+        k (int): The number of groups to keep.
+        agg (str): The aggregation, like "sum", "mean", "median", "min" or "max".
+        other (Optional[str]): The label of a final row aggregating every other group,
+            or None to leave them out.
+
+    Returns:
+        pd.DataFrame: The groups, largest first, with the group in `by` and the aggregate in
+        `value`, or in "count" when counting rows.
+    """
+    assert k > 0, "k must be positive."
+    if isinstance(df, DataSource):
+        return df.top_k_groups(by, value=value, k=k, agg=agg, other=other)
+    assert by in df.columns, f"Column {by!r} is not in the dataframe."
+    grouped = df.groupby(by, observed=True, sort=False)
+    if value is None:
+        name, totals = "count", grouped.size()
+    else:
+        name, totals = value, grouped[value].agg(agg)
+    totals = totals.sort_values(ascending=False)
+    result = totals.iloc[:k].rename(name).reset_index()
+
+    if other is not None and len(totals) > k:
+        if value is None or agg in ("sum", "count"):
+            rest = totals.iloc[k:].sum()
+        else:
+            # Other aggregates are not additive, so aggregate the remaining rows together
+            rest = df.loc[~df[by].isin(totals.index[:k]), value].agg(agg)
+        # Object dtype, so the label fits whatever the type of the groups
+        result[by] = result[by].astype(object)
+        result.loc[len(result)] = {by: other, name: rest}
+    return result
+
+
+def aggregate(
+    df: pd.DataFrame,
+    by: Union[str, List[str]],
+    values: Optional[Union[str, List[str]]] = None,
+    agg: str = "sum",
+) -> pd.DataFrame:
+    """
+    Aggregate columns per group.
+
+    Plot with px.bar(result, x=by, y=values), instead of a bar per raw row.
+
+    Args:
+        df (pd.DataFrame): The dataframe.
+        by (Union[str, List[str]]): The column(s) to group by. Rows missing them are left out.
+        values (Optional[Union[str, List[str]]]): The column(s) to aggregate. Defaults to
+            counting rows.
+        agg (str): The aggregation, like "sum", "mean", "min", "max" or "count".
+
+    Returns:
+        pd.DataFrame: One row per group, in order of the groups, with the groups in `by` and
+        the aggregates in `values`, or in "count" when counting rows.
+    """
+    if isinstance(df, DataSource):
+        return df.aggregate(by, values=values, agg=agg)
+    grouped = df.groupby(by, observed=True)
+    if values is None:
+        return grouped.size().reset_index(name="count")
+    return grouped[values].agg(agg).reset_index()
+
+
+# The helpers available to generated code, by name
+HELPERS = {
+    "bin_histogram": bin_histogram,
+    "density_grid": density_grid,
+    "resample_timeseries": resample_timeseries,
+    "top_k_groups": top_k_groups,
+    "aggregate": aggregate,
+}
@@ -0,0 +1,246 @@
+"""
+This module contains the FigureCache class, a content-addressed cache of figures produced by LLM‑generated plotting code.
+
+Cache keys combine:
+  • A hash of the normalized code, so comments and formatting do not matter
+  • A fingerprint of the dataframe the code runs against
+
+Entries are bounded by count and total size with LRU eviction, and can
+optionally be persisted to a directory so they survive restarts.
+"""
+import ast
+import hashlib
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import pandas as pd
+
+
+def normalize_code(code: str) -> str:
+    """
+    Normalize code so that comments and formatting do not change its hash.
+
+    Args:
+        code (str): The code to normalize.
+
+    Returns:
+        str: The normalized code, or the stripped code if it does not parse.
+    """
+    try:
+        return ast.dump(ast.parse(code))
+    except (SyntaxError, ValueError):
+        return code.strip()
+
+
+def code_hash(code: str) -> str:
+    """
+    Hash code after normalizing it.
+
+    Args:
+        code (str): The code to hash.
+
+    Returns:
+        str: A hex digest identifying the code.
+    """
+    return hashlib.sha256(normalize_code(code).encode("utf-8")).hexdigest()
+
+
+def dataframe_fingerprint(df: pd.DataFrame) -> str:
+    """
+    Fingerprint a dataframe's schema and contents.
+
+    Args:
+        df (pd.DataFrame): The dataframe to fingerprint.
+
+    Returns:
+        str: A hex digest identifying the dataframe.
+    """
+    digest = hashlib.sha256()
+    digest.update(repr((list(map(str, df.columns)), list(map(str, df.dtypes)), df.shape)).encode("utf-8"))
+    try:
+        digest.update(pd.util.hash_pandas_object(df, index=True).values.tobytes())
+    except TypeError:
+        # Unhashable cell values such as lists or dicts
+        digest.update(pickle.dumps(df, protocol=pickle.HIGHEST_PROTOCOL))
+    return digest.hexdigest()
+
+
+class FigureCache:
+    """
+    A thread-safe LRU cache of figures keyed by code hash and dataframe fingerprint.
+
+    Figures are stored pickled, so every hit returns an independent copy that
+    callers are free to modify. If `directory` is given, entries are also
+    written there and reloaded on startup; only point it at a trusted
+    location, since entries are unpickled.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 128,
+        max_bytes: int = 256 * 1024 * 1024,
+        directory: Optional[str] = None,
+    ):
+        """
+        Initialize the cache.
+
+        Args:
+            max_entries (int): Maximum number of figures to keep.
+            max_bytes (int): Maximum total size of the pickled figures to keep.
+            directory (Optional[str]): Directory to persist entries to, if any.
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        # Cache key -> (size in bytes, pickled figure or None if only on disk)
+        self._entries = OrderedDict()
+        self._bytes = 0
+
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            self._load_index()
+
+    @staticmethod
+    def key(generated_code: str, fingerprint: str) -> str:
+        """
+        Build the cache key for some code run against a dataframe.
+
+        Args:
+            generated_code (str): The code that builds the figure.
+            fingerprint (str): The fingerprint of the dataframe the code runs against.
+
+        Returns:
+            str: The cache key.
+        """
+        return hashlib.sha256(f"{code_hash(generated_code)}:{fingerprint}".encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.pkl")
+
+    def _load_index(self):
+        """Register entries already persisted to the directory, oldest first."""
+        paths = [
+            os.path.join(self.directory, name)
+            for name in os.listdir(self.directory)
+            if name.endswith(".pkl")
+        ]
+        for path in sorted(paths, key=os.path.getmtime):
+            key = os.path.basename(path)[: -len(".pkl")]
+            size = os.path.getsize(path)
+            self._entries[key] = (size, None)
+            self._bytes += size
+        self._evict()
+
+    def _evict(self):
+        """Drop least recently used entries until the cache is within its bounds."""
+        while self._entries and (
+            len(self._entries) > self.max_entries or self._bytes > self.max_bytes
+        ):
+            key, (size, _) = self._entries.popitem(last=False)
+            self._bytes -= size
+            self.evictions += 1
+            if self.directory:
+                try:
+                    os.remove(self._path(key))
+                except OSError:
+                    pass
+
+    def get(self, key: str):
+        """
+        Look up a figure.
+
+        Args:
+            key (str): The cache key.
+
+        Returns:
+            The cached figure, or None on a miss.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            size, payload = entry
+            if payload is None:
+                # Persisted entry that has not been loaded yet
+                try:
+                    with open(self._path(key), "rb") as f:
+                        payload = f.read()
+                except OSError:
+                    del self._entries[key]
+                    self._bytes -= size
+                    self.misses += 1
+                    return None
+                self._entries[key] = (size, payload)
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return pickle.loads(payload)
+
+    def put(self, key: str, fig):
+        """
+        Store a figure.
+
+        Args:
+            key (str): The cache key.
+            fig: The figure to store.
+        """
+        try:
+            payload = pickle.dumps(fig, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            # Figures that cannot be pickled are simply not cached
+            return
+        if len(payload) > self.max_bytes:
+            return
+
+        if self.directory:
+            # Write atomically so readers never see a partial file
+            tmp_path = f"{self._path(key)}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(payload)
+            os.replace(tmp_path, self._path(key))
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[0]
+            self._entries[key] = (len(payload), payload)
+            self._bytes += len(payload)
+            self._evict()
+
+    def clear(self):
+        """Remove every entry, including persisted ones."""
+        with self._lock:
+            if self.directory:
+                for key in self._entries:
+                    try:
+                        os.remove(self._path(key))
+                    except OSError:
+                        pass
+            self._entries.clear()
+            self._bytes = 0
+
+    def cache_info(self) -> dict:
+        """
+        Report cache statistics.
+
+        Returns:
+            dict: Hits, misses, evictions, current entry count and size in bytes.
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+            }
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,163 @@
+"""
+This module contains helpers that keep figures produced by generated code small enough to serialize and render.
+
+optimize_figure() post-processes a Plotly figure in place:
+  • Scatter and line traces with more than `max_points` points are downsampled,
+    with Largest-Triangle-Three-Buckets (LTTB) when x is ordered so the shape of
+    the line is preserved, and with a random sample otherwise
+  • Large traces are switched to Scattergl, so the browser renders them with WebGL
+
+Every change is described in the returned list, so it can be reported back.
+"""
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+
+# Traces with more points than this are switched to WebGL
+WEBGL_THRESHOLD = 1000
+
+# Trace types that can be downsampled and switched to WebGL
+_SCATTER_TYPES = ("scatter", "scattergl")
+
+# Scatter attributes that Scattergl does not support
+_NON_WEBGL_ATTRIBUTES = ("stackgroup", "groupnorm", "stackgaps", "cliponaxis")
+
+
+def lttb(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """
+    Pick the points that best preserve the shape of a line, using Largest-Triangle-Three-Buckets.
+
+    Args:
+        x (np.ndarray): Numeric, ordered x values.
+        y (np.ndarray): Numeric y values.
+        n_out (int): The number of points to keep.
+
+    Returns:
+        np.ndarray: The sorted positions of the points to keep.
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    # The first and last points are always kept; the rest are split into n_out - 2 buckets
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    positions = np.empty(n_out, dtype=np.int64)
+    positions[0], positions[-1] = 0, n - 1
+
+    previous = 0
+    for bucket in range(n_out - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        # The average of the next bucket, or the last point for the last bucket
+        next_end = edges[bucket + 2] if bucket + 2 < len(edges) else n
+        next_x = x[end:next_end].mean()
+        next_y = np.nanmean(y[end:next_end]) if np.isfinite(y[end:next_end]).any() else 0.0
+
+        # Keep the point forming the largest triangle with the previous kept point and that average
+        area = np.abs(
+            (x[previous] - next_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (next_y - y[previous])
+        )
+        area = np.nan_to_num(area, nan=-1.0)
+        previous = start + int(np.argmax(area))
+        positions[bucket + 1] = previous
+
+    return positions
+
+
+def _numeric(values) -> np.ndarray:
+    """Convert trace values to floats, or return None if they are not numeric or dates."""
+    values = np.asarray(values)
+    if values.dtype.kind in "iufb":
+        return values.astype(float)
+    if values.dtype.kind == "M":
+        return values.astype("datetime64[ns]").astype(np.int64).astype(float)
+    try:
+        return pd.to_datetime(values, format="ISO8601").asi8.astype(float)
+    except (ValueError, TypeError):
+        return None
+
+
+def _take(props: dict, positions: np.ndarray, n: int) -> dict:
+    """Subset every per-point array in trace properties, including nested ones like marker.color."""
+    taken = {}
+    for name, value in props.items():
+        if isinstance(value, dict):
+            taken[name] = _take(value, positions, n)
+        elif isinstance(value, (list, tuple, np.ndarray)) and len(value) == n:
+            taken[name] = np.asarray(value)[positions]
+        else:
+            taken[name] = value
+    return taken
+
+
+def _decimate(props: dict, max_points: int, n: int):
+    """Downsample trace properties, returning them with the name of the algorithm used."""
+    x = _numeric(props["x"]) if props.get("x") is not None else np.arange(n, dtype=float)
+    y = _numeric(props["y"])
+
+    if x is not None and y is not None and np.all(np.diff(x) >= 0):
+        positions = lttb(x, y, max_points)
+        algorithm = "LTTB"
+    else:
+        positions = np.sort(np.random.default_rng(0).choice(n, max_points, replace=False))
+        algorithm = "random sampling"
+
+    if props.get("x") is None:
+        # Keep the implicit x positions of the kept points
+        props = dict(props, x=np.arange(n))
+    return _take(props, positions, n), algorithm
+
+
+def optimize_figure(
+    fig, max_points: int = 5000, webgl_threshold: int = WEBGL_THRESHOLD
+) -> List[str]:
+    """
+    Downsample oversized scatter and line traces and switch large ones to WebGL, in place.
+
+    Args:
+        fig: The figure to optimize. Anything other than a Plotly figure is left alone.
+        max_points (int): The maximum number of points to keep per trace.
+        webgl_threshold (int): Traces with more points than this are switched to Scattergl.
+
+    Returns:
+        List[str]: A description of every change made.
+    """
+    import plotly.graph_objects as go
+
+    if not isinstance(fig, go.Figure):
+        return []
+
+    changes = []
+    traces = []
+    for index, trace in enumerate(fig.data):
+        props = trace.to_plotly_json()
+        n = len(props["y"]) if props.get("y") is not None else 0
+        if trace.type not in _SCATTER_TYPES or n <= webgl_threshold:
+            traces.append(trace)
+            continue
+
+        label = f"trace {index}" + (f" ({trace.name!r})" if trace.name else "")
+        if n > max_points:
+            props, algorithm = _decimate(props, max_points, n)
+            changes.append(
+                f"{label}: downsampled from {n} to {len(props['y'])} points with {algorithm}"
+            )
+
+        props.pop("type", None)
+        if trace.type == "scatter" and not any(props.get(name) for name in _NON_WEBGL_ATTRIBUTES):
+            try:
+                trace = go.Scattergl(props)
+                changes.append(f"{label}: switched to Scattergl for WebGL rendering")
+            except ValueError:
+                # Uses Scatter features Scattergl does not support
+                trace = go.Scatter(props)
+        else:
+            trace = type(trace)(props)
+        traces.append(trace)
+
+    if changes:
+        fig.data = ()
+        fig.add_traces(traces)
+    return changes
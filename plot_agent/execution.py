@@ -6,25 +6,644 @@ Security features:
     matplotlib, plotly, sklearn)
   • AST scan rejects any import outside that list and any __dunder__ access
   • Sandbox builtins to include only a minimal safe set + our _safe_import
-  • Enforce a 60 second timeout via signal.alarm
+  • Enforce a 60 second timeout by running code on a sandbox thread (works from any thread)
+  • Give each execution its own copy-on-write view of the dataframe, so in-place
+    changes never leak into later executions
+  • Close the matplotlib figures each execution creates, so pyplot's registry never grows
+  • Hand code only the columns of df it uses, worked out from its AST, so executions
+    copy, transfer and read (from data sources) as little data as possible
 """
 import ast
 import builtins
-import signal
+import contextlib
+import ctypes
+import hashlib
+import importlib
+import sys
+import threading
 import traceback
+from collections import OrderedDict, deque
 from io import StringIO
-import contextlib
+from typing import List, NamedTuple, Optional, Union
 
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import plotly.express as px
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
+
+from plot_agent.aggregations import HELPERS
+from plot_agent.cache import dataframe_fingerprint
+from plot_agent.decimation import optimize_figure
+from plot_agent.instrumentation import timed, track_peak_memory, track_resident_memory
+from plot_agent.matplotlib_figures import as_matplotlib_figure, import_pyplot, track_figures
+from plot_agent.sampling import sample_dataframe, sample_source
+from plot_agent.sources import DataSource
+
+
+# Error reported when code runs cleanly but never assigns `fig`
+NO_FIG_ERROR = "No `fig` created. Assign your figure to a variable named `fig`."
+
+# Error reported when an execution is cancelled, the only outcome that says nothing about the code
+CANCELLED_ERROR = "Code execution was cancelled."
+
+
+def _copy_on_write_enabled() -> bool:
+    """Check if pandas copies data lazily on first write, so that shallow copies are isolated."""
+    if int(pd.__version__.split(".")[0]) >= 3:
+        return True
+    try:
+        return pd.get_option("mode.copy_on_write") is True
+    except KeyError:
+        # pandas < 1.5 has no copy-on-write
+        return False
+
+
+def _copy_on_write_available() -> bool:
+    """Check if pandas has copy-on-write, whether or not it is enabled."""
+    if _copy_on_write_enabled():
+        return True
+    try:
+        pd.get_option("mode.copy_on_write")
+    except KeyError:
+        return False
+    return True
+
+
+# Executions holding copy-on-write on, and the option's value before the first of them
+_COPY_ON_WRITE_LOCK = threading.Lock()
+_copy_on_write_runs = 0
+_copy_on_write_previous = None
+
+
+@contextlib.contextmanager
+def _copy_on_write():
+    """
+    Turn on copy-on-write while executions run, where pandas has it but it is off.
+
+    pandas options are global, so the option is set back only once every execution holding it
+    is done, and not at all if something else turned it on.
+    """
+    global _copy_on_write_runs, _copy_on_write_previous
+    with _COPY_ON_WRITE_LOCK:
+        held = _copy_on_write_runs > 0 or (not _copy_on_write_enabled() and _copy_on_write_available())
+        if held:
+            if not _copy_on_write_runs:
+                _copy_on_write_previous = pd.get_option("mode.copy_on_write")
+                pd.set_option("mode.copy_on_write", True)
+            _copy_on_write_runs += 1
+    try:
+        yield
+    finally:
+        if held:
+            with _COPY_ON_WRITE_LOCK:
+                _copy_on_write_runs -= 1
+                if not _copy_on_write_runs:
+                    pd.set_option("mode.copy_on_write", _copy_on_write_previous)
+
+
+def _isolated_df(df: pd.DataFrame) -> pd.DataFrame:
+    """Return a copy of df that code can modify without affecting df."""
+    if _copy_on_write_enabled():
+        # Shares data with df until the code writes to it, then only the written columns are copied
+        return df.copy(deep=False)
+    return df.copy(deep=True)
+
+
+# The array pandas wraps NumPy-backed columns in, called PandasArray before pandas 2.1
+_NUMPY_ARRAY = getattr(pd.arrays, "NumpyExtensionArray", None) or pd.arrays.PandasArray
+
+
+def _column_data(df: pd.DataFrame) -> list:
+    """
+    Return the data of each column: a NumPy view of it, or the column's own extension array.
+
+    Views share memory with the column, and keep it alive, so columns can be compared to them by address.
+    """
+    data = []
+    for _, column in df.items():
+        values = column.array
+        data.append(np.asarray(values) if isinstance(values, _NUMPY_ARRAY) else values)
+    return data
+
+
+def _same_data(old, new) -> bool:
+    """Check if column data taken before and after are the same data, not replaced."""
+    if isinstance(old, np.ndarray) and isinstance(new, np.ndarray):
+        return (
+            old.__array_interface__["data"][0] == new.__array_interface__["data"][0]
+            and old.shape == new.shape
+            and old.strides == new.strides
+            and old.dtype == new.dtype
+        )
+    return old is new
+
+
+def _df_state(df: pd.DataFrame) -> tuple:
+    """Capture what in-place changes to a dataframe replace: its column data, axes and metadata."""
+    return (
+        _column_data(df),
+        df.index,
+        df.columns,
+        list(df.index.names),
+        list(df.columns.names),
+        dict(df.attrs),
+    )
+
+
+def _df_changes(state: tuple, df: pd.DataFrame):
+    """
+    Compare a dataframe to an earlier state of it.
+
+    Returns:
+        tuple: Whether it was modified in place, and the bytes of data arrays it allocated since.
+    """
+    arrays, index, columns, *metadata = state
+    now_arrays, now_index, now_columns, *now_metadata = _df_state(df)
+
+    # Replaced arrays may still be views of the old ones, for example when a block is split
+    before = [array for array in arrays if isinstance(array, np.ndarray)]
+    allocated = 0
+    for array in now_arrays:
+        if any(_same_data(old, array) for old in arrays):
+            continue
+        if isinstance(array, np.ndarray) and any(np.may_share_memory(array, old) for old in before):
+            continue
+        allocated += getattr(array, "nbytes", 0)
+    modified = (
+        len(arrays) != len(now_arrays)
+        or not all(_same_data(a, b) for a, b in zip(arrays, now_arrays))
+        or index is not now_index
+        or columns is not now_columns
+        or metadata != now_metadata
+    )
+    return modified, int(allocated)
+
+
+def _prunable(df: pd.DataFrame) -> bool:
+    """Check if a dataframe can be pruned to the columns code names, which are all strings."""
+    return df.columns.is_unique and df.columns.inferred_type == "string"
+
+
+class _ColumnUsage(NamedTuple):
+    """What code does with `df`, to work out which of its columns the code can use."""
+
+    # Strings in the code, and attributes read off df, any of which may name a column
+    names: frozenset
+    # Attributes read directly off df that dataframes do not have, so can only be columns
+    df_attributes: frozenset
+    # Whether df is used in a way that may involve any column, like df.describe() or px.scatter(df)
+    whole_frame: bool
+    # Whether df is only passed straight to helpers that data sources run themselves
+    pushdown: bool = False
+
+    def columns(self, available: List[str]) -> Optional[List[str]]:
+        """Return the available columns the code can use, or None if it may use any of them."""
+        if self.whole_frame or not self.df_attributes <= set(available):
+            return None
+        return [column for column in available if column in self.names]
+
+
+# plotly.express arguments that name the columns a chart plots. Given df and none of these,
+# px charts plot every column (wide-form data)
+_PX_COLUMN_ARGUMENTS = frozenset(
+    {
+        "x", "y", "z", "a", "b", "c", "r", "theta", "lat", "lon", "locations",
+        "names", "values", "parents", "ids", "path", "dimensions", "x_start", "x_end",
+    }
+)
+
+# plotly.express charts whose arguments name columns of the dataframe they are given. Others,
+# like imshow, take arrays, where x and y are axis labels rather than columns
+_PX_DATAFRAME_CHARTS = frozenset(
+    {
+        "scatter", "scatter_3d", "scatter_polar", "scatter_ternary", "scatter_geo", "scatter_map",
+        "scatter_mapbox", "scatter_matrix", "line", "line_3d", "line_polar", "line_ternary", "line_geo",
+        "line_map", "line_mapbox", "area", "bar", "bar_polar", "box", "violin", "strip", "histogram",
+        "ecdf", "funnel", "funnel_area", "pie", "sunburst", "treemap", "icicle", "timeline",
+        "density_contour", "density_heatmap", "density_map", "density_mapbox", "choropleth",
+        "choropleth_map", "choropleth_mapbox", "parallel_coordinates", "parallel_categories",
+    }
+)
+
+# Other plotly.express arguments that name columns of the dataframe given to the chart
+_PX_NAMING_ARGUMENTS = _PX_COLUMN_ARGUMENTS | frozenset(
+    {
+        "color", "symbol", "size", "text", "hover_name", "hover_data", "custom_data", "facet_row",
+        "facet_col", "animation_frame", "animation_group", "line_group", "line_dash", "pattern_shape",
+        "error_x", "error_x_minus", "error_y", "error_y_minus", "error_z", "error_z_minus", "base",
+    }
+)
+
+# Aggregation helpers, with their parameters after df in order. They use only the columns
+# named in their arguments, except resample_timeseries without values, which uses every numeric one
+_HELPER_PARAMETERS = {
+    "bin_histogram": ("column", "bins", "range", "weights"),
+    "density_grid": ("x", "y", "bins", "weights"),
+    "resample_timeseries": ("time", "values", "freq", "agg", "by", "max_points"),
+    "top_k_groups": ("by", "value", "k", "agg", "other"),
+    "aggregate": ("by", "values", "agg"),
+}
+
+# Parameters of the aggregation helpers that name columns
+_HELPER_NAMING_PARAMETERS = frozenset({"column", "weights", "x", "y", "time", "values", "by", "value"})
+
+# Aggregation helpers that data sources run themselves, like SQL sources in the database
+_PUSHDOWN_HELPERS = frozenset({"bin_histogram", "top_k_groups", "aggregate"})
+
+# Dataframe methods that return some of its rows, with every column
+_ROW_METHODS = frozenset(
+    {"head", "tail", "sample", "sort_values", "sort_index", "nlargest", "nsmallest", "copy", "reset_index"}
+)
+
+# groupby() options that do not involve other columns
+_GROUPBY_OPTIONS = frozenset({"as_index", "observed", "sort", "dropna"})
+
+# Series methods that return a boolean mask, for selecting rows like df[df['a'].isin(...)]
+_MASK_METHODS = frozenset(
+    {"isin", "between", "isna", "isnull", "notna", "notnull", "contains", "startswith", "endswith", "match"}
+)
+
+
+def _is_column_key(key: ast.AST) -> bool:
+    """Check if a subscript selects columns by name, as in df['a'] or df[['a', 'b']]."""
+    keys = key.elts if isinstance(key, (ast.List, ast.Tuple)) else [key]
+    return all(isinstance(k, ast.Constant) and isinstance(k.value, str) for k in keys)
+
+
+def _is_row_key(key: ast.AST) -> bool:
+    """Check if a subscript selects rows, by slice or boolean mask, as in df[df['a'] > 0]."""
+    if isinstance(key, (ast.Slice, ast.Compare, ast.BoolOp)):
+        return True
+    if isinstance(key, ast.UnaryOp):
+        return isinstance(key.op, (ast.Invert, ast.Not))
+    if isinstance(key, ast.BinOp):
+        return isinstance(key.op, (ast.BitAnd, ast.BitOr, ast.BitXor))
+    return (
+        isinstance(key, ast.Call)
+        and isinstance(key.func, ast.Attribute)
+        and key.func.attr in _MASK_METHODS
+    )
+
+
+def _is_literal_name(value: ast.AST) -> bool:
+    """Check if an argument names columns in the code itself, as in x='a', hover_data=['a', 'b'] or y=None."""
+    if isinstance(value, ast.Constant):
+        return value.value is None or isinstance(value.value, str)
+    if isinstance(value, (ast.List, ast.Tuple)):
+        return all(isinstance(item, ast.Constant) and isinstance(item.value, str) for item in value.elts)
+    if isinstance(value, ast.Dict):
+        # hover_data={'a': True}
+        return all(isinstance(key, ast.Constant) and isinstance(key.value, str) for key in value.keys)
+    return False
+
+
+def _uses_named_columns(call: ast.Call) -> bool:
+    """Check if a px chart or aggregation helper given df only uses the columns its arguments name."""
+    if any(keyword.arg is None for keyword in call.keywords):
+        # **options may hold anything
+        return False
+    arguments = {keyword.arg: keyword.value for keyword in call.keywords}
+    func = call.func
+    if (
+        isinstance(func, ast.Attribute)
+        and isinstance(func.value, ast.Name)
+        and func.value.id == "px"
+        and func.attr in _PX_DATAFRAME_CHARTS
+    ):
+        # Columns can also be passed by position, after the dataframe. Names worked out at run
+        # time, like y=name, are not in the code, so any column may be the one used
+        if not all(map(_is_literal_name, call.args[1:])) or not all(
+            _is_literal_name(value) for name, value in arguments.items() if name in _PX_NAMING_ARGUMENTS
+        ):
+            return False
+        return len(call.args) > 1 or not arguments.keys().isdisjoint(_PX_COLUMN_ARGUMENTS)
+    if isinstance(func, ast.Name) and func.id in _HELPER_PARAMETERS:
+        arguments.update(zip(_HELPER_PARAMETERS[func.id], call.args[1:]))
+        if not all(_is_literal_name(value) for name, value in arguments.items() if name in _HELPER_NAMING_PARAMETERS):
+            return False
+        if func.id == "resample_timeseries":
+            # Without values, every numeric column is resampled
+            values = arguments.get("values")
+            return values is not None and not (isinstance(values, ast.Constant) and values.value is None)
+        return True
+    return False
+
+
+def _is_pushed_down(load: ast.Name, parents: dict) -> bool:
+    """Check if df is passed straight to a helper that data sources run themselves, as in aggregate(df, 'a')."""
+    call = parents.get(load)
+    return (
+        isinstance(call, ast.Call)
+        and bool(call.args)
+        and call.args[0] is load
+        and isinstance(call.func, ast.Name)
+        and call.func.id in _PUSHDOWN_HELPERS
+        and all(keyword.arg is not None for keyword in call.keywords)
+    )
+
+
+def _frame_use(node: ast.AST, parents: dict, df_attributes: set, aliases: set) -> bool:
+    """
+    Follow an expression evaluating to df, or to some of its rows, up to what uses it.
+
+    Args:
+        node (ast.AST): The expression.
+        parents (dict): The parent of each node in the tree.
+        df_attributes (set): Collects the attributes read off the frame, which must be columns.
+            Dataframe attributes, like df.size or df.values, use the whole frame instead.
+        aliases (set): Collects the names the frame is assigned to, whose uses must be followed too.
+
+    Returns:
+        bool: Whether the use only involves columns named in the code.
+    """
+    while True:
+        parent = parents.get(node)
+        if isinstance(parent, ast.Subscript) and parent.value is node:
+            if _is_column_key(parent.slice):
+                return True
+            if not _is_row_key(parent.slice):
+                return False
+            node = parent
+            continue
+
+        if isinstance(parent, ast.Attribute) and parent.value is node:
+            grandparent = parents.get(parent)
+            called = isinstance(grandparent, ast.Call) and grandparent.func is parent
+            if parent.attr in _ROW_METHODS and called:
+                node = grandparent
+                continue
+            if parent.attr == "groupby" and called:
+                # Only df.groupby('a')['b'], which leaves out the other columns
+                selection = parents.get(grandparent)
+                return (
+                    all(_is_column_key(arg) for arg in grandparent.args)
+                    and all(keyword.arg in _GROUPBY_OPTIONS for keyword in grandparent.keywords)
+                    and isinstance(selection, ast.Subscript)
+                    and selection.value is grandparent
+                    and _is_column_key(selection.slice)
+                )
+            if parent.attr == "loc" and isinstance(grandparent, ast.Subscript):
+                key = grandparent.slice
+                if isinstance(key, ast.Tuple) and len(key.elts) == 2:
+                    # df.loc[rows, columns]
+                    return _is_column_key(key.elts[1])
+                if not _is_row_key(key):
+                    return False
+                node = grandparent
+                continue
+            if parent.attr == "index":
+                return True
+            if called or hasattr(pd.DataFrame, parent.attr):
+                # Any other method or property, like df.values or df.shape, may use every column
+                return False
+            df_attributes.add(parent.attr)
+            return True
+
+        if isinstance(parent, ast.keyword):
+            # px.scatter(data_frame=df, ...)
+            call = parents.get(parent)
+            return parent.arg == "data_frame" and _uses_named_columns(call)
+
+        if isinstance(parent, ast.Call) and parent.args and parent.args[0] is node:
+            if isinstance(parent.func, ast.Name) and parent.func.id == "len":
+                return True
+            return _uses_named_columns(parent)
+
+        if (
+            isinstance(parent, ast.Assign)
+            and parent.value is node
+            and all(isinstance(target, ast.Name) for target in parent.targets)
+        ):
+            # Follow the uses of the names the frame is assigned to
+            aliases.update(target.id for target in parent.targets)
+            return True
+
+        return False
+
+
+class ExecutionCancelled(BaseException):
+    """
+    Raised inside sandboxed code when its execution is cancelled.
+
+    Like asyncio.CancelledError it is not an Exception, so generated code
+    that catches Exception cannot swallow it.
+    """
+
+
+class _SandboxTimeout(BaseException):
+    """Raised inside sandboxed code when it runs past its timeout."""
+
+
+def _raise_in_thread(thread_id: int, exc_type):
+    """Asynchronously raise `exc_type` in the thread with the given id."""
+    ctypes.pythonapi.PyThreadState_SetAsyncExc(
+        ctypes.c_ulong(thread_id), ctypes.py_object(exc_type)
+    )
+
+
+def _clear_pending_exception(thread_id: int):
+    """Drop an exception injected into the thread with the given id that has not been raised yet."""
+    ctypes.pythonapi.PyThreadState_SetAsyncExc(ctypes.c_ulong(thread_id), None)
+
+
+class _SandboxRun:
+    """
+    Run sandboxed code on its own thread so it can be timed out or cancelled.
+
+    Unlike signal.alarm this works whichever thread the caller is on (thread
+    pools, web workers, event loop executors), so many executions can be timed
+    at once. Only the sandbox thread is ever interrupted, never the caller, and
+    the interrupt is injected at most once, while the code is still running.
+    """
+
+    def __init__(self, code, ns: dict):
+        self.code = code
+        self.ns = ns
+        self.out_buf, self.err_buf = StringIO(), StringIO()
+        # Exception raised by the code, and its formatted traceback
+        self.error = None
+        self.traceback = ""
+        # Exception type injected by interrupt(), if any
+        self.interrupted = None
+        # The pyplot figures the code created, closed once it finished
+        self.figures = []
+        self._lock = threading.Lock()
+        self._running = False
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="plot-agent-sandbox", daemon=True)
+
+    def _run(self):
+        with self._lock:
+            self._running = True
+        try:
+            # The figures the code creates are closed once it finishes, even when interrupted,
+            # so long-running processes never accumulate figures
+            with track_figures() as self.figures:
+                try:
+                    # Redirect stdout and stderr for this thread
+                    with _capture_output(self.out_buf, self.err_buf):
+                        exec(self.code, self.ns, self.ns)
+                except BaseException as e:
+                    self.error = e
+                    self.traceback = traceback.format_exc()
+                try:
+                    # Stop further interrupts
+                    with self._lock:
+                        self._running = False
+                    # An interrupt that just missed the code may still be pending. Drop it rather
+                    # than wait for it, since code that swallowed the interrupt never gets another
+                    if self.interrupted is not None:
+                        _clear_pending_exception(threading.get_ident())
+                except BaseException as e:
+                    # The pending interrupt landed before it could be dropped
+                    self._running = False
+                    self.error = e
+                if self.interrupted is not None and not isinstance(self.error, self.interrupted):
+                    # The code swallowed the interrupt: it still counts as a timeout or cancellation
+                    self.error, self.traceback = self.interrupted(), ""
+        except BaseException as e:
+            self.error = e
+        self._done.set()
+
+    def run(self, timeout: float):
+        """Run the code, interrupting it after `timeout` seconds."""
+        self._thread.start()
+        if not self._done.wait(timeout):
+            self.interrupt(_SandboxTimeout)
+        self._done.wait()
+
+    def interrupt(self, exc_type) -> bool:
+        """Raise `exc_type` in the sandbox thread if the code is still running."""
+        with self._lock:
+            if not self._running or self.interrupted is not None:
+                return False
+            _raise_in_thread(self._thread.ident, exc_type)
+            self.interrupted = exc_type
+        # Release the caller now; the sandbox thread unwinds in the background
+        self._done.set()
+        return True
 
 
-def _timeout_handler(signum, frame):
-    raise TimeoutError("Code execution timed out")
+class _ThreadLocalStream:
+    """
+    A stream that writes to a per-thread buffer when one is set.
+
+    contextlib.redirect_stdout swaps the process-wide sys.stdout, which
+    interleaves and corrupts output when executions run concurrently.
+    """
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._local = threading.local()
+
+    @property
+    def target(self):
+        target = getattr(self._local, "target", None)
+        return self._stream if target is None else target
+
+    def write(self, text):
+        return self.target.write(text)
+
+    def flush(self):
+        return self.target.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.target, name)
+
+
+def _install_thread_local_stream(name: str) -> _ThreadLocalStream:
+    """Wrap sys.stdout or sys.stderr in a _ThreadLocalStream if not already wrapped."""
+    stream = getattr(sys, name)
+    if not isinstance(stream, _ThreadLocalStream):
+        stream = _ThreadLocalStream(stream)
+        setattr(sys, name, stream)
+    return stream
+
+
+@contextlib.contextmanager
+def _capture_output(out_buf: StringIO, err_buf: StringIO):
+    """Capture stdout and stderr written by the current thread only."""
+    stdout = _install_thread_local_stream("stdout")
+    stderr = _install_thread_local_stream("stderr")
+    stdout._local.target, stderr._local.target = out_buf, err_buf
+    try:
+        yield
+    finally:
+        stdout._local.target = stderr._local.target = None
+
+
+class _CompiledCodeCache:
+    """
+    A thread-safe LRU cache of validated, compiled code keyed by a hash of the source.
+
+    Rejections are cached too, so resubmitted unsafe or broken code is turned
+    away without being parsed again.
+    """
+
+    def __init__(self, max_entries: int = 512):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # Source hash -> (compiled code or None, rejection message or None)
+        self._entries = OrderedDict()
+
+    def get(self, key: str):
+        """Return the cached (code, rejection) pair for `key`, or None on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: str, entry):
+        """Store a (code, rejection) pair, evicting the least recently used entries."""
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Remove every entry and reset the counters."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def cache_info(self) -> dict:
+        """Report hits, misses and the current number of entries."""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+
+# Sandbox globals that are only imported once some code refers to them,
+# as (module, attribute or None for the module itself)
+_LAZY_GLOBALS = {
+    "plt": ("matplotlib.pyplot", None),
+    "px": ("plotly.express", None),
+    "go": ("plotly.graph_objects", None),
+    "make_subplots": ("plotly.subplots", "make_subplots"),
+}
+
+
+def _resolve_lazy_global(name: str):
+    """Import and return the object behind a lazy sandbox global."""
+    module_name, attr = _LAZY_GLOBALS[name]
+    if module_name == "matplotlib.pyplot":
+        # With a headless backend, and tracking the figures each execution creates
+        return import_pyplot()
+    module = importlib.import_module(module_name)
+    return getattr(module, attr) if attr else module
+
+
+def _referenced_names(code) -> set:
+    """Collect every global name referenced by a code object and the code nested in it."""
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if hasattr(const, "co_names"):
+            names |= _referenced_names(const)
+    return names
 
 
 # List of allowed modules
@@ -48,6 +667,9 @@ def _safe_import(name, globals=None, locals=None, fromlist=(), level=0):
     """
     root = name.split(".", 1)[0]
     if root in _ALLOWED_MODULES:
+        if name == "matplotlib.pyplot" or (name == "matplotlib" and "pyplot" in (fromlist or ())):
+            # With a headless backend, and tracking the figures each execution creates
+            import_pyplot()
         return _orig_import(name, globals, locals, fromlist, level)
     # If the module is not in the allowlist, raise an ImportError
     raise ImportError(f"Import of module '{name}' is not allowed.")
@@ -62,13 +684,19 @@ class PlotAgentExecutionEnvironment:
         matplotlib, plotly, sklearn)
       • AST scan rejects any import outside that list and any __dunder__ access
       • Sandbox builtins to include only a minimal safe set + our _safe_import
-      • Enforce a 60 second timeout via signal.alarm
-      • Capture both stdout & stderr
+      • Enforce a 60 second timeout from any calling thread
+      • Allow running executions to be cancelled from another thread
+      • Capture both stdout & stderr, per thread
       • Purge any old `fig` between runs
+      • Discard in-place changes to `df` between runs, without copying it up front
+      • Close the matplotlib figures each run creates, accepting them as `fig`
     """
 
     TIMEOUT_SECONDS = 60
 
+    # Validated, compiled code shared by every environment
+    _code_cache = _CompiledCodeCache()
+
     # A lean set of builtins, plus our safe-import hook
     _SAFE_BUILTINS = {
         "abs": abs,
@@ -110,32 +738,204 @@ class PlotAgentExecutionEnvironment:
         "__import__": _safe_import,
     }
 
-    def __init__(self, df: pd.DataFrame):
+    def __init__(
+        self,
+        df: Union[pd.DataFrame, DataSource],
+        cache=None,
+        preview_rows: Optional[int] = None,
+        preview_stratify_by: Optional[Union[str, List[str]]] = None,
+        figure_max_points: Optional[int] = None,
+        track_memory: bool = False,
+        isolate_df: Optional[bool] = None,
+    ):
         """
         Initialize the execution environment with a dataframe.
+
+        Args:
+            df (Union[pd.DataFrame, DataSource]): The dataframe generated code runs against, or a
+                data source, from which each execution only reads the columns its code uses.
+            cache (Optional[FigureCache]): A cache of figures from previously executed code.
+            preview_rows (Optional[int]): If set, preview executions run against a sample
+                of this many rows instead of the full dataframe.
+            preview_stratify_by (Optional[Union[str, List[str]]]): Column(s) whose groups must
+                all be represented in the preview sample.
+            figure_max_points (Optional[int]): If set, scatter and line traces with more points
+                than this are downsampled, and large traces are switched to WebGL.
+            track_memory (bool): Record the peak memory of each execution in its metrics.
+                This uses tracemalloc, which slows executions down.
+            isolate_df (Optional[bool]): Give each execution its own copy of df, so in-place changes
+                are discarded. The copy is shallow and only the columns the code writes to are
+                copied, with copy-on-write turned on while code runs in pandas 2. By default df is
+                isolated if pandas has copy-on-write. Without it df is copied in full, and compared
+                to the copy afterwards, on every execution.
         """
-        self.df = df
-        # Base namespace for both globals & locals
-        self._base_ns = {
+        self.source = df if isinstance(df, DataSource) else None
+        # With a data source, df is only read in full if something needs every column
+        self._df = df if self.source is None else None
+        self.cache = cache
+        self._fingerprint = None
+        # Base namespace for both globals & locals. plt, px, go and make_subplots
+        # are added per execution, and only if the code refers to them
+        self._base_ns = self._namespace(df)
+        self.fig = None
+        # The code that produced `fig`
+        self.fig_code = None
+
+        # Preview mode: the sample is drawn on first use
+        self.preview_rows = preview_rows
+        self.preview_stratify_by = preview_stratify_by
+
+        # Post-processing of large figures
+        self.figure_max_points = figure_max_points
+        self.track_memory = track_memory
+        self.isolate_df = _copy_on_write_available() if isolate_df is None else isolate_df
+        self._preview_df = None
+        self._preview_ns = None
+        self.preview_fig = None
+        # The last code that produced a figure on the preview sample, not yet run on df
+        self.accepted_code = None
+        # Executions currently running, so they can be cancelled
+        self._runs = set()
+        self._runs_lock = threading.Lock()
+
+    def _namespace(self, df: pd.DataFrame) -> dict:
+        """Build the base namespace generated code runs in."""
+        return {
             "__builtins__": self._SAFE_BUILTINS,
             "df": df,
             "pd": pd,
             "np": np,
-            "plt": plt,
-            "px": px,
-            "go": go,
-            "make_subplots": make_subplots,
+            # Vectorized aggregations, so figures carry aggregates instead of raw rows
+            **HELPERS,
         }
-        self.fig = None
 
-    def _validate_ast(self, node: ast.AST):
+    @property
+    def df(self) -> pd.DataFrame:
+        """The dataframe. With a data source, every column is read on first use."""
+        if self._df is None:
+            self._df = self.source.read()
+        return self._df
+
+    @property
+    def n_rows(self) -> int:
+        """The number of rows in the dataframe, without reading a data source."""
+        return len(self.source) if self.source is not None else len(self._df)
+
+    @property
+    def preview_df(self) -> Optional[Union[pd.DataFrame, DataSource]]:
+        """
+        The preview sample, or None if preview mode is off or df is already small enough.
+
+        A data source is sampled as a source, so previews read only the sampled rows of the
+        columns their code uses, and sources still run the aggregation helpers themselves.
+        """
+        if self.preview_rows is None or self.n_rows <= self.preview_rows:
+            return None
+        if self._preview_df is None:
+            if self.source is not None:
+                self._preview_df = sample_source(
+                    self.source, self.preview_rows, stratify_by=self.preview_stratify_by
+                )
+            else:
+                self._preview_df = sample_dataframe(
+                    self.df, self.preview_rows, stratify_by=self.preview_stratify_by
+                )
+        return self._preview_df
+
+    @property
+    def fingerprint(self) -> str:
+        """A fingerprint of the dataframe, computed on first use."""
+        if self._fingerprint is None:
+            if self.source is not None:
+                self._fingerprint = self.source.fingerprint
+            else:
+                self._fingerprint = dataframe_fingerprint(self.df)
+        return self._fingerprint
+
+    def _cache_key(self, generated_code: str) -> str:
+        """Build the figure cache key, which also depends on how figures are post-processed."""
+        fingerprint = self.fingerprint
+        if self.figure_max_points is not None:
+            fingerprint = f"{fingerprint}:{self.figure_max_points}"
+        return self.cache.key(generated_code, fingerprint)
+
+    def _cached_result(self, generated_code: str):
+        """Return a success result from the figure cache, or None on a miss."""
+        if self.cache is None:
+            return None
+        fig = self.cache.get(self._cache_key(generated_code))
+        if fig is None:
+            return None
+        self.fig, self.fig_code = fig, generated_code
+        return {
+            "fig": fig,
+            "output": "Code executed successfully. 'fig' object was created.",
+            "error": "",
+            "success": True,
+        }
+
+    def _update_fig(self, generated_code: str, result: dict):
+        """Update `fig` and the code that produced it, but only once the code has actually run."""
+        if result["success"] or result["error"] == NO_FIG_ERROR:
+            self.fig = result["fig"]
+            self.fig_code = generated_code if result["success"] else None
+
+    def _cache_result(self, generated_code: str, result: dict):
+        """Store the figure of a successful result in the figure cache."""
+        if self.cache is not None and result["success"]:
+            self.cache.put(self._cache_key(generated_code), result["fig"])
+
+    def close(self):
+        """Release the figures and preview sample held by this environment."""
+        self.fig = self.fig_code = self.preview_fig = self.accepted_code = None
+        self._preview_df = self._preview_ns = None
+        if self.source is not None:
+            # The source is read again if the environment is used after all
+            self._df = None
+            self.source.release()
+
+    def cancel(self) -> bool:
+        """
+        Cancel any execution currently running in this environment.
+
+        Safe to call from any thread. The cancelled execution returns an error result.
+
+        Returns:
+            bool: True if a running execution was interrupted.
+        """
+        with self._runs_lock:
+            runs = list(self._runs)
+        return any([run.interrupt(ExecutionCancelled) for run in runs])
+
+    def _validate_ast(self, node: ast.AST) -> _ColumnUsage:
         """
         Walk the AST and enforce:
          • any Import/ImportFrom must be from _ALLOWED_MODULES
          • no __dunder__ attribute access
+
+        Returns:
+            _ColumnUsage: What the code does with the columns of df, worked out in the same walk.
         """
-        # Walk the AST and enforce:
-        for child in ast.walk(node):
+        # Strings, which may name columns, the parent of each node, and the names read and bound
+        strings = set()
+        parents = {}
+        loads = {}
+        bound = set()
+        # Walk the AST breadth-first, as ast.walk does, recording parents along the way.
+        # Child nodes are found inline, which is about twice as fast as ast.iter_child_nodes
+        todo = deque([node])
+        while todo:
+            child = todo.popleft()
+            for field in child._fields:
+                value = getattr(child, field, None)
+                if isinstance(value, ast.AST):
+                    parents[value] = child
+                    todo.append(value)
+                elif isinstance(value, list):
+                    for item in value:
+                        if isinstance(item, ast.AST):
+                            parents[item] = child
+                            todo.append(item)
             # Check for imports
             if isinstance(child, ast.Import):
                 # Check for imports
@@ -144,36 +944,177 @@ class PlotAgentExecutionEnvironment:
                     # Check if the module is in the allowlist
                     if root not in _ALLOWED_MODULES:
                         raise ValueError(f"Import of '{alias.name}' is not allowed.")
+                    bound.add(alias.asname or root)
             # Check for import-froms
             elif isinstance(child, ast.ImportFrom):
                 root = (child.module or "").split(".", 1)[0]
                 if root not in _ALLOWED_MODULES:
                     raise ValueError(f"Import-from of '{child.module}' is not allowed.")
+                bound.update(alias.asname or alias.name for alias in child.names)
             # Check for dunder attribute access
             elif isinstance(child, ast.Attribute) and child.attr.startswith("__"):
                 raise ValueError("Access to dunder attributes is forbidden.")
+            elif isinstance(child, ast.Constant) and isinstance(child.value, str):
+                strings.add(child.value)
+            elif isinstance(child, ast.Name):
+                if isinstance(child.ctx, ast.Load):
+                    loads.setdefault(child.id, []).append(child)
+                else:
+                    bound.add(child.id)
+            elif isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef, ast.ExceptHandler)):
+                bound.add(child.name)
+            elif isinstance(child, ast.arg):
+                bound.add(child.arg)
 
-    def execute_code(self, generated_code: str):
+        # Follow every use of df, and of the names rows of it are assigned to
+        df_attributes = set()
+        frames, followed = {"df"}, set()
+        whole_frame = False
+        while frames - followed and not whole_frame:
+            name = (frames - followed).pop()
+            followed.add(name)
+            whole_frame = not all(
+                _frame_use(load, parents, df_attributes, frames) for load in loads.get(name, [])
+            )
+        # Helpers replaced by the code may use any column
+        whole_frame = whole_frame or not bound.isdisjoint(_HELPER_PARAMETERS)
+
+        # Data sources run the helpers themselves if df is only ever passed to them, and
+        # neither df nor the helpers are replaced by the code
+        pushdown = (
+            "df" in loads
+            and not bound & (_PUSHDOWN_HELPERS | {"df"})
+            and all(_is_pushed_down(load, parents) for load in loads["df"])
+        )
+        return _ColumnUsage(frozenset(strings | df_attributes), frozenset(df_attributes), whole_frame, pushdown)
+
+    @classmethod
+    def code_cache_info(cls) -> dict:
+        """
+        Report statistics for the shared compiled-code cache.
+
+        Returns:
+            dict: Hits, misses and the current number of entries.
+        """
+        return cls._code_cache.cache_info()
+
+    def _compile(self, generated_code: str):
+        """
+        Parse, validate and compile code, reusing earlier results for identical source.
+
+        Raises:
+            ValueError: If the code does not parse or fails validation.
+
+        Returns:
+            tuple: The compiled code object, and what the code does with the columns of df.
+        """
+        key = hashlib.sha256(f"{type(self).__qualname__}:{generated_code}".encode("utf-8")).hexdigest()
+        entry = self._code_cache.get(key)
+        if entry is None:
+            try:
+                # Parse the generated code
+                tree = ast.parse(generated_code)
+                # Validate the AST
+                usage = self._validate_ast(tree)
+                entry = (compile(tree, "<string>", "exec"), None, usage)
+            except Exception as e:
+                entry = (None, str(e), None)
+            self._code_cache.put(key, entry)
+
+        code, rejection, usage = entry
+        if rejection is not None:
+            raise ValueError(rejection)
+        return code, usage
+
+    def _preview_result(self, generated_code: str, result: dict) -> dict:
+        """Record the outcome of a preview execution and explain it in the result."""
+        if result["success"]:
+            self.preview_fig = result["fig"]
+            self.accepted_code = generated_code
+            result["output"] = (
+                f"Code executed successfully on a preview sample of {len(self.preview_df)} "
+                f"of the {self.n_rows} rows in df. 'fig' object was created, and will be "
+                "rendered on the full dataframe once you are done."
+            )
+        return result
+
+    def finalize_preview(self) -> Optional[dict]:
+        """
+        Run the code last accepted on the preview sample against the full dataframe.
+
+        Returns:
+            Optional[dict]: The execution result, or None if no code was waiting to be run.
+        """
+        generated_code, self.accepted_code = self.accepted_code, None
+        if generated_code is None:
+            return None
+        return self.execute_code(generated_code)
+
+    def execute_code(self, generated_code: str, preview: bool = False):
         """
         Execute the user code in a locked‑down sandbox.
 
+        Args:
+            generated_code (str): The code to execute.
+            preview (bool): Run against the preview sample, if there is one, leaving
+                `fig` untouched. Call finalize_preview() to render the accepted code on df.
+
         Returns a dict with:
           - fig: The figure if created, else None
           - output: Captured stdout
           - error: Captured stderr or exception text
           - success: True if fig was produced and no errors
+          - optimizations: What was done to keep the figure small, if figure_max_points is set
+          - metrics: Wall time of the execution and its stages, in seconds, its peak
+            memory if track_memory is set, the change in resident memory of the process
+            (rss_delta_bytes), the number of matplotlib figures it left open that were
+            closed (matplotlib_figures_closed), and with isolate_df, whether the code modified
+            df in place (df_modified) and the bytes of df data that cost (df_allocated_bytes).
+            Also the number of columns of df the code was given (columns_used), which is
+            fewer than df has when isolate_df is set and the code only uses some, and with
+            a data source, the number of its columns read for the code (columns_loaded)
+            and the time that took (load_seconds), or whether the code only used aggregation
+            helpers that the source ran itself (pushdown)
         """
+        metrics = {"preview": preview and self.preview_df is not None, "cached": False}
+        # Isolated copies of df are shallow, so pandas must copy what the code writes to
+        isolation = _copy_on_write() if self.isolate_df else contextlib.nullcontext()
+        with timed(metrics, "seconds"), isolation:
+            result = self._execute(generated_code, preview, metrics)
+        result["metrics"] = metrics
+        return result
 
+    def _execute(self, generated_code: str, preview: bool, metrics: dict) -> dict:
+        """Execute code for execute_code, recording what it did in `metrics`."""
+        if preview and self.preview_df is not None:
+            # Previews are cheap to recompute, so they skip the figure cache
+            if self._preview_ns is None:
+                self._preview_ns = self._namespace(self.preview_df)
+            result = self._run_code(generated_code, self._preview_ns, metrics)
+            return self._preview_result(generated_code, result)
+
+        # Reuse the figure if this code has already run against this dataframe
+        cached = self._cached_result(generated_code)
+        if cached is not None:
+            metrics["cached"] = True
+            return cached
+
+        result = self._run_code(generated_code, self._base_ns, metrics)
+        self._update_fig(generated_code, result)
+        self._cache_result(generated_code, result)
+        return result
+
+    def _run_code(self, generated_code: str, base_ns: dict, metrics: dict) -> dict:
+        """Validate and run code in a copy of a base namespace, returning the result dict."""
         # Copy the base namespace
-        ns = self._base_ns.copy()
+        ns = base_ns.copy()
         # Purge any old `fig`
         ns.pop("fig", None)
 
         try:
-            # Parse the generated code
-            tree = ast.parse(generated_code)
-            # Validate the AST
-            self._validate_ast(tree)
+            # Parse, validate and compile the generated code
+            with timed(metrics, "validate_seconds"):
+                code, usage = self._compile(generated_code)
         except Exception as e:
             # If the code is rejected on safety grounds, return an error
             return {
@@ -183,56 +1124,127 @@ class PlotAgentExecutionEnvironment:
                 "success": False,
             }
 
-        # Set a timeout
-        signal.signal(signal.SIGALRM, _timeout_handler)
-        signal.alarm(self.TIMEOUT_SECONDS)
+        # Import the plotting libraries the code refers to, on first use
+        for name in _referenced_names(code) & _LAZY_GLOBALS.keys():
+            ns.setdefault(name, _resolve_lazy_global(name))
 
-        # Execute the code
-        out_buf, err_buf = StringIO(), StringIO()
+        # Hand the code only the columns it uses, or all of them if unsure which. Data
+        # sources only read those columns, and in-memory frames are pruned to them
+        df = ns.get("df")
+        if isinstance(df, DataSource) and df.pushdown and usage.pushdown:
+            # The code only passes df to helpers that the source runs itself, reading no columns here
+            metrics["columns_loaded"] = 0
+            metrics["pushdown"] = True
+        elif isinstance(df, DataSource):
+            with timed(metrics, "load_seconds"):
+                df = ns["df"] = df.read(usage.columns(df.columns))
+            metrics["columns_loaded"] = df.shape[1]
+        elif self.isolate_df and isinstance(df, pd.DataFrame) and _prunable(df):
+            # Without isolation the code works on the shared dataframe itself, so it is left whole
+            columns = usage.columns(df.columns)
+            if columns is not None and len(columns) < df.shape[1]:
+                # Selects without copying under copy-on-write, and otherwise copies only these
+                df = ns["df"] = df[columns]
+        if isinstance(df, pd.DataFrame):
+            metrics["columns_used"] = df.shape[1]
+
+        # Give the code its own dataframe, remembering its state to detect in-place changes
+        if self.isolate_df and isinstance(df, pd.DataFrame):
+            shared, df = df, _isolated_df(df)
+            ns["df"] = df
+            df_state = _df_state(df)
+        else:
+            df_state = None
+
+        # Run the code on its own thread, under a timeout that cancel() can trigger early
+        run = _SandboxRun(code, ns)
+        with self._runs_lock:
+            self._runs.add(run)
         try:
-            # Redirect stdout and stderr
-            with contextlib.redirect_stdout(out_buf), contextlib.redirect_stderr(
-                err_buf
-            ):
-                # Execute the code
-                exec(generated_code, ns, ns)
-        except TimeoutError as te:
+            with timed(metrics, "exec_seconds"), track_resident_memory(metrics):
+                if self.track_memory:
+                    with track_peak_memory(metrics):
+                        run.run(self.TIMEOUT_SECONDS)
+                else:
+                    run.run(self.TIMEOUT_SECONDS)
+        finally:
+            with self._runs_lock:
+                self._runs.discard(run)
+        out_buf = run.out_buf
+        if run.figures:
+            metrics["matplotlib_figures_closed"] = len(run.figures)
+
+        df_modified = False
+        if df_state is not None:
+            df_modified, metrics["df_allocated_bytes"] = _df_changes(df_state, df)
+            if not df_modified and not _copy_on_write_enabled():
+                # Without copy-on-write the code got a deep copy, whose values it can change
+                # in place without replacing any column, so compare them too
+                df_modified = not df.equals(shared)
+            metrics["df_modified"] = df_modified
+
+        if run.interrupted is ExecutionCancelled:
+            # If the code execution was cancelled, return an error
+            return {
+                "fig": None,
+                "output": out_buf.getvalue(),
+                "error": CANCELLED_ERROR,
+                "success": False,
+            }
+        if run.interrupted is _SandboxTimeout:
             # If the code execution timed out, return an error
-            tb = traceback.format_exc()
             return {
                 "fig": None,
                 "output": out_buf.getvalue(),
-                "error": f"Code execution timed out: {te}\n{tb}",
+                "error": f"Code execution timed out after {self.TIMEOUT_SECONDS} seconds.",
                 "success": False,
             }
-        except Exception as e:
+        if run.error is not None:
             # If there was an error, return an error
-            tb = traceback.format_exc()
             return {
                 "fig": None,
                 "output": out_buf.getvalue(),
-                "error": f"Error executing code: {e}\n{tb}",
+                "error": f"Error executing code: {run.error}\n{run.traceback}",
                 "success": False,
             }
-        finally:
-            # Reset the timeout
-            signal.alarm(0)
 
-        # Get the `fig`
+        # Get the `fig`. Matplotlib axes stand for their figure, and code that only
+        # drew with pyplot produced the last figure it created
         fig = ns.get("fig")
-        self.fig = fig
+        drawn = fig is None and bool(run.figures)
+        if drawn:
+            fig = run.figures[-1]
+        elif fig is not None:
+            fig = as_matplotlib_figure(fig) or fig
         if fig is None:
             return {
                 "fig": None,
                 "output": out_buf.getvalue(),
-                "error": "No `fig` created. Assign your figure to a variable named `fig`.",
+                "error": NO_FIG_ERROR,
                 "success": False,
             }
 
         # Return the result
-        return {
+        result = {
             "fig": fig,
             "output": "Code executed successfully. 'fig' object was created.",
             "error": "",
             "success": True,
         }
+
+        if drawn:
+            result["output"] += " The last matplotlib figure the code created was used as 'fig'."
+        if df_modified:
+            result["output"] += (
+                " The code modified df in place; the changes were discarded after this run,"
+                " so later code sees the original df."
+            )
+
+        # Keep oversized figures cheap to serialize and render
+        if self.figure_max_points is not None:
+            with timed(metrics, "postprocess_seconds"):
+                optimizations = optimize_figure(fig, max_points=self.figure_max_points)
+            result["optimizations"] = optimizations
+            if optimizations:
+                result["output"] += f" Large traces were optimized for display: {'; '.join(optimizations)}."
+        return result
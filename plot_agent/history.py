@@ -0,0 +1,138 @@
+"""
+This module contains helpers to keep the chat history sent to the LLM within a token budget.
+
+compact_history() returns histories that already fit the budget as they are,
+and rewrites longer ones so that:
+  • The most recent turns are kept verbatim
+  • Older turns are collapsed into one-line summaries, newest first, while they fit
+  • Code blocks are dropped from all but the latest message containing code, and
+    the latest working code is kept once
+
+No LLM calls are made, so compaction adds no latency of its own.
+"""
+import re
+from typing import List, Optional
+
+from plot_agent.profiling import estimate_tokens
+
+
+# Fenced code blocks, with or without a language
+_CODE_BLOCK = re.compile(r"```[\w+-]*\n.*?```", re.DOTALL)
+
+# Characters of each side of a turn kept in its summary
+_SUMMARY_CHARS = 150
+
+# Rough per-message overhead of the chat format, in tokens
+_MESSAGE_TOKENS = 4
+
+
+def _text(message) -> str:
+    """Return the text content of a message."""
+    content = message.content
+    if isinstance(content, str):
+        return content
+    # Content blocks, as used by multimodal messages
+    return " ".join(block.get("text", "") if isinstance(block, dict) else str(block) for block in content)
+
+
+def _one_line(text: str, max_chars: int = _SUMMARY_CHARS) -> str:
+    """Collapse text to a single line of at most `max_chars` characters."""
+    text = " ".join(_CODE_BLOCK.sub("[code]", text).split())
+    return text if len(text) <= max_chars else text[: max_chars - 3] + "..."
+
+
+def _tokens(messages: list) -> int:
+    """Estimate the number of tokens a list of messages uses."""
+    return sum(estimate_tokens(_text(message)) + _MESSAGE_TOKENS for message in messages)
+
+
+def _split_turns(messages: list) -> List[list]:
+    """Group messages into turns, each starting with a human message."""
+    turns = []
+    for message in messages:
+        if message.type == "human" or not turns:
+            turns.append([])
+        turns[-1].append(message)
+    return turns
+
+
+def _summarize(turn: list) -> str:
+    """Summarize a turn in one line."""
+    parts = []
+    for message in turn:
+        role = "User" if message.type == "human" else "Assistant"
+        parts.append(f"{role}: {_one_line(_text(message))}")
+    return "- " + " | ".join(parts)
+
+
+def compact_history(
+    messages: list,
+    token_budget: int,
+    recent_turns: int = 2,
+    latest_code: Optional[str] = None,
+) -> list:
+    """
+    Compact a chat history to fit within a token budget.
+
+    Args:
+        messages (list): The chat history, as LangChain messages.
+        token_budget (int): Approximate number of tokens the compacted history may use.
+        recent_turns (int): Number of most recent turns to keep verbatim, if they fit.
+        latest_code (Optional[str]): The latest working code, kept once in the history.
+
+    Returns:
+        list: The compacted history. The input list is not modified.
+    """
+    from langchain_core.messages import SystemMessage
+
+    if _tokens(messages) <= token_budget:
+        return list(messages)
+
+    turns = _split_turns(messages)
+
+    # Keep code only in the latest message that has any
+    latest_with_code = next(
+        (message for message in reversed(messages) if _CODE_BLOCK.search(_text(message))), None
+    )
+
+    def strip_code(message):
+        if message is latest_with_code or not isinstance(message.content, str):
+            return message
+        content = _CODE_BLOCK.sub("[code omitted, see the latest code]", message.content)
+        return message.model_copy(update={"content": content})
+
+    code_messages = []
+    if latest_code and (latest_with_code is None or latest_code.strip() not in _text(latest_with_code)):
+        code_messages = [SystemMessage(content=f"The latest working code is:\n```python\n{latest_code}\n```")]
+
+    # Keep as many recent turns verbatim as fit, but always the current one
+    for keep in range(min(recent_turns, len(turns)), 0, -1):
+        recent = [strip_code(message) for turn in turns[len(turns) - keep :] for message in turn]
+        if keep == 1 or _tokens(code_messages + recent) <= token_budget:
+            break
+    else:
+        keep, recent = 0, []
+    older = turns[: len(turns) - keep]
+
+    # Summarize older turns, newest first, while they fit
+    remaining = token_budget - _tokens(code_messages + recent) - _MESSAGE_TOKENS - 10
+    lines = []
+    for turn in reversed(older):
+        line = _summarize(turn)
+        cost = estimate_tokens(line) + 1
+        if cost > remaining:
+            break
+        lines.insert(0, line)
+        remaining -= cost
+
+    summary = []
+    if older:
+        omitted = len(older) - len(lines)
+        text = "Summary of the earlier conversation:"
+        if omitted:
+            text += f"\n- ({omitted} earlier turns omitted)"
+        if lines:
+            text += "\n" + "\n".join(lines)
+        summary = [SystemMessage(content=text)]
+
+    return summary + code_messages + recent
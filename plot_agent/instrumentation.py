@@ -0,0 +1,326 @@
+"""
+This module contains the instrumentation used to see where process_message spends its time.
+
+MessageMetrics collects, for one process_message call:
+  • Wall time per stage (the agent loop, fallback executions)
+  • Wall time and tokens in and out per LLM call, and the number of iterations and tool calls
+  • Wall time per execute_code, split into validation, execution and post-processing,
+    the change in resident memory of the process, and its peak memory if memory tracking is on
+
+MessageMetrics.to_dict() returns plain data, and flatten_metrics() turns it into
+flat name -> number pairs that can be fed to any metrics exporter (Prometheus,
+StatsD, OpenTelemetry, logs).
+"""
+import contextlib
+import functools
+import os
+import threading
+import time
+import tracemalloc
+from typing import Dict, Optional
+
+try:
+    import psutil
+except ImportError:  # pragma: no cover - psutil is optional
+    psutil = None
+
+
+@contextlib.contextmanager
+def timed(metrics: dict, name: str):
+    """
+    Add the wall time of a block to `metrics[name]`, in seconds.
+
+    Args:
+        metrics (dict): The metrics to update.
+        name (str): The name of the timing.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics[name] = metrics.get(name, 0.0) + time.perf_counter() - started
+
+
+# Number of blocks currently tracking memory, so tracemalloc is only on while needed,
+# and whether we started tracemalloc, so we never stop tracing someone else started
+_memory_tracking = 0
+_started_tracing = False
+_memory_tracking_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def track_peak_memory(metrics: dict):
+    """
+    Record the peak memory allocated by Python during a block in `metrics["peak_memory_bytes"]`.
+
+    tracemalloc slows allocations down, so it only runs while a block is being tracked.
+    When tracked blocks overlap, their peaks include each other's allocations.
+
+    Args:
+        metrics (dict): The metrics to update.
+    """
+    global _memory_tracking, _started_tracing
+
+    with _memory_tracking_lock:
+        if _memory_tracking == 0:
+            _started_tracing = not tracemalloc.is_tracing()
+            if _started_tracing:
+                tracemalloc.start()
+            elif hasattr(tracemalloc, "reset_peak"):
+                tracemalloc.reset_peak()
+        _memory_tracking += 1
+        baseline = tracemalloc.get_traced_memory()[0]
+    try:
+        yield
+    finally:
+        with _memory_tracking_lock:
+            metrics["peak_memory_bytes"] = max(tracemalloc.get_traced_memory()[1] - baseline, 0)
+            _memory_tracking -= 1
+            if _memory_tracking == 0 and _started_tracing:
+                tracemalloc.stop()
+
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def resident_memory_bytes() -> Optional[int]:
+    """
+    Report the resident memory of this process.
+
+    Reads /proc on Linux, which takes microseconds, and falls back to psutil if it is installed.
+
+    Returns:
+        Optional[int]: The number of bytes, or None if it cannot be read.
+    """
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        pass
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    return None
+
+
+@contextlib.contextmanager
+def track_resident_memory(metrics: dict):
+    """
+    Record the resident memory of the process after a block in `metrics["rss_bytes"]`, and
+    how much it changed during the block in `metrics["rss_delta_bytes"]`.
+
+    Resident memory is process-wide, so when blocks overlap their deltas include each
+    other's. Nothing is recorded where resident memory cannot be read.
+
+    Args:
+        metrics (dict): The metrics to update.
+    """
+    before = resident_memory_bytes()
+    try:
+        yield
+    finally:
+        after = resident_memory_bytes()
+        if before is not None and after is not None:
+            metrics["rss_bytes"] = after
+            metrics["rss_delta_bytes"] = after - before
+
+
+@functools.lru_cache(maxsize=None)
+def _callback_handler_class():
+    """Define the LangChain callback handler on first use, so LangChain is only imported when needed."""
+    from langchain_core.callbacks import BaseCallbackHandler
+
+    class MetricsCallbackHandler(BaseCallbackHandler):
+        """Records the duration and token usage of LLM calls, and the number of tool calls."""
+
+        # Recording is cheap, so there is no need to hop to a thread for async runs
+        run_inline = True
+
+        def __init__(self, metrics: "MessageMetrics"):
+            self.metrics = metrics
+            self._started = {}
+
+        def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+            self._started[run_id] = time.perf_counter()
+
+        def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+            self._started[run_id] = time.perf_counter()
+
+        def on_llm_end(self, response, *, run_id, **kwargs):
+            started = self._started.pop(run_id, None)
+            seconds = time.perf_counter() - started if started is not None else 0.0
+
+            # Chat models report usage on their messages, others in llm_output
+            input_tokens = output_tokens = 0
+            for generations in response.generations:
+                for generation in generations:
+                    usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                    if usage:
+                        input_tokens += usage.get("input_tokens", 0)
+                        output_tokens += usage.get("output_tokens", 0)
+            if not (input_tokens or output_tokens):
+                usage = (response.llm_output or {}).get("token_usage") or {}
+                input_tokens = usage.get("prompt_tokens", 0)
+                output_tokens = usage.get("completion_tokens", 0)
+
+            self.metrics.record_llm_call(seconds, input_tokens, output_tokens)
+
+        def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+            self.metrics.record_tool_call()
+
+    return MetricsCallbackHandler
+
+
+class MessageMetrics:
+    """
+    Metrics of a single process_message call.
+
+    Thread-safe, since tools may run on executor threads.
+    """
+
+    def __init__(self):
+        """Start timing a process_message call."""
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+        self.stages = {}
+        self.current_stage = None
+        self.llm_calls = []
+        self.tool_calls = 0
+        self.executions = []
+        self.skipped_executions = 0
+        # Hash of the code that produced the final figure
+        self.figure_code_hash = None
+        self.total_seconds = None
+        self.error = None
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        """
+        Time a stage of process_message. Executions during the stage are tagged with it.
+
+        Args:
+            name (str): The name of the stage.
+        """
+        previous, self.current_stage = self.current_stage, name
+        try:
+            with timed(self.stages, name):
+                yield
+        finally:
+            self.current_stage = previous
+
+    def callback_handler(self):
+        """
+        Create a LangChain callback handler that records LLM calls and tool calls here.
+
+        Returns:
+            BaseCallbackHandler: The handler, to pass in the `callbacks` of a run config.
+        """
+        return _callback_handler_class()(self)
+
+    def record_llm_call(self, seconds: float, input_tokens: int, output_tokens: int):
+        """Record an LLM call."""
+        with self._lock:
+            self.llm_calls.append(
+                {"seconds": seconds, "input_tokens": input_tokens, "output_tokens": output_tokens}
+            )
+
+    def record_tool_call(self):
+        """Record a tool call."""
+        with self._lock:
+            self.tool_calls += 1
+
+    def record_execution(self, execution_metrics: dict):
+        """
+        Record the metrics of an execute_code call.
+
+        Args:
+            execution_metrics (dict): The `metrics` of the execution result.
+        """
+        with self._lock:
+            self.executions.append(dict(execution_metrics, stage=self.current_stage))
+
+    def record_skipped_execution(self):
+        """Record an execution that was skipped because the outcome of its code was already known."""
+        with self._lock:
+            self.skipped_executions += 1
+
+    def finish(self, error: Optional[BaseException] = None):
+        """Stop timing, recording the error the call failed with, if any."""
+        self.total_seconds = time.perf_counter() - self._started
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+
+    def to_dict(self) -> dict:
+        """
+        Report the metrics as plain data.
+
+        Returns:
+            dict: With:
+              - total_seconds: Wall time of the whole call
+              - stages: Wall time per stage
+              - iterations: Number of LLM calls made by the agent loop
+              - tool_calls: Number of tool calls
+              - llm_seconds, input_tokens, output_tokens: Totals over LLM calls
+              - llm_calls: Wall time and tokens per LLM call
+              - execution_seconds: Total wall time of execute_code calls
+              - peak_memory_bytes: Largest peak memory of an execution, if tracked
+              - rss_delta_bytes: Total change in resident memory over executions, if known
+              - executions: The metrics of each execute_code call
+              - skipped_executions: Number of executions skipped because their outcome was known
+              - figure_code_hash: Hash of the code that produced the final figure, if any
+              - error: The error the call failed with, if any
+        """
+        with self._lock:
+            llm_calls = [dict(call) for call in self.llm_calls]
+            executions = [dict(execution) for execution in self.executions]
+        peaks = [e["peak_memory_bytes"] for e in executions if e.get("peak_memory_bytes") is not None]
+        rss_deltas = [e["rss_delta_bytes"] for e in executions if e.get("rss_delta_bytes") is not None]
+        return {
+            "total_seconds": self.total_seconds,
+            "stages": dict(self.stages),
+            "iterations": len(llm_calls),
+            "tool_calls": self.tool_calls,
+            "llm_seconds": sum(call["seconds"] for call in llm_calls),
+            "input_tokens": sum(call["input_tokens"] for call in llm_calls),
+            "output_tokens": sum(call["output_tokens"] for call in llm_calls),
+            "llm_calls": llm_calls,
+            "execution_seconds": sum(execution.get("seconds", 0.0) for execution in executions),
+            "peak_memory_bytes": max(peaks) if peaks else None,
+            "rss_delta_bytes": sum(rss_deltas) if rss_deltas else None,
+            "executions": executions,
+            "skipped_executions": self.skipped_executions,
+            "figure_code_hash": self.figure_code_hash,
+            "error": self.error,
+        }
+
+
+def flatten_metrics(metrics: dict, prefix: str = "plot_agent") -> Dict[str, float]:
+    """
+    Flatten the metrics of a process_message call into name -> number pairs for exporters.
+
+    Args:
+        metrics (dict): The metrics, as returned by MessageMetrics.to_dict().
+        prefix (str): Prefix for every metric name.
+
+    Returns:
+        Dict[str, float]: The metrics that have a value, by dotted name.
+    """
+    flat = {}
+    for name in (
+        "total_seconds",
+        "iterations",
+        "tool_calls",
+        "llm_seconds",
+        "input_tokens",
+        "output_tokens",
+        "execution_seconds",
+        "peak_memory_bytes",
+        "rss_delta_bytes",
+        "skipped_executions",
+    ):
+        if metrics.get(name) is not None:
+            flat[f"{prefix}.{name}"] = metrics[name]
+    for stage, seconds in metrics.get("stages", {}).items():
+        flat[f"{prefix}.stage.{stage}.seconds"] = seconds
+    flat[f"{prefix}.executions"] = len(metrics.get("executions", []))
+    flat[f"{prefix}.errors"] = int(metrics.get("error") is not None)
+    return flat
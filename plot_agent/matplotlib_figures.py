@@ -0,0 +1,213 @@
+"""
+This module contains the helpers that stop matplotlib figures made by generated code from leaking.
+
+pyplot keeps every figure it creates in a global registry until it is closed, so
+figures left open by generated code pile up in long-running processes. Here:
+  • pyplot is imported with the SANDBOX_BACKEND backend (Agg), unless a backend was chosen already
+  • Each figure is tagged with the sandbox run that created it, so a run can close exactly
+    its own figures, even while other runs are creating theirs
+  • Figures are rasterized to PNG straight from the Agg renderer, with fast compression
+
+Figures are tagged by wrapping the method pyplot registers new figures with, and only
+while sandbox runs are going on: the original is put back once the last one finishes.
+
+Selecting the backend affects the whole process, so it is only done when the application
+has not chosen one. Applications that rely on matplotlib picking a GUI backend itself
+should import pyplot first, or set SANDBOX_BACKEND to None.
+"""
+import contextlib
+import sys
+import threading
+from io import BytesIO
+from typing import Optional
+
+
+# The backend selected when pyplot is first imported for sandboxed code, if the application has
+# not imported pyplot or set MPLBACKEND. GUI backends cannot run off the main thread, and
+# sandboxed code never does. None leaves the choice to matplotlib
+SANDBOX_BACKEND: Optional[str] = "Agg"
+
+# Attribute set on figures to the token of the sandbox run that created them
+_OWNER_ATTR = "_plot_agent_run"
+
+# The token of the sandbox run on each thread, if any
+_local = threading.local()
+
+_pyplot_lock = threading.Lock()
+_pyplot_ready = False
+# Number of sandbox runs going on, pyplot's own registration method, and whether it is wrapped
+_active_runs = 0
+_original_register = None
+_wrapped = False
+
+
+def _set_new_active_manager(cls, manager):
+    """Tag a new figure with the sandbox run creating it on this thread, and register it."""
+    owner = getattr(_local, "owner", None)
+    if owner is not None and not hasattr(manager.canvas.figure, _OWNER_ATTR):
+        setattr(manager.canvas.figure, _OWNER_ATTR, owner)
+    return _original_register.__func__(cls, manager)
+
+
+def _update_registration():
+    """Wrap pyplot's figure registration while runs are going on, and unwrap it after. Holds _pyplot_lock."""
+    global _original_register, _wrapped
+
+    if not _pyplot_ready:
+        return
+    from matplotlib._pylab_helpers import Gcf
+
+    if _active_runs and not _wrapped:
+        # Kept once taken, for calls already inside the wrapper when it is unwrapped
+        _original_register = Gcf.__dict__["_set_new_active_manager"]
+        Gcf._set_new_active_manager = classmethod(_set_new_active_manager)
+        _wrapped = True
+    elif not _active_runs and _wrapped:
+        Gcf._set_new_active_manager = _original_register
+        _wrapped = False
+
+
+def import_pyplot():
+    """
+    Import pyplot for sandboxed code, with the sandbox backend and figure tracking.
+
+    The SANDBOX_BACKEND backend is only selected if pyplot was not imported yet and no
+    backend was chosen, with matplotlib.use(), MPLBACKEND or matplotlibrc, so an
+    application's own choice of backend is kept.
+
+    Returns:
+        The matplotlib.pyplot module.
+    """
+    global _pyplot_ready
+
+    if _pyplot_ready:
+        return sys.modules["matplotlib.pyplot"]
+    with _pyplot_lock:
+        if not _pyplot_ready:
+            import matplotlib
+
+            # A backend set with matplotlib.use(), MPLBACKEND or matplotlibrc is a string, and
+            # otherwise a placeholder until pyplot picks one. Read it without resolving it
+            chosen = isinstance(dict.__getitem__(matplotlib.rcParams, "backend"), str)
+            if SANDBOX_BACKEND and "matplotlib.pyplot" not in sys.modules and not chosen:
+                matplotlib.use(SANDBOX_BACKEND)
+            import matplotlib.pyplot  # noqa: F401
+
+            _pyplot_ready = True
+            # Runs already going on track the figures they create from now on
+            _update_registration()
+    return sys.modules["matplotlib.pyplot"]
+
+
+def _close_figures(owner) -> list:
+    """Close the pyplot figures a sandbox run created, in the order they were created."""
+    if not _pyplot_ready:
+        # pyplot was never set up for sandboxed code, so it created no figures
+        return []
+    from matplotlib._pylab_helpers import Gcf
+
+    managers = [
+        manager
+        for manager in Gcf.get_all_fig_managers()
+        if getattr(manager.canvas.figure, _OWNER_ATTR, None) is owner
+    ]
+    figures = []
+    for manager in sorted(managers, key=lambda manager: manager.num):
+        figures.append(manager.canvas.figure)
+        Gcf.destroy(manager)
+    return figures
+
+
+@contextlib.contextmanager
+def track_figures():
+    """
+    Track the pyplot figures the current thread creates in the block, and close them after it.
+
+    The figures are closed even if the block raises, and stay usable: they can still be
+    drawn and saved. Each block gets a token of its own, so figures of an earlier run on a
+    thread with the same id are never mistaken for this one's.
+
+    Yields:
+        list: The closed figures, in the order they were created, filled in when the block exits.
+    """
+    global _active_runs
+
+    owner, previous = object(), getattr(_local, "owner", None)
+    with _pyplot_lock:
+        _active_runs += 1
+        _update_registration()
+    _local.owner = owner
+    figures = []
+    try:
+        yield figures
+    finally:
+        _local.owner = previous
+        try:
+            figures.extend(_close_figures(owner))
+        finally:
+            with _pyplot_lock:
+                _active_runs -= 1
+                _update_registration()
+
+
+def is_matplotlib_figure(obj) -> bool:
+    """Check if an object is a matplotlib figure, without importing matplotlib."""
+    if "matplotlib.figure" not in sys.modules:
+        return False
+    from matplotlib.figure import Figure
+
+    return isinstance(obj, Figure)
+
+
+def as_matplotlib_figure(obj):
+    """
+    Return the matplotlib figure behind a figure, axes or array of axes, or None.
+
+    Args:
+        obj: The object generated code assigned to `fig`.
+
+    Returns:
+        The matplotlib Figure, or None if `obj` is not a matplotlib object.
+    """
+    if "matplotlib.figure" not in sys.modules:
+        return None
+    from matplotlib.axes import Axes
+
+    if is_matplotlib_figure(obj):
+        return obj
+    if isinstance(obj, Axes):
+        # The figure of axes on a subfigure is the subfigure, whose own figure is the root one
+        return obj.figure.figure
+    # plt.subplots() returns axes as an array
+    flat = list(getattr(obj, "flat", []))
+    if flat and isinstance(flat[0], Axes):
+        return as_matplotlib_figure(flat[0])
+    return None
+
+
+def figure_to_png(fig, dpi: Optional[float] = None, compress_level: int = 1) -> bytes:
+    """
+    Rasterize a matplotlib figure to PNG.
+
+    Args:
+        fig: The matplotlib figure.
+        dpi (Optional[float]): Resolution, in dots per inch. Defaults to the figure's own.
+        compress_level (int): zlib compression level, from 0 to 9. Low levels are faster
+            to write and only slightly larger for plots, which are mostly flat color.
+
+    Returns:
+        bytes: The PNG image.
+    """
+    assert is_matplotlib_figure(fig), "The figure must be a matplotlib figure."
+    assert 0 <= compress_level <= 9, "compress_level must be between 0 and 9."
+
+    buffer = BytesIO()
+    # Saving as PNG always renders with Agg, whatever the figure's canvas
+    fig.savefig(
+        buffer,
+        format="png",
+        dpi=dpi or "figure",
+        metadata={"Software": None},
+        pil_kwargs={"compress_level": compress_level},
+    )
+    return buffer.getvalue()
@@ -0,0 +1,455 @@
+"""
+This module contains the PlotAgentWorkerPool class, which runs LLM‑generated plotting code in a pool of warm worker processes.
+
+Each worker process:
+  • Imports pandas, numpy and plotly once at startup, so requests never pay import cost
+  • Keeps the dataframes of the sessions it has served loaded (bounded, LRU), and only
+    the columns of them that the code it ran used, so large frames are sent in part
+  • Executes code with the same sandbox as PlotAgentExecutionEnvironment
+
+The parent process hands each request to an idle worker, so executions from
+many sessions (and many threads) run in parallel on separate cores, and a
+snippet that hangs or crashes only takes down its own worker.
+"""
+import multiprocessing
+import os
+import queue
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Optional, Union
+
+import pandas as pd
+
+from plot_agent.execution import CANCELLED_ERROR, PlotAgentExecutionEnvironment, _prunable
+from plot_agent.sources import DataSource
+
+
+def _worker_main(conn, max_frames: int):
+    """
+    Entry point for a pool worker process.
+
+    Warms up the plotting stack, then serves requests from `conn` until told to stop.
+
+    Args:
+        conn: The worker end of the pipe to the parent process.
+        max_frames (int): Maximum number of session dataframes to keep loaded.
+    """
+    # Pay the import cost once, up front, rather than on the first request
+    import numpy  # noqa: F401
+    import plotly.express  # noqa: F401
+    import plotly.graph_objects  # noqa: F401
+    from plotly.subplots import make_subplots  # noqa: F401
+
+    # Execution environments keyed by frame key, least recently used first
+    environments = OrderedDict()
+
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+
+        command = message[0]
+        if command == "stop":
+            break
+
+        if command == "load":
+            # Load a session dataframe, or more of its columns, evicting the least recently used
+            # one if needed
+            _, key, df, columns = message
+            env = environments.get(key)
+            if env is not None and columns is not None:
+                # Add the columns to those already loaded, in the order of the session dataframe
+                df = pd.concat([env.df, df], axis=1)
+                df = df[[column for column in columns if column in df.columns]]
+            environments[key] = PlotAgentExecutionEnvironment(df)
+            environments.move_to_end(key)
+            while len(environments) > max_frames:
+                environments.popitem(last=False)
+            conn.send(("loaded", None))
+
+        elif command == "drop":
+            _, key = message
+            environments.pop(key, None)
+
+        elif command == "execute":
+            _, key, generated_code, options, columns = message
+            env = environments.get(key)
+            if env is None:
+                # Ask the parent to send the dataframe first
+                conn.send(("missing", None))
+                continue
+            if columns is not None and not set(columns) <= set(env.df.columns):
+                # Ask the parent for the columns the code uses, saying which are loaded
+                conn.send(("missing", list(env.df.columns)))
+                continue
+            environments.move_to_end(key)
+            # Per-session options such as figure_max_points, applied on the worker so that
+            # post-processing happens before the figure is sent back
+            for name, value in options.items():
+                setattr(env, name, value)
+            result = env.execute_code(generated_code)
+            try:
+                conn.send(("result", result))
+            except Exception as e:
+                # The figure could not be pickled back to the parent
+                conn.send(
+                    (
+                        "result",
+                        {
+                            "fig": None,
+                            "output": result.get("output", ""),
+                            "error": f"Could not return result from worker: {e}",
+                            "success": False,
+                        },
+                    )
+                )
+
+
+def _missing_data(df: Union[pd.DataFrame, DataSource], columns: Optional[list], loaded: Optional[list]):
+    """Select the data a worker is missing to run code using `columns` of df, given the columns it has."""
+    if columns is None:
+        # Every column, or a data source, sent as a reference to the data
+        return df
+    loaded = set(loaded or [])
+    return df[[column for column in columns if column not in loaded]]
+
+
+class _Worker:
+    """A single worker process and the parent end of its pipe."""
+
+    def __init__(self, context, max_frames: int):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main, args=(child_conn, max_frames), daemon=True
+        )
+        self.process.start()
+        # The parent only talks over its own end of the pipe
+        child_conn.close()
+        # Frame keys released while this worker was busy, dropped on next use
+        self.pending_drops = []
+        # Key of the frame the worker is running code against, and whether cancel() killed it
+        self.running = None
+        self.cancelled = False
+
+    def stop(self):
+        """Ask the worker to exit, killing it if it does not."""
+        try:
+            self.conn.send(("stop",))
+        except (OSError, ValueError):
+            pass
+        self.process.join(timeout=5)
+        self.kill()
+
+    def kill(self):
+        """Kill the worker process immediately."""
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+class PlotAgentWorkerPool:
+    """
+    A pool of warm worker processes that execute LLM‑generated plotting code.
+
+    Results have the same shape as PlotAgentExecutionEnvironment.execute_code:
+      - fig: The figure if created, else None
+      - output: Captured stdout
+      - error: Captured stderr or exception text
+      - success: True if fig was produced and no errors
+
+    The pool is thread-safe and can be shared by many sessions; each call to
+    execute() blocks until a worker is free.
+    """
+
+    # Extra seconds the parent waits beyond the sandbox timeout before killing a worker
+    KILL_GRACE_SECONDS = 5
+
+    def __init__(
+        self,
+        max_workers: Optional[int] = None,
+        max_frames_per_worker: int = 8,
+        timeout: Optional[float] = None,
+        start_method: str = "spawn",
+    ):
+        """
+        Initialize the pool and start its workers.
+
+        Args:
+            max_workers (Optional[int]): Number of worker processes. Defaults to the number of CPUs.
+            max_frames_per_worker (int): Maximum number of session dataframes each worker keeps loaded.
+            timeout (Optional[float]): Seconds after which a busy worker is killed and replaced.
+                Defaults to the sandbox timeout plus a short grace period.
+            start_method (str): The multiprocessing start method used for workers.
+        """
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_frames_per_worker = max_frames_per_worker
+        self.timeout = timeout or (
+            PlotAgentExecutionEnvironment.TIMEOUT_SECONDS + self.KILL_GRACE_SECONDS
+        )
+        self._context = multiprocessing.get_context(start_method)
+        self._lock = threading.Lock()
+        self._workers = []
+        self._idle = queue.Queue()
+        self._closed = False
+        for _ in range(self.max_workers):
+            self._idle.put(self._spawn())
+
+    def _spawn(self) -> _Worker:
+        """Start a new worker and track it."""
+        worker = _Worker(self._context, self.max_frames_per_worker)
+        with self._lock:
+            self._workers.append(worker)
+        return worker
+
+    def _replace(self, worker: _Worker) -> _Worker:
+        """Kill a broken or stuck worker and start a fresh one in its place."""
+        worker.kill()
+        with self._lock:
+            if worker in self._workers:
+                self._workers.remove(worker)
+        return self._spawn()
+
+    def _receive(self, worker: _Worker):
+        """Wait for a reply from a worker, raising TimeoutError if it takes too long."""
+        if not worker.conn.poll(self.timeout):
+            raise TimeoutError(f"Worker did not respond within {self.timeout} seconds")
+        return worker.conn.recv()
+
+    def execute(
+        self,
+        key: str,
+        df: Union[pd.DataFrame, DataSource],
+        generated_code: str,
+        columns: Optional[list] = None,
+        **options,
+    ) -> dict:
+        """
+        Execute code against a session dataframe on the next free worker.
+
+        Args:
+            key (str): A stable key identifying the session dataframe.
+            df (Union[pd.DataFrame, DataSource]): The session dataframe, or data source, sent only to
+                workers that do not have it loaded. Data sources are sent as a reference to the data.
+            generated_code (str): The code to execute.
+            columns (Optional[list]): The columns of df the code uses. Only those a worker does not
+                have loaded yet are sent to it. Defaults to sending the whole dataframe.
+            **options: Execution environment attributes to use, like figure_max_points or track_memory.
+
+        Returns:
+            dict: The execution result. Its metrics include the number of columns sent to the
+            worker for it (columns_sent), if any were.
+        """
+        assert not self._closed, "The worker pool has been shut down."
+
+        worker = self._idle.get()
+        try:
+            with self._lock:
+                worker.running = key
+                drops, worker.pending_drops = worker.pending_drops, []
+            for dropped_key in drops:
+                worker.conn.send(("drop", dropped_key))
+            worker.conn.send(("execute", key, generated_code, options, columns))
+            status, payload = self._receive(worker)
+            if status == "missing":
+                # First request for this frame, or these columns of it, on this worker: load, retry
+                data = _missing_data(df, columns, payload)
+                worker.conn.send(("load", key, data, list(df.columns) if columns is not None else None))
+                status, _ = self._receive(worker)
+                if status != "loaded":
+                    raise RuntimeError(f"Worker replied {status!r} to loading the dataframe")
+                worker.conn.send(("execute", key, generated_code, options, columns))
+                status, payload = self._receive(worker)
+                if isinstance(data, pd.DataFrame) and status == "result" and "metrics" in payload:
+                    payload["metrics"]["columns_sent"] = data.shape[1]
+            if status != "result":
+                raise RuntimeError(f"Worker replied {status!r} to executing code")
+            return payload
+        except TimeoutError as te:
+            worker = self._replace(worker)
+            return {
+                "fig": None,
+                "output": "",
+                "error": f"Code execution timed out: {te}",
+                "success": False,
+            }
+        except (EOFError, OSError) as e:
+            cancelled = worker.cancelled
+            worker = self._replace(worker)
+            return {
+                "fig": None,
+                "output": "",
+                "error": CANCELLED_ERROR if cancelled else f"Worker process crashed while executing code: {e!r}",
+                "success": False,
+            }
+        except BaseException:
+            # Anything else, like data that cannot be pickled, may leave a message half sent
+            worker = self._replace(worker)
+            raise
+        finally:
+            with self._lock:
+                worker.running = None
+            if worker.cancelled:
+                # Killed by cancel() after it had replied
+                worker = self._replace(worker)
+            self._idle.put(worker)
+
+    def cancel(self, key: str) -> bool:
+        """
+        Cancel the executions running against a session dataframe, by killing their workers.
+
+        Safe to call from any thread. The cancelled executions return an error result, and
+        their workers are replaced.
+
+        Args:
+            key (str): The key of the session dataframe.
+
+        Returns:
+            bool: True if a running execution was cancelled.
+        """
+        with self._lock:
+            workers = [worker for worker in self._workers if worker.running == key]
+            for worker in workers:
+                worker.cancelled = True
+                # Only the process: the pipe is closed by the thread waiting on it
+                worker.process.kill()
+        return bool(workers)
+
+    def release(self, key: str):
+        """
+        Drop a session dataframe from every worker the next time it is used.
+
+        Args:
+            key (str): The key of the session dataframe to drop.
+        """
+        with self._lock:
+            for worker in self._workers:
+                worker.pending_drops.append(key)
+
+    def shutdown(self):
+        """Stop all worker processes."""
+        self._closed = True
+        with self._lock:
+            workers, self._workers = self._workers, []
+        for worker in workers:
+            worker.stop()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.shutdown()
+
+
+class PooledExecutionEnvironment(PlotAgentExecutionEnvironment):
+    """
+    Execution environment that runs code on a PlotAgentWorkerPool instead of in-process.
+
+    It is a drop-in replacement for PlotAgentExecutionEnvironment: execute_code
+    returns the same result dict and keeps `fig` up to date.
+    """
+
+    def __init__(self, df: Union[pd.DataFrame, DataSource], pool: PlotAgentWorkerPool, cache=None, **kwargs):
+        """
+        Initialize the execution environment with a dataframe and a worker pool.
+
+        Args:
+            df (Union[pd.DataFrame, DataSource]): The dataframe generated code runs against, or a
+                data source, which workers open themselves.
+            pool (PlotAgentWorkerPool): The pool to execute code on.
+            cache (Optional[FigureCache]): A cache of figures from previously executed code.
+            **kwargs: Preview and figure options, as for PlotAgentExecutionEnvironment.
+        """
+        super().__init__(df, cache=cache, **kwargs)
+        self.pool = pool
+        # Identify this dataframe and its preview sample on the workers
+        self.key = uuid.uuid4().hex
+        self.preview_key = uuid.uuid4().hex
+
+    def cancel(self) -> bool:
+        """
+        Cancel any execution currently running for this environment, killing its worker.
+
+        Returns:
+            bool: True if a running execution was cancelled.
+        """
+        return any([self.pool.cancel(self.key), self.pool.cancel(self.preview_key)])
+
+    def close(self):
+        """Release the figures held here, and the dataframe and preview sample loaded on workers."""
+        super().close()
+        self.pool.release(self.key)
+        self.pool.release(self.preview_key)
+
+    def _execute_on_worker(
+        self, key: str, df: Union[pd.DataFrame, DataSource], generated_code: str, metrics: dict
+    ) -> dict:
+        """Execute code on a pool worker, merging the worker's metrics into `metrics`."""
+        columns = None
+        if self.isolate_df and isinstance(df, pd.DataFrame) and _prunable(df):
+            # Workers are only sent the columns the code uses, or every one if unsure which.
+            # Without isolation code may change the worker's frame, so it is sent whole
+            try:
+                columns = self._compile(generated_code)[1].columns(df.columns)
+            except ValueError:
+                # The worker rejects the code without using any column
+                columns = []
+            if columns is None:
+                columns = list(df.columns)
+        result = self.pool.execute(
+            key,
+            df,
+            generated_code,
+            columns=columns,
+            figure_max_points=self.figure_max_points,
+            track_memory=self.track_memory,
+            isolate_df=self.isolate_df,
+        )
+        worker_metrics = result.pop("metrics", {})
+        for name in (
+            "validate_seconds",
+            "exec_seconds",
+            "postprocess_seconds",
+            "peak_memory_bytes",
+            "df_modified",
+            "df_allocated_bytes",
+            "rss_bytes",
+            "rss_delta_bytes",
+            "matplotlib_figures_closed",
+            "load_seconds",
+            "columns_loaded",
+            "pushdown",
+            "columns_used",
+            "columns_sent",
+        ):
+            if name in worker_metrics:
+                metrics[name] = worker_metrics[name]
+        if "seconds" in worker_metrics:
+            metrics["worker_seconds"] = worker_metrics["seconds"]
+        return result
+
+    def _execute(self, generated_code: str, preview: bool, metrics: dict) -> dict:
+        """
+        Execute the user code on a pool worker.
+
+        execute_code returns the same dict as for PlotAgentExecutionEnvironment, with the time
+        spent on the worker in metrics["worker_seconds"] and the round trip in metrics["seconds"].
+        """
+        if preview and self.preview_df is not None:
+            result = self._execute_on_worker(self.preview_key, self.preview_df, generated_code, metrics)
+            return self._preview_result(generated_code, result)
+
+        # Reuse the figure if this code has already run against this dataframe
+        cached = self._cached_result(generated_code)
+        if cached is not None:
+            metrics["cached"] = True
+            return cached
+
+        # Workers open data sources themselves, and only read the columns code uses
+        data = self.source if self.source is not None else self.df
+        result = self._execute_on_worker(self.key, data, generated_code, metrics)
+        self._cache_result(generated_code, result)
+        self._update_fig(generated_code, result)
+        return result
@@ -0,0 +1,265 @@
+"""
+This module contains a bounded-cost dataframe profiler, which is used to describe a dataframe to the LLM.
+
+df.info() and df.head().to_string() grow with the size of the frame: a
+5,000 column frame or one with long text cells produces a prompt of hundreds
+of KB. profile_dataframe() instead:
+  • Stays within a token budget, capping how many columns are described
+  • Computes nulls and cardinality on a random row sample of large frames
+  • Truncates long cell values
+  • Summarizes the columns it leaves out by dtype
+
+profile_source() does the same for a data source, from its metadata and first rows only.
+"""
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+
+
+# Rough number of characters per LLM token
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Roughly estimate how many LLM tokens some text will use.
+
+    Args:
+        text (str): The text to estimate.
+
+    Returns:
+        int: The estimated number of tokens.
+    """
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def _truncate(value, max_chars: int) -> str:
+    """Render a value on one line, truncated to at most `max_chars` characters."""
+    if isinstance(value, (float, np.floating)):
+        text = f"{value:.6g}"
+    else:
+        text = str(value).replace("\n", " ")
+    if len(text) <= max_chars:
+        return text
+    return text[: max_chars - 3] + "..."
+
+
+def _sample_values(series: pd.Series, count: int, max_chars: int) -> str:
+    """Return up to `count` distinct non-null values of a series as a short string."""
+    values = []
+    seen = set()
+    for value in series.dropna().iloc[: count * 20]:
+        text = _truncate(value, max_chars)
+        if text not in seen:
+            seen.add(text)
+            values.append(text)
+        if len(values) == count:
+            break
+    return ", ".join(values)
+
+
+def _profile_column(name, series: pd.Series, total_rows: int, sampled: bool, max_chars: int) -> dict:
+    """Describe one column from its (possibly sampled) values."""
+    non_null = int(series.notna().sum())
+    if sampled:
+        null_pct = 100.0 * (1 - non_null / max(len(series), 1))
+        nulls = f"~{null_pct:.0f}%"
+    else:
+        nulls = str(total_rows - non_null)
+
+    try:
+        unique = int(series.nunique(dropna=True))
+        unique = f"{unique}+" if sampled and 0 < unique == non_null else str(unique)
+    except TypeError:
+        # Unhashable values such as lists or dicts
+        unique = "?"
+
+    return {
+        "column": _truncate(name, max_chars),
+        "dtype": str(series.dtype),
+        "nulls": nulls,
+        "unique": unique,
+        "values": _sample_values(series, 3, max_chars),
+    }
+
+
+def _format_table(rows: list, columns: list) -> list:
+    """Format dicts as left-aligned text columns, one line per row."""
+    widths = {
+        column: max([len(column)] + [len(str(row[column])) for row in rows])
+        for column in columns
+    }
+    lines = ["  ".join(column.ljust(widths[column]) for column in columns).rstrip()]
+    for row in rows:
+        lines.append("  ".join(str(row[column]).ljust(widths[column]) for column in columns).rstrip())
+    return lines
+
+
+def _profile_info(
+    df: pd.DataFrame, token_budget: int, sample_rows: int, max_chars: int
+) -> Tuple[str, int]:
+    """Build the df.info()-like summary and return it with the number of columns described."""
+    total_rows, total_columns = df.shape
+
+    header = [
+        str(type(df)),
+        f"{type(df.index).__name__}: {total_rows} entries",
+        f"Data columns (total {total_columns} columns):",
+    ]
+    dtype_counts = df.dtypes.astype(str).value_counts()
+    memory = df.memory_usage(index=True, deep=False).sum()
+    footer = [
+        "dtypes: " + ", ".join(f"{dtype}({count})" for dtype, count in sorted(dtype_counts.items())),
+        f"memory usage: {memory / 1024 ** 2:.1f} MB (excluding object contents)",
+    ]
+
+    # A fixed-size random sample of rows, so large frames are profiled at a fixed cost.
+    # Seeded so the same frame always produces the same prompt, and random rather than
+    # evenly spaced so periodic data is not aliased.
+    sampled = total_rows > sample_rows
+    if sampled:
+        positions = np.sort(np.random.default_rng(0).choice(total_rows, sample_rows, replace=False))
+    else:
+        positions = slice(None)
+    if sampled:
+        header.append(f"Nulls and unique counts below are estimated from {sample_rows} sampled rows.")
+
+    fixed_tokens = estimate_tokens("\n".join(header + footer)) + 30
+    columns = ["#", "column", "dtype", "nulls", "unique", "values"]
+
+    rows = []
+    used_tokens = fixed_tokens
+    for index in range(total_columns):
+        series = df.iloc[positions, index]
+        row = {"#": index, **_profile_column(df.columns[index], series, total_rows, sampled, max_chars)}
+        row_tokens = estimate_tokens("  ".join(str(value) for value in row.values())) + 2
+        if rows and used_tokens + row_tokens > token_budget:
+            break
+        rows.append(row)
+        used_tokens += row_tokens
+
+    lines = header + _format_table(rows, columns)
+    if len(rows) < total_columns:
+        lines.append(f"... {total_columns - len(rows)} more columns not shown")
+    lines += footer
+    return "\n".join(lines), len(rows)
+
+
+def _profile_head(
+    df: pd.DataFrame, n_columns: int, token_budget: int, head_rows: int, max_chars: int
+) -> str:
+    """Render the first rows of up to `n_columns` columns within the token budget."""
+    n_columns = max(min(n_columns, df.shape[1]), 1)
+    head = df.iloc[:head_rows, :n_columns]
+    while True:
+        text = head.to_string(max_colwidth=max_chars)
+        if estimate_tokens(text) <= token_budget or (head.shape[1] == 1 and len(head) <= 1):
+            break
+        if head.shape[1] > 1:
+            head = head.iloc[:, : head.shape[1] // 2]
+        else:
+            head = head.iloc[: len(head) // 2]
+
+    if head.shape[1] < df.shape[1]:
+        text += f"\n... {df.shape[1] - head.shape[1]} more columns not shown"
+    return text
+
+
+def profile_dataframe(
+    df: pd.DataFrame,
+    token_budget: int = 2000,
+    sample_rows: int = 10000,
+    head_rows: int = 5,
+    max_cell_chars: int = 40,
+) -> Tuple[str, str]:
+    """
+    Profile a dataframe for the system prompt at a bounded cost.
+
+    Args:
+        df (pd.DataFrame): The dataframe to profile.
+        token_budget (int): Approximate number of tokens the profile may use in total.
+        sample_rows (int): Frames with more rows than this are profiled on a random sample.
+        head_rows (int): Number of leading rows to show.
+        max_cell_chars (int): Maximum characters shown for any single value.
+
+    Returns:
+        Tuple[str, str]: A df.info()-like summary and a df.head()-like preview.
+    """
+    # Most of the budget goes to the column summary, the rest to the preview
+    info_budget = int(token_budget * 0.7)
+    head_budget = token_budget - info_budget
+
+    df_info, n_columns = _profile_info(df, info_budget, sample_rows, max_cell_chars)
+    df_head = _profile_head(df, n_columns, head_budget, head_rows, max_cell_chars)
+    return df_info, df_head
+
+
+def profile_source(
+    source,
+    token_budget: int = 2000,
+    head_rows: int = 5,
+    max_cell_chars: int = 40,
+) -> Tuple[str, str]:
+    """
+    Profile a data source for the system prompt, without reading its data.
+
+    Column types and sample values come from the first rows, and null counts and value
+    ranges from the source's column statistics, where it has them.
+
+    Args:
+        source (DataSource): The data source to profile.
+        token_budget (int): Approximate number of tokens the profile may use in total.
+        head_rows (int): Number of leading rows to show.
+        max_cell_chars (int): Maximum characters shown for any single value.
+
+    Returns:
+        Tuple[str, str]: A df.info()-like summary and a df.head()-like preview.
+    """
+    info_budget = int(token_budget * 0.7)
+    head_budget = token_budget - info_budget
+
+    head = source.head(head_rows)
+    statistics = source.column_statistics()
+    total_rows, total_columns = len(source), len(source.columns)
+
+    header = [
+        str(type(source)),
+        f"{type(head.index).__name__}: {total_rows} entries",
+        f"Data columns (total {total_columns} columns):",
+        source.prompt_note,
+    ]
+    dtype_counts = head.dtypes.astype(str).value_counts()
+    footer = ["dtypes: " + ", ".join(f"{dtype}({count})" for dtype, count in sorted(dtype_counts.items()))]
+
+    fixed_tokens = estimate_tokens("\n".join(header + footer)) + 30
+    columns = ["#", "column", "dtype", "nulls", "range", "values"]
+
+    rows = []
+    used_tokens = fixed_tokens
+    for index, name in enumerate(head.columns):
+        column = statistics.get(name, {})
+        value_range = ""
+        if "min" in column and "max" in column:
+            value_range = f"{_truncate(column['min'], max_cell_chars)} to {_truncate(column['max'], max_cell_chars)}"
+        row = {
+            "#": index,
+            "column": _truncate(name, max_cell_chars),
+            "dtype": str(head.dtypes.iloc[index]),
+            "nulls": column.get("nulls", "?"),
+            "range": value_range or "?",
+            "values": _sample_values(head.iloc[:, index], 3, max_cell_chars),
+        }
+        row_tokens = estimate_tokens("  ".join(str(value) for value in row.values())) + 2
+        if rows and used_tokens + row_tokens > info_budget:
+            break
+        rows.append(row)
+        used_tokens += row_tokens
+
+    lines = header + _format_table(rows, columns)
+    if len(rows) < total_columns:
+        lines.append(f"... {total_columns - len(rows)} more columns not shown")
+    lines += footer
+
+    df_head = _profile_head(head, len(rows), head_budget, head_rows, max_cell_chars)
+    return "\n".join(lines), df_head
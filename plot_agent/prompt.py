@@ -32,6 +32,22 @@ TOOLS:
 - does_fig_exist() to check that a fig object is available for display. This tool takes no arguments.
 - view_generated_code() to view the generated code if need to fix it. This tool takes no arguments.
 
+AGGREGATION HELPERS:
+These functions are already available in your code, without importing anything. They aggregate with vectorized operations
+and return small dataframes, so figures carry aggregated data instead of every raw row. When df has more than about
+100,000 rows, use them (or your own groupby aggregations) rather than passing raw rows to px.scatter, px.line or px.histogram:
+- bin_histogram(df, column, bins=50, range=None, weights=None) -> columns bin_start, bin_end, bin_center, count.
+  Plot with px.bar(hist, x='bin_center', y='count').
+- density_grid(df, x, y, bins=100, weights=None) -> a grid of counts indexed by y bin centers, with x bin centers as columns.
+  Plot with px.imshow(grid, origin='lower', aspect='auto') instead of a dense scatter.
+- resample_timeseries(df, time, values=None, freq=None, agg='mean', by=None, max_points=1000) -> one row per time bucket
+  (and group in `by`), with the bucket size picked to give at most max_points buckets unless freq (like '1h') is given.
+  Plot with px.line(series, x=time, y=values, color=by).
+- top_k_groups(df, by, value=None, k=10, agg='sum', other='Other') -> the k largest groups, with the rest in an 'Other' row,
+  and the aggregate in `value` (or 'count' when value is None). Plot with px.bar(top, x=by, y=value).
+- aggregate(df, by, values=None, agg='sum') -> one row per group in `by` (a column or a list of them), with the aggregate
+  of each column in `values` (or 'count' when values is None). Plot with px.bar(totals, x=by, y=values).
+
 IMPORTANT CODE FORMATTING INSTRUCTIONS:
 1. Include thorough, detailed comments in your code to explain what each section does.
 2. Use descriptive variable names.
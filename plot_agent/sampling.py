@@ -0,0 +1,100 @@
+"""
+This module contains helpers to draw small, representative samples of a dataframe.
+
+Samples are used to try out generated code cheaply before running it on the
+full dataframe. They:
+  • Are reproducible, so the same frame always yields the same sample
+  • Keep rows in their original order, so time series still look like time series
+  • Can be stratified, so every category is represented, however rare
+
+Data sources are sampled without reading them: the sample reads the rows it keeps
+from the source, and only once code uses their columns.
+"""
+from typing import List, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from plot_agent.sources import DataSource, SampledSource, _as_list
+
+
+def _sample_positions(
+    n_total: int, n_rows: int, groups: Optional[dict] = None, seed: int = 0
+) -> np.ndarray:
+    """Draw the positions of `n_rows` of `n_total` rows, in proportion to each group's size if given."""
+    rng = np.random.default_rng(seed)
+    if groups is None:
+        return np.sort(rng.choice(n_total, n_rows, replace=False))
+    fraction = n_rows / n_total
+    positions = np.concatenate(
+        [rng.choice(group, max(1, round(len(group) * fraction)), replace=False) for group in groups.values()]
+    )
+    return np.sort(positions)
+
+
+def sample_dataframe(
+    df: pd.DataFrame,
+    n_rows: int,
+    stratify_by: Optional[Union[str, List[str]]] = None,
+    seed: int = 0,
+) -> pd.DataFrame:
+    """
+    Draw a random sample of rows from a dataframe.
+
+    With `stratify_by`, rows are drawn from each group in proportion to its
+    size, with at least one row per group, so the sample can exceed `n_rows`
+    when there are more groups than that.
+
+    Args:
+        df (pd.DataFrame): The dataframe to sample.
+        n_rows (int): The number of rows to draw.
+        stratify_by (Optional[Union[str, List[str]]]): Column(s) whose groups must all be represented.
+        seed (int): Seed for the random number generator.
+
+    Returns:
+        pd.DataFrame: The sampled rows, in their original order, or df itself if it is small enough.
+    """
+    assert n_rows > 0, "The number of rows to sample must be positive."
+
+    if len(df) <= n_rows:
+        return df
+
+    groups = None
+    if stratify_by is not None:
+        # Row positions of each group, by group
+        groups = df.groupby(stratify_by, sort=False, dropna=False, observed=True).indices
+    return df.iloc[_sample_positions(len(df), n_rows, groups, seed)]
+
+
+def sample_source(
+    source: DataSource,
+    n_rows: int,
+    stratify_by: Optional[Union[str, List[str]]] = None,
+    seed: int = 0,
+) -> DataSource:
+    """
+    Draw a random sample of rows from a data source, as sample_dataframe does.
+
+    Only the columns in `stratify_by` are read here. The sample reads the rows it keeps
+    of other columns from the source when code uses them.
+
+    Args:
+        source (DataSource): The source to sample.
+        n_rows (int): The number of rows to draw.
+        stratify_by (Optional[Union[str, List[str]]]): Column(s) whose groups must all be represented.
+        seed (int): Seed for the random number generator.
+
+    Returns:
+        DataSource: The sampled rows, in their original order, or the source itself if it is small enough.
+    """
+    assert n_rows > 0, "The number of rows to sample must be positive."
+
+    n_total = len(source)
+    if n_total <= n_rows:
+        return source
+
+    groups = None
+    if stratify_by is not None:
+        keys = source.read(_as_list(stratify_by))
+        groups = keys.groupby(stratify_by, sort=False, dropna=False, observed=True).indices
+    return SampledSource(source, _sample_positions(n_total, n_rows, groups, seed))
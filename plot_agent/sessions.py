@@ -0,0 +1,423 @@
+"""
+This module contains the SessionManager class, which hosts many PlotAgent sessions behind session ids.
+
+Sessions:
+  • Share one LLM client, execution pool and figure cache, and the prepared agents built on them
+  • Count their dataframe, or the columns read from their data source, and figure against
+    a global memory budget. SQL query results are cached apart, in one shared QueryCache
+  • Are evicted in least recently used order when the budget is exceeded: their dataframe,
+    figure and agent executor are dropped, while their chat history and code are kept
+  • Are rehydrated on next use, through a hook that reloads their dataframe, and their
+    figure is rebuilt from the code that produced it
+
+Sessions in use are never evicted, so a node can host thousands of mostly idle
+sessions with only the active ones holding data.
+"""
+import asyncio
+import contextlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Callable, Optional
+
+import numpy as np
+import pandas as pd
+
+from plot_agent.agent import PlotAgent
+from plot_agent.sources import QueryCache
+
+
+def dataframe_bytes(df: Optional[pd.DataFrame]) -> int:
+    """
+    Estimate the memory a dataframe uses, including the contents of object columns.
+
+    Args:
+        df (Optional[pd.DataFrame]): The dataframe.
+
+    Returns:
+        int: The number of bytes, 0 if there is no dataframe.
+    """
+    if df is None:
+        return 0
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+def figure_bytes(fig) -> int:
+    """
+    Estimate the memory the data of a figure uses.
+
+    Args:
+        fig: The Plotly figure, or None.
+
+    Returns:
+        int: The number of bytes, 0 if there is no figure.
+    """
+    if fig is None or not hasattr(fig, "data"):
+        return 0
+    total = 0
+    for trace in fig.data:
+        for value in trace.to_plotly_json().values():
+            if isinstance(value, np.ndarray):
+                total += value.nbytes
+            elif isinstance(value, (list, tuple)):
+                # Roughly a pointer and a boxed number per element
+                total += 32 * len(value)
+    return total
+
+
+class _Session:
+    """A hosted agent and its bookkeeping."""
+
+    def __init__(self, session_id: str, agent: PlotAgent):
+        self.session_id = session_id
+        self.agent = agent
+        # Held while the session is evicted or rehydrated
+        self.lock = threading.Lock()
+        # Number of callers currently using the session; sessions in use are never evicted
+        self.in_use = 0
+        self.evicted = False
+        # The dataframe last measured, and the estimated bytes of it and the figure
+        self.df = None
+        self.df_bytes = 0
+        self.fig_bytes = 0
+        self.last_used = time.time()
+
+    @property
+    def memory_bytes(self) -> int:
+        return self.df_bytes + self.fig_bytes
+
+
+class SessionManager:
+    """
+    Hosts many PlotAgent sessions behind session ids, within a global memory budget.
+
+    Thread-safe: sessions can be used from many threads and event loops at once.
+    """
+
+    def __init__(
+        self,
+        memory_budget_bytes: int = 2 * 1024**3,
+        rehydrate: Optional[Callable] = None,
+        on_evict: Optional[Callable] = None,
+        restore_figures: bool = True,
+        query_cache: Optional[QueryCache] = None,
+        **agent_options,
+    ):
+        """
+        Initialize the session manager.
+
+        Args:
+            memory_budget_bytes (int): Approximate memory all sessions' dataframes and figures may
+                use. Idle sessions are evicted, least recently used first, to stay within it.
+            rehydrate (Optional[Callable]): Called with a session id when an evicted session is
+                used again. Returns its dataframe, a (dataframe, sql_query) tuple, or None if it
+                cannot be reloaded. Without it, evicted sessions need set_df() again.
+            on_evict (Optional[Callable]): Called with the session id and agent just before a
+                session's data is dropped, for example to persist its dataframe.
+            restore_figures (bool): Rebuild the figure of a rehydrated session from its code.
+            query_cache (Optional[QueryCache]): The cache of SQL query results that sessions set
+                with set_sql() share, within its own size limit. Defaults to a new QueryCache.
+            **agent_options: Options for every PlotAgent, as for PlotAgent(). The LLM client,
+                execution pool and figure cache are shared by all sessions.
+        """
+        assert memory_budget_bytes > 0, "The memory budget must be positive."
+
+        self.memory_budget_bytes = memory_budget_bytes
+        self.rehydrate = rehydrate
+        self.on_evict = on_evict
+        self.restore_figures = restore_figures
+        self.query_cache = query_cache if query_cache is not None else QueryCache()
+        # Sessions are spawned from this agent, so they share its LLM, pool and cache
+        self._template = PlotAgent(**agent_options)
+        # Sessions by id, least recently used first
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._memory_bytes = 0
+        self.evictions = 0
+        self.rehydrations = 0
+
+    def create_session(
+        self,
+        df: Optional[pd.DataFrame] = None,
+        sql_query: Optional[str] = None,
+        session_id: Optional[str] = None,
+    ) -> str:
+        """
+        Create a session, optionally with its dataframe.
+
+        Args:
+            df (Optional[pd.DataFrame]): The session's dataframe.
+            sql_query (Optional[str]): The SQL query used to generate the dataframe.
+            session_id (Optional[str]): The id to use. A random one is created if not given.
+
+        Returns:
+            str: The session id.
+        """
+        session_id = session_id or uuid.uuid4().hex
+        session = _Session(session_id, self._template._spawn())
+        with self._lock:
+            assert session_id not in self._sessions, f"Session {session_id!r} already exists."
+            self._sessions[session_id] = session
+        if df is not None:
+            self.set_df(session_id, df, sql_query)
+        return session_id
+
+    def close_session(self, session_id: str):
+        """
+        Close a session, releasing everything it holds.
+
+        Args:
+            session_id (str): The session id.
+        """
+        with self._lock:
+            session = self._sessions.pop(session_id)
+            self._memory_bytes -= session.memory_bytes
+        if session.agent.execution_env is not None:
+            session.agent.execution_env.close()
+
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self._sessions
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def memory_usage(self) -> int:
+        """
+        Report the estimated memory used by the sessions' dataframes and figures.
+
+        Returns:
+            int: The number of bytes.
+        """
+        return self._memory_bytes
+
+    def stats(self) -> dict:
+        """
+        Report the state of the hosted sessions.
+
+        Returns:
+            dict: The number of sessions, resident, evicted and in use, the memory used and
+            the budget, in bytes, and the number of evictions and rehydrations so far.
+        """
+        with self._lock:
+            sessions = list(self._sessions.values())
+            memory_bytes = self._memory_bytes
+        return {
+            "sessions": len(sessions),
+            "resident": sum(not session.evicted for session in sessions),
+            "evicted": sum(session.evicted for session in sessions),
+            "in_use": sum(session.in_use > 0 for session in sessions),
+            "memory_bytes": memory_bytes,
+            "memory_budget_bytes": self.memory_budget_bytes,
+            "evictions": self.evictions,
+            "rehydrations": self.rehydrations,
+        }
+
+    def _acquire(self, session_id: str) -> _Session:
+        """Mark a session in use and most recently used, rehydrating it if it was evicted."""
+        with self._lock:
+            session = self._sessions[session_id]
+            session.in_use += 1
+            self._sessions.move_to_end(session_id)
+        try:
+            with session.lock:
+                if session.evicted:
+                    self._rehydrate(session)
+        except BaseException:
+            self._release(session)
+            raise
+        return session
+
+    def _release(self, session: _Session):
+        """Mark a session no longer in use, update its memory and enforce the budget."""
+        # Measure what the agent holds now, however its dataframe was set
+        agent = session.agent
+        df = agent.df
+        if df is None and agent.source is not None:
+            # Only the columns read from the source so far are held in memory
+            df_bytes = agent.source.memory_usage()
+        else:
+            df_bytes = session.df_bytes if df is session.df else dataframe_bytes(df)
+        fig_bytes = figure_bytes(agent.get_figure())
+        with self._lock:
+            session.in_use -= 1
+            session.last_used = time.time()
+            if session.session_id in self._sessions:
+                self._memory_bytes += df_bytes + fig_bytes - session.memory_bytes
+            session.df, session.df_bytes, session.fig_bytes = df, df_bytes, fig_bytes
+            if df is not None or agent.source is not None:
+                session.evicted = False
+        self._enforce_budget()
+
+    @contextlib.contextmanager
+    def session(self, session_id: str):
+        """
+        Use a session's agent directly. The session is not evicted until the block exits.
+
+        Args:
+            session_id (str): The session id.
+
+        Yields:
+            PlotAgent: The session's agent, rehydrated if it had been evicted.
+        """
+        session = self._acquire(session_id)
+        try:
+            yield session.agent
+        finally:
+            self._release(session)
+
+    def set_df(self, session_id: str, df: pd.DataFrame, sql_query: Optional[str] = None):
+        """
+        Set a session's dataframe.
+
+        Args:
+            session_id (str): The session id.
+            df (pd.DataFrame): The dataframe.
+            sql_query (Optional[str]): The SQL query used to generate the dataframe.
+        """
+        with self.session(session_id) as agent:
+            agent.set_df(df, sql_query=sql_query)
+
+    def set_source(self, session_id: str, source, file_format: Optional[str] = None, sql_query: Optional[str] = None):
+        """
+        Set a session's data source, as PlotAgent.set_source does.
+
+        Only the columns read from the source count against the memory budget, and evicting
+        the session releases them. The source itself is kept, so the session is rehydrated
+        without the rehydrate hook.
+
+        Args:
+            session_id (str): The session id.
+            source: A DataSource, or the path of a Parquet, Feather or Arrow IPC file.
+            file_format (Optional[str]): The format of the file, if it cannot be told from its name.
+            sql_query (Optional[str]): The SQL query used to generate the data.
+        """
+        with self.session(session_id) as agent:
+            agent.set_source(source, file_format=file_format, sql_query=sql_query)
+
+    def set_sql(
+        self, session_id: str, connection, sql_query: str, name: Optional[str] = None, statistics: bool = False
+    ):
+        """
+        Set the result of a SQL query as a session's data, as PlotAgent.set_sql does.
+
+        Query results are cached in the manager's query_cache, so sessions plotting the same
+        database reuse each other's results.
+
+        Args:
+            session_id (str): The session id.
+            connection: A DB-API connection, or a function that opens one.
+            sql_query (str): The SELECT query whose result is the data.
+            name (Optional[str]): Identifies the database in cache keys, like its URL. Give the
+                same name to every session on one database for them to share results.
+            statistics (bool): Describe the nulls and value range of each column to the LLM,
+                scanning every row of the query result.
+        """
+        with self.session(session_id) as agent:
+            agent.set_sql(connection, sql_query, name=name, query_cache=self.query_cache, statistics=statistics)
+
+    def process_message(self, session_id: str, user_message: str) -> str:
+        """
+        Process a user message in a session, as PlotAgent.process_message does.
+
+        Args:
+            session_id (str): The session id.
+            user_message (str): The user message.
+
+        Returns:
+            str: The agent's response.
+        """
+        with self.session(session_id) as agent:
+            return agent.process_message(user_message)
+
+    async def aprocess_message(self, session_id: str, user_message: str) -> str:
+        """
+        Async version of process_message. Rehydration runs in the default executor.
+
+        Args:
+            session_id (str): The session id.
+            user_message (str): The user message.
+
+        Returns:
+            str: The agent's response.
+        """
+        loop = asyncio.get_running_loop()
+        session = await loop.run_in_executor(None, self._acquire, session_id)
+        try:
+            return await session.agent.aprocess_message(user_message)
+        finally:
+            await loop.run_in_executor(None, self._release, session)
+
+    def get_figure(self, session_id: str):
+        """
+        Return a session's current figure, rehydrating the session if needed.
+
+        Args:
+            session_id (str): The session id.
+
+        Returns:
+            The figure, or None if there is none.
+        """
+        with self.session(session_id) as agent:
+            return agent.get_figure()
+
+    def _enforce_budget(self):
+        """Evict idle sessions, least recently used first, until memory is within the budget."""
+        while self._memory_bytes > self.memory_budget_bytes:
+            with self._lock:
+                victim = next(
+                    (
+                        session
+                        for session in self._sessions.values()
+                        if not session.in_use and not session.evicted and session.memory_bytes
+                    ),
+                    None,
+                )
+            if victim is None:
+                # Everything left is in use
+                return
+            with victim.lock:
+                # It may have been picked up again in the meantime
+                with self._lock:
+                    if victim.in_use or victim.evicted:
+                        continue
+                self._evict(victim)
+
+    def _evict(self, session: _Session):
+        """Drop a session's dataframe, figure and agent executor, keeping its history and code."""
+        agent = session.agent
+        if self.on_evict is not None:
+            self.on_evict(session.session_id, agent)
+        if agent.execution_env is not None:
+            agent.execution_env.close()
+        agent.df = agent.df_info = agent.df_head = None
+        agent.execution_env = agent.agent_executor = None
+
+        with self._lock:
+            if session.session_id in self._sessions:
+                self._memory_bytes -= session.memory_bytes
+            session.df, session.df_bytes, session.fig_bytes = None, 0, 0
+            session.evicted = True
+            self.evictions += 1
+
+    def _rehydrate(self, session: _Session):
+        """Reload an evicted session's dataframe and figure."""
+        loaded = self.rehydrate(session.session_id) if self.rehydrate is not None else None
+        agent = session.agent
+        figure_code = agent.figure_code
+        if loaded is not None:
+            df, sql_query = loaded if isinstance(loaded, tuple) else (loaded, agent.sql_query)
+            agent.set_df(df, sql_query=sql_query)
+        elif agent.source is not None:
+            # The source was kept, and its columns are read again as they are used
+            agent.set_source(agent.source, sql_query=agent.sql_query)
+        else:
+            # Nothing to reload: the session needs set_df() again
+            return
+        if figure_code is not None and self.restore_figures:
+            agent.execution_env.execute_code(figure_code)
+            agent.figure_code = agent.execution_env.fig_code
+
+        session.evicted = False
+        with self._lock:
+            self.rehydrations += 1
@@ -0,0 +1,818 @@
+"""
+This module contains data sources, which let PlotAgent work on data that is not loaded up front.
+
+ArrowFileSource opens a Parquet, Feather or Arrow IPC file without reading its data:
+  • The schema, row count and (for Parquet) column statistics come from the file metadata
+  • The file is memory-mapped, and only the columns that generated code uses are read
+  • Columns are read once and kept, so later executions reuse them
+  • Sources pickle as their path, so worker processes open the file themselves
+
+pyarrow is only needed, and only imported, once a file source is opened.
+
+SqlSource wraps a SQL query on a DB-API connection:
+  • Only the columns that generated code uses are queried
+  • The aggregation helpers run as SQL in the database, so only their results are fetched
+  • Results are cached by normalized SQL, in a QueryCache that sources can share
+"""
+import hashlib
+import os
+import queue
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+# File formats by file extension
+_EXTENSIONS = {
+    ".parquet": "parquet",
+    ".parq": "parquet",
+    ".pq": "parquet",
+    ".feather": "feather",
+    ".fea": "feather",
+    ".arrow": "feather",
+    ".ipc": "feather",
+}
+
+# Leading bytes of each format, for files without a known extension
+_MAGIC = {b"PAR1": "parquet", b"ARROW1": "feather"}
+
+
+def _pyarrow():
+    """Import pyarrow, explaining how to get it if it is missing."""
+    try:
+        import pyarrow
+        import pyarrow.feather  # noqa: F401
+        import pyarrow.parquet  # noqa: F401
+    except ImportError as e:  # pragma: no cover - pyarrow is optional
+        raise ImportError("Reading Parquet, Feather or Arrow files needs pyarrow: pip install pyarrow") from e
+    return pyarrow
+
+
+def _as_list(columns) -> list:
+    """Return one column name or several as a list."""
+    if columns is None:
+        return []
+    return [columns] if isinstance(columns, str) else list(columns)
+
+
+def _detect_format(path: str) -> str:
+    """Work out the format of a file from its extension, or failing that its leading bytes."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension in _EXTENSIONS:
+        return _EXTENSIONS[extension]
+    with open(path, "rb") as f:
+        start = f.read(6)
+    for magic, file_format in _MAGIC.items():
+        if start.startswith(magic):
+            return file_format
+    raise ValueError(f"Cannot tell the format of {path!r}: expected a Parquet, Feather or Arrow IPC file.")
+
+
+class DataSource:
+    """
+    Data that is read on demand, one column at a time, instead of a dataframe held in memory.
+
+    Subclasses provide the schema and row count without reading the data, and read columns.
+    The aggregation helpers call the source's own versions of them when given a source,
+    which read only the columns they use, and can be overridden to run in the source.
+    """
+
+    # What the system prompt says about how the data is read
+    prompt_note = "Columns are read from the source when code uses them."
+    # Whether the source runs the aggregation helpers itself, like SQL sources in the database,
+    # so code passing it straight to them reads no columns
+    pushdown = False
+
+    @property
+    def columns(self) -> List[str]:
+        """The names of the columns, in order."""
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        """The number of rows."""
+        raise NotImplementedError
+
+    @property
+    def fingerprint(self) -> str:
+        """A fingerprint of the data, which changes whenever the data does."""
+        raise NotImplementedError
+
+    def read(self, columns: Optional[Iterable[str]] = None) -> pd.DataFrame:
+        """
+        Read columns into a dataframe.
+
+        Args:
+            columns (Optional[Iterable[str]]): The columns to read. Defaults to every column.
+
+        Returns:
+            pd.DataFrame: The columns, in their order in the source.
+        """
+        raise NotImplementedError
+
+    def head(self, n_rows: int = 5) -> pd.DataFrame:
+        """Read the first rows of every column."""
+        raise NotImplementedError
+
+    def column_statistics(self) -> Dict[str, dict]:
+        """
+        Report what the metadata says about each column, without reading the data.
+
+        Returns:
+            Dict[str, dict]: By column, the "nulls" count and the "min" and "max" values, each
+            present only if known.
+        """
+        return {}
+
+    def memory_usage(self) -> int:
+        """The bytes of data read so far and kept in memory."""
+        return 0
+
+    def release(self):
+        """Drop the data read so far. It is read again when next needed."""
+
+    def bin_histogram(self, column: str, bins: int = 50, range=None, weights: Optional[str] = None) -> pd.DataFrame:
+        """Count the rows per bin of a column, as plot_agent.aggregations.bin_histogram does."""
+        from plot_agent import aggregations
+
+        frame = self.read([column] + _as_list(weights))
+        return aggregations.bin_histogram(frame, column, bins=bins, range=range, weights=weights)
+
+    def top_k_groups(
+        self, by: str, value: Optional[str] = None, k: int = 10, agg: str = "sum", other: Optional[str] = "Other"
+    ) -> pd.DataFrame:
+        """Aggregate a column per group, keeping the k largest, as plot_agent.aggregations.top_k_groups does."""
+        from plot_agent import aggregations
+
+        frame = self.read([by] + _as_list(value))
+        return aggregations.top_k_groups(frame, by, value=value, k=k, agg=agg, other=other)
+
+    def aggregate(self, by, values=None, agg: str = "sum") -> pd.DataFrame:
+        """Aggregate columns per group, as plot_agent.aggregations.aggregate does."""
+        from plot_agent import aggregations
+
+        frame = self.read(_as_list(by) + _as_list(values))
+        return aggregations.aggregate(frame, by, values=values, agg=agg)
+
+
+class ArrowFileSource(DataSource):
+    """
+    A Parquet, Feather or Arrow IPC file, memory-mapped, whose columns are read on demand.
+
+    Thread-safe: columns can be read from many executions at once.
+    """
+
+    prompt_note = "Columns are read from the source when code uses them. Nulls and ranges are from its metadata."
+
+    def __init__(self, path, file_format: Optional[str] = None):
+        """
+        Open a file, reading only its metadata.
+
+        Args:
+            path: The path of the file.
+            file_format (Optional[str]): "parquet" or "feather", which covers Arrow IPC files
+                (Feather version 2 files are Arrow IPC files). Worked out from the file if not given.
+        """
+        self.path = os.fspath(path)
+        self.file_format = file_format or _detect_format(self.path)
+        assert self.file_format in ("parquet", "feather"), "The format must be 'parquet' or 'feather'."
+        self._lock = threading.Lock()
+        self._open()
+
+    def _open(self):
+        """Read the metadata, and start with no columns loaded."""
+        pa = _pyarrow()
+        if self.file_format == "parquet":
+            self._parquet = pa.parquet.ParquetFile(self.path, memory_map=True)
+            self.schema = self._parquet.schema_arrow
+            self._n_rows = self._parquet.metadata.num_rows
+        else:
+            with pa.ipc.open_file(pa.memory_map(self.path)) as reader:
+                self.schema = reader.schema
+                self._n_rows = reader.count_rows()
+
+        # Columns pandas stored its index in are read along with every column, to restore it
+        pandas_metadata = self.schema.pandas_metadata or {}
+        self._index_columns = [
+            name for name in pandas_metadata.get("index_columns", []) if isinstance(name, str)
+        ]
+        self._columns = [name for name in self.schema.names if name not in self._index_columns]
+
+        stat = os.stat(self.path)
+        self._fingerprint = hashlib.sha256(
+            repr((os.path.abspath(self.path), stat.st_size, stat.st_mtime_ns, self.schema.to_string())).encode()
+        ).hexdigest()
+
+        # Columns read so far, sharing one index, and their size in bytes
+        self._index = None
+        self._loaded = {}
+        self._loaded_bytes = 0
+
+    def __getstate__(self):
+        # Pickle as the path only: the unpickled source reopens the file
+        return {"path": self.path, "file_format": self.file_format}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        self._open()
+
+    def __repr__(self) -> str:
+        return f"ArrowFileSource({self.path!r}, file_format={self.file_format!r})"
+
+    @property
+    def columns(self) -> List[str]:
+        return list(self._columns)
+
+    def __len__(self) -> int:
+        return self._n_rows
+
+    @property
+    def fingerprint(self) -> str:
+        # Of the path, size, modification time and schema, so the data is never hashed
+        return self._fingerprint
+
+    def _read_table(self, columns: List[str], n_rows: Optional[int] = None):
+        """Read some columns of the file, and the columns holding its index, as an Arrow table."""
+        pa = _pyarrow()
+        columns = columns + self._index_columns
+        if self.file_format == "parquet":
+            if n_rows is None:
+                return self._parquet.read(columns=columns, use_threads=True)
+            # Only decode the first pages
+            batches = self._parquet.iter_batches(batch_size=n_rows, columns=columns)
+            batch = next(batches, None)
+            return pa.Table.from_batches([batch]) if batch is not None else self.schema.empty_table()
+        if n_rows is None:
+            return pa.feather.read_table(self.path, columns=columns, memory_map=True)
+        # Only decode the first record batch
+        with pa.ipc.open_file(pa.memory_map(self.path)) as reader:
+            if not reader.num_record_batches:
+                return self.schema.empty_table().select(columns)
+            return pa.Table.from_batches([reader.get_batch(0).select(columns).slice(0, n_rows)])
+
+    def read(self, columns: Optional[Iterable[str]] = None) -> pd.DataFrame:
+        wanted = set(self._columns if columns is None else columns)
+        names = [name for name in self._columns if name in wanted]
+        with self._lock:
+            missing = [name for name in names if name not in self._loaded]
+            if missing or self._index is None:
+                frame = self._read_table(missing).to_pandas(split_blocks=True)
+                if self._index is None:
+                    self._index = frame.index
+                for name in missing:
+                    # Share one index, so frames are put together without aligning them
+                    series = frame[name].set_axis(self._index)
+                    self._loaded[name] = series
+                    self._loaded_bytes += int(series.memory_usage(index=False, deep=True))
+            data = {name: self._loaded[name] for name in names}
+            index = self._index
+        return pd.DataFrame(data, index=index, columns=names, copy=False)
+
+    def head(self, n_rows: int = 5) -> pd.DataFrame:
+        return self._read_table(self.columns, n_rows=n_rows).to_pandas()
+
+    def column_statistics(self) -> Dict[str, dict]:
+        if self.file_format != "parquet":
+            # Arrow IPC files keep no statistics
+            return {}
+        metadata = self._parquet.metadata
+        positions = {metadata.schema.column(i).path: i for i in range(metadata.num_columns)}
+        statistics = {}
+        for name in self._columns:
+            if name not in positions:
+                # Nested columns are stored as several leaf columns
+                continue
+            chunks = [
+                metadata.row_group(group).column(positions[name]).statistics
+                for group in range(metadata.num_row_groups)
+            ]
+            column = {}
+            if chunks and all(chunk is not None and chunk.has_null_count for chunk in chunks):
+                column["nulls"] = sum(chunk.null_count for chunk in chunks)
+            if chunks and all(chunk is not None and chunk.has_min_max for chunk in chunks):
+                try:
+                    column["min"] = min(chunk.min for chunk in chunks)
+                    column["max"] = max(chunk.max for chunk in chunks)
+                except TypeError:
+                    # Values that cannot be compared, like bytes against str
+                    pass
+            statistics[name] = column
+        return statistics
+
+    def memory_usage(self) -> int:
+        return self._loaded_bytes
+
+    def release(self):
+        with self._lock:
+            self._index = None
+            self._loaded = {}
+            self._loaded_bytes = 0
+
+
+# Tokens of SQL text: quoted strings and identifiers, comments, whitespace, words and symbols
+_SQL_TOKENS = re.compile(
+    r"""
+    '(?:[^']|'')*'
+    | "(?:[^"]|"")*"
+    | `[^`]*`
+    | --[^\n]*
+    | /\*.*?\*/
+    | \s+
+    | \w+
+    | .
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+
+
+def normalize_sql(sql: str) -> str:
+    """
+    Normalize SQL so that comments, formatting and the case of keywords do not change it.
+
+    Quoted strings and identifiers are kept as they are, and everything else is lowercased,
+    since unquoted identifiers and keywords are case-insensitive in SQL.
+
+    Args:
+        sql (str): The SQL text.
+
+    Returns:
+        str: The normalized SQL, with tokens separated by single spaces.
+    """
+    tokens = []
+    for token in _SQL_TOKENS.findall(sql):
+        if token.isspace() or token.startswith(("--", "/*")):
+            continue
+        tokens.append(token if token[0] in "'\"`" else token.lower())
+    while tokens and tokens[-1] == ";":
+        tokens.pop()
+    return " ".join(tokens)
+
+
+class QueryCache:
+    """
+    A thread-safe LRU cache of query results, keyed by database and normalized SQL.
+
+    Share one between SqlSources on the same database, for example across sessions,
+    so they reuse each other's results. Entries expire after `ttl_seconds`, if given,
+    since the database may change.
+    """
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024, ttl_seconds: Optional[float] = None):
+        """
+        Initialize the cache.
+
+        Args:
+            max_bytes (int): Maximum total memory of the results to keep.
+            ttl_seconds (Optional[float]): Seconds after which results are queried again.
+        """
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        # Cache key -> (size in bytes, time stored, result)
+        self._entries = OrderedDict()
+        self._bytes = 0
+
+    def get(self, key: Tuple) -> Optional[pd.DataFrame]:
+        """
+        Look up a query result.
+
+        Args:
+            key (Tuple): The database, the normalized SQL and the number of rows fetched.
+
+        Returns:
+            Optional[pd.DataFrame]: The result, or None on a miss.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl_seconds is not None and time.time() - entry[1] > self.ttl_seconds:
+                del self._entries[key]
+                self._bytes -= entry[0]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, key: Tuple, result: pd.DataFrame):
+        """
+        Store a query result.
+
+        Args:
+            key (Tuple): The database, the normalized SQL and the number of rows fetched.
+            result (pd.DataFrame): The result.
+        """
+        size = int(result.memory_usage(index=True, deep=True).sum())
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[0]
+            self._entries[key] = (size, time.time(), result)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (evicted_size, _, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        """Remove every result."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def memory_usage(self) -> int:
+        """The bytes of results kept."""
+        return self._bytes
+
+    def cache_info(self) -> dict:
+        """
+        Report cache statistics.
+
+        Returns:
+            dict: Hits, misses, evictions, current entry count and size in bytes.
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+            }
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# Aggregations that run as SQL, by name
+_SQL_AGGREGATES = {"sum": "SUM", "mean": "AVG", "min": "MIN", "max": "MAX", "count": "COUNT"}
+
+# Columns whose statistics are queried together, to stay within database limits on result columns
+_STATISTICS_BATCH = 100
+
+
+class SqlSource(DataSource):
+    """
+    The result of a SQL query on a DB-API connection, whose columns are queried on demand.
+
+    Queries wrap the original one as a subquery, so any SELECT works. Every result is
+    cached by its normalized SQL, and the aggregation helpers run as SQL.
+
+    Thread-safe: queries from many executions run one at a time on a shared connection,
+    or each on a connection of its own when the source is given a function that opens
+    connections. Connections are used from several threads, so SQLite ones must be
+    opened with check_same_thread=False.
+    """
+
+    prompt_note = (
+        "The data is the result of a SQL query, and columns are queried when code uses them. Code that passes df "
+        "straight to aggregate(), top_k_groups() or bin_histogram() runs them in the database, so only their "
+        "small results are fetched: prefer them to working on raw rows."
+    )
+
+    pushdown = True
+
+    # Quote character of identifiers, as in standard SQL. MySQL without ANSI_QUOTES needs "`"
+    identifier_quote = '"'
+
+    def __init__(
+        self,
+        connection,
+        query: str,
+        name: Optional[str] = None,
+        query_cache: Optional[QueryCache] = None,
+        statistics: bool = False,
+    ):
+        """
+        Wrap a query, running it only to learn its columns.
+
+        Args:
+            connection: A DB-API connection, or a function that opens one. Sources given a
+                function can also be sent to worker pools, which open their own connections.
+            query (str): The SELECT query whose result is the data.
+            name (Optional[str]): Identifies the database in cache keys and fingerprints,
+                like its URL. Give sources on one database the same name to share cached
+                results. Defaults to a name unique to this source, since neither connections
+                nor functions identify their database reliably.
+            query_cache (Optional[QueryCache]): A cache of query results, shared with other
+                sources. Defaults to one of this source's own.
+            statistics (bool): Report the nulls and value range of each column in
+                column_statistics(). Off by default, since finding them scans every row.
+        """
+        self.query = query.strip().rstrip(";").strip()
+        assert self.query, "The SQL query must not be empty."
+        if hasattr(connection, "cursor"):
+            self._connect = None
+        else:
+            assert callable(connection), "The connection must be a DB-API connection or a function opening one."
+            self._connect, connection = connection, None
+        self.name = name or f"database-{uuid.uuid4().hex}"
+        self.query_cache = query_cache
+        self.statistics = statistics
+        self._open(connection)
+
+    def _open(self, connection=None):
+        """Set up the connections and the cache, and query the columns."""
+        # Idle connections, most recently used first
+        self._connections = queue.LifoQueue()
+        if connection is not None:
+            self._connections.put(connection)
+        self._own_cache = self.query_cache is None
+        if self._own_cache:
+            self.query_cache = QueryCache()
+        self._columns = list(self._fetch(f"SELECT * FROM {self._from} WHERE 1 = 0").columns)
+
+    def __getstate__(self):
+        # Pickle as the way to connect and the query: the unpickled source connects itself
+        if self._connect is None:
+            raise TypeError(
+                "A SqlSource on a connection cannot be sent to another process. "
+                "Give it a function that opens a connection instead."
+            )
+        return {
+            "query": self.query,
+            "name": self.name,
+            "_connect": self._connect,
+            "query_cache": None,
+            "statistics": self.statistics,
+        }
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._open()
+
+    def __repr__(self) -> str:
+        return f"SqlSource({self.name!r}, {self.query!r})"
+
+    @property
+    def _from(self) -> str:
+        """The FROM clause selecting from the result of the query."""
+        # On lines of their own, so a comment ending the query does not swallow the parenthesis
+        return f"(\n{self.query}\n) plot_agent_data"
+
+    def _quote(self, name: str) -> str:
+        """Quote an identifier."""
+        quote = self.identifier_quote
+        return quote + str(name).replace(quote, quote * 2) + quote
+
+    def _check_columns(self, columns: Iterable[str]):
+        for column in columns:
+            assert column in self._columns, f"Column {column!r} is not in the dataframe."
+
+    def _fetch(self, sql: str, max_rows: Optional[int] = None) -> pd.DataFrame:
+        """Run a query, or reuse its cached result, fetching at most `max_rows` rows."""
+        key = (self.name, normalize_sql(sql), max_rows)
+        result = self.query_cache.get(key)
+        if result is not None:
+            return result
+
+        try:
+            connection = self._connections.get(block=self._connect is None)
+        except queue.Empty:
+            connection = self._connect()
+        try:
+            cursor = connection.cursor()
+            try:
+                cursor.execute(sql)
+                rows = cursor.fetchall() if max_rows is None else cursor.fetchmany(max_rows)
+                names = [description[0] for description in cursor.description]
+            finally:
+                cursor.close()
+        finally:
+            self._connections.put(connection)
+
+        result = pd.DataFrame.from_records(rows, columns=names)
+        self.query_cache.put(key, result)
+        return result
+
+    @property
+    def columns(self) -> List[str]:
+        return list(self._columns)
+
+    def __len__(self) -> int:
+        return int(self._fetch(f"SELECT COUNT(*) AS n FROM {self._from}").iloc[0, 0])
+
+    @property
+    def fingerprint(self) -> str:
+        # Of the database and the query: results are cached the same way
+        return hashlib.sha256(repr((self.name, normalize_sql(self.query))).encode()).hexdigest()
+
+    def read(self, columns: Optional[Iterable[str]] = None) -> pd.DataFrame:
+        wanted = set(self._columns if columns is None else columns)
+        names = [name for name in self._columns if name in wanted]
+        if not names:
+            return pd.DataFrame(index=pd.RangeIndex(len(self)))
+        # One query, so the rows of every column line up. Copied, so code changing the frame
+        # in place does not change the cached result (the copy is shallow under copy-on-write)
+        return self._fetch(f"SELECT {', '.join(map(self._quote, names))} FROM {self._from}").copy()
+
+    def head(self, n_rows: int = 5) -> pd.DataFrame:
+        return self._fetch(f"SELECT * FROM {self._from}", max_rows=n_rows).copy()
+
+    def column_statistics(self) -> Dict[str, dict]:
+        statistics = {}
+        if not self.statistics:
+            # Unlike file metadata, these come from scanning every row
+            return statistics
+        for start in range(0, len(self._columns), _STATISTICS_BATCH):
+            batch = self._columns[start : start + _STATISTICS_BATCH]
+            selected = []
+            for index, name in enumerate(batch):
+                column = self._quote(name)
+                selected += [
+                    f"COUNT(*) - COUNT({column}) AS nulls_{index}",
+                    f"MIN({column}) AS min_{index}",
+                    f"MAX({column}) AS max_{index}",
+                ]
+            row = self._fetch(f"SELECT {', '.join(selected)} FROM {self._from}").iloc[0]
+            for index, name in enumerate(batch):
+                column = {"nulls": int(row[f"nulls_{index}"])}
+                if row[f"min_{index}"] is not None and not pd.isna(row[f"min_{index}"]):
+                    column["min"], column["max"] = row[f"min_{index}"], row[f"max_{index}"]
+                statistics[name] = column
+        return statistics
+
+    def memory_usage(self) -> int:
+        # Results in a shared cache are not this source's alone
+        return self.query_cache.memory_usage() if self._own_cache else 0
+
+    def release(self):
+        if self._own_cache:
+            self.query_cache.clear()
+
+    def _aggregate_sql(self, agg: str, column: str) -> str:
+        """The SQL aggregating a column, which like pandas sums missing values to 0."""
+        sql = f"{_SQL_AGGREGATES[agg]}({self._quote(column)})"
+        return f"COALESCE({sql}, 0)" if agg == "sum" else sql
+
+    def bin_histogram(self, column: str, bins: int = 50, range=None, weights: Optional[str] = None) -> pd.DataFrame:
+        assert bins > 0, "bins must be positive."
+        self._check_columns([column] + _as_list(weights))
+        quoted = self._quote(column)
+        if range is None:
+            bounds = self._fetch(f"SELECT MIN({quoted}) AS low, MAX({quoted}) AS high FROM {self._from}")
+            range = (bounds.iloc[0, 0], bounds.iloc[0, 1])
+        low, high = range
+        if not all(isinstance(bound, (int, float, np.number)) and not isinstance(bound, bool) for bound in range):
+            # Datetimes and values the database does not compare as numbers are binned in pandas
+            return super().bin_histogram(column, bins=bins, range=range, weights=weights)
+        low, high = float(low), float(high)
+        if low == high:
+            # As numpy does for a single value
+            low, high = low - 0.5, high + 0.5
+
+        # Bin like numpy: the highest value goes in the last bin, not one past it, as do values
+        # just below it that rounding puts there. CASE rather than MIN(), which in most
+        # databases only aggregates
+        position = f"CAST(({quoted} - {low!r}) * {bins / (high - low)!r} AS INTEGER)"
+        index = f"CASE WHEN {position} >= {bins} THEN {bins - 1} ELSE {position} END"
+        total = "COUNT(*)" if weights is None else f"SUM({self._quote(weights)})"
+        counts = self._fetch(
+            f"SELECT {index} AS bin, {total} AS total FROM {self._from} "
+            f"WHERE {quoted} >= {low!r} AND {quoted} <= {high!r} GROUP BY {index}"
+        )
+
+        values = np.zeros(bins, dtype=int if weights is None else float)
+        values[counts["bin"].to_numpy(dtype=int)] = counts["total"].to_numpy()
+        edges = np.linspace(low, high, bins + 1)
+        return pd.DataFrame(
+            {
+                "bin_start": edges[:-1],
+                "bin_end": edges[1:],
+                "bin_center": edges[:-1] + (edges[1:] - edges[:-1]) / 2,
+                "count": values,
+            }
+        )
+
+    def top_k_groups(
+        self, by: str, value: Optional[str] = None, k: int = 10, agg: str = "sum", other: Optional[str] = "Other"
+    ) -> pd.DataFrame:
+        assert k > 0, "k must be positive."
+        if agg not in _SQL_AGGREGATES:
+            return super().top_k_groups(by, value=value, k=k, agg=agg, other=other)
+        self._check_columns([by] + _as_list(value))
+        key = self._quote(by)
+        name = "count" if value is None else value
+        total = "COUNT(*)" if value is None else self._aggregate_sql(agg, value)
+        where = f"FROM {self._from} WHERE {key} IS NOT NULL"
+
+        # One more group than kept, to know if there are others
+        groups = self._fetch(
+            f"SELECT {key}, {total} AS {self._quote(name)} {where} GROUP BY {key} "
+            f"ORDER BY {self._quote(name)} DESC, {key}",
+            max_rows=k + 1,
+        )
+        result = groups.iloc[:k].copy()
+        if other is not None and len(groups) > k:
+            if value is not None and agg not in ("sum", "count"):
+                # Other aggregates are not additive, so aggregate the remaining rows together in pandas
+                return super().top_k_groups(by, value=value, k=k, agg=agg, other=other)
+            rest = self._fetch(f"SELECT {total} AS total {where}").iloc[0, 0] - result[name].sum()
+            # Object dtype, so the label fits whatever the type of the groups
+            result[by] = result[by].astype(object)
+            result.loc[len(result)] = {by: other, name: rest}
+        return result
+
+    def aggregate(self, by, values=None, agg: str = "sum") -> pd.DataFrame:
+        if values is not None and agg not in _SQL_AGGREGATES:
+            return super().aggregate(by, values=values, agg=agg)
+        by_columns, value_columns = _as_list(by), _as_list(values)
+        self._check_columns(by_columns + value_columns)
+        keys = ", ".join(map(self._quote, by_columns))
+        if values is None:
+            totals = f"COUNT(*) AS {self._quote('count')}"
+        else:
+            totals = ", ".join(f"{self._aggregate_sql(agg, column)} AS {self._quote(column)}" for column in value_columns)
+        # Like pandas, leave out rows missing a group
+        where = " AND ".join(f"{self._quote(column)} IS NOT NULL" for column in by_columns)
+        return self._fetch(
+            f"SELECT {keys}, {totals} FROM {self._from} WHERE {where} GROUP BY {keys} ORDER BY {keys}"
+        ).copy()
+
+
+class SampledSource(DataSource):
+    """
+    Some of the rows of another source, at fixed positions, read from it as code uses their columns.
+
+    Sources that run the aggregation helpers themselves still do, on every row, since
+    aggregating in the database costs about as little as sampling.
+    """
+
+    def __init__(self, source: DataSource, positions: np.ndarray):
+        """
+        Sample a source.
+
+        Args:
+            source (DataSource): The source sampled.
+            positions (np.ndarray): The positions of the rows sampled.
+        """
+        self.source = source
+        self.positions = np.sort(positions)
+        self.prompt_note = source.prompt_note
+        self.pushdown = source.pushdown
+
+    def __repr__(self) -> str:
+        return f"SampledSource({self.source!r}, {len(self.positions)} rows)"
+
+    @property
+    def columns(self) -> List[str]:
+        return self.source.columns
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    @property
+    def fingerprint(self) -> str:
+        return hashlib.sha256(self.source.fingerprint.encode() + self.positions.tobytes()).hexdigest()
+
+    def read(self, columns: Optional[Iterable[str]] = None) -> pd.DataFrame:
+        return self.source.read(columns).iloc[self.positions]
+
+    def head(self, n_rows: int = 5) -> pd.DataFrame:
+        return self.source.read().iloc[self.positions[:n_rows]]
+
+    def bin_histogram(self, column: str, bins: int = 50, range=None, weights: Optional[str] = None) -> pd.DataFrame:
+        if self.pushdown:
+            return self.source.bin_histogram(column, bins=bins, range=range, weights=weights)
+        return super().bin_histogram(column, bins=bins, range=range, weights=weights)
+
+    def top_k_groups(
+        self, by: str, value: Optional[str] = None, k: int = 10, agg: str = "sum", other: Optional[str] = "Other"
+    ) -> pd.DataFrame:
+        if self.pushdown:
+            return self.source.top_k_groups(by, value=value, k=k, agg=agg, other=other)
+        return super().top_k_groups(by, value=value, k=k, agg=agg, other=other)
+
+    def aggregate(self, by, values=None, agg: str = "sum") -> pd.DataFrame:
+        if self.pushdown:
+            return self.source.aggregate(by, values=values, agg=agg)
+        return super().aggregate(by, values=values, agg=agg)
+
+
+def open_source(source, file_format: Optional[str] = None) -> DataSource:
+    """
+    Open a data source, passing existing sources through.
+
+    Args:
+        source: A DataSource, or the path of a Parquet, Feather or Arrow IPC file.
+        file_format (Optional[str]): The format of the file, if it cannot be told from its name.
+
+    Returns:
+        DataSource: The source.
+    """
+    if isinstance(source, DataSource):
+        return source
+    return ArrowFileSource(source, file_format=file_format)
+
@@ -0,0 +1,90 @@
+"""
+This module contains the events used to stream the progress of process_message.
+
+Events are dicts with a "type" key:
+  • token: A piece of LLM output as it is generated, in "text"
+  • tool_start: A tool call starting, with the tool's "name" and its "input"
+  • tool_end: A tool call finishing, with the tool's "name" and its "output"
+  • figure: Code produced a figure, with the "fig", the "code" that produced it, and
+    whether it was only rendered on the "preview" sample
+  • response: The agent's final response, in "output", always the last event
+
+LLM tokens and tool calls are collected by a LangChain callback handler, so
+they arrive as they happen rather than once the agent loop is done. The handler
+is a streaming handler to LangChain, so chat models given it stream their
+replies even when invoked.
+"""
+import functools
+from typing import Callable
+
+
+@functools.lru_cache(maxsize=None)
+def _callback_handler_class():
+    """Define the LangChain callback handler on first use, so LangChain is only imported when needed."""
+    from langchain_core.callbacks import BaseCallbackHandler
+    from langchain_core.tracers._streaming import _StreamingCallbackHandler
+
+    class StreamingCallbackHandler(BaseCallbackHandler, _StreamingCallbackHandler):
+        """Passes LLM tokens and tool calls to a sink as events."""
+
+        # The sink is thread-safe, so there is no need to hop to a thread for async runs
+        run_inline = True
+
+        def __init__(self, sink: Callable[[dict], None]):
+            self.sink = sink
+            # Tool names by run id, since on_tool_end is not given the name
+            self._tools = {}
+
+        def tap_output_iter(self, run_id, output):
+            # Outputs of runnables are not events, only what the callbacks below are given
+            return output
+
+        def tap_output_aiter(self, run_id, output):
+            return output
+
+        def on_llm_new_token(self, token, **kwargs):
+            # Tool call chunks come with empty text
+            if token:
+                self.sink({"type": "token", "text": token})
+
+        def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+            name = (serialized or {}).get("name") or kwargs.get("name")
+            self._tools[run_id] = name
+            self.sink({"type": "tool_start", "name": name, "input": input_str})
+
+        def on_tool_end(self, output, *, run_id, **kwargs):
+            output = getattr(output, "content", output)
+            self.sink({"type": "tool_end", "name": self._tools.pop(run_id, None), "output": str(output)})
+
+        def on_tool_error(self, error, *, run_id, **kwargs):
+            self.sink({"type": "tool_end", "name": self._tools.pop(run_id, None), "output": f"Error: {error}"})
+
+    return StreamingCallbackHandler
+
+
+def streaming_callback_handler(sink: Callable[[dict], None]):
+    """
+    Create a LangChain callback handler that passes LLM tokens and tool calls to `sink`.
+
+    Args:
+        sink (Callable[[dict], None]): Called with each event. May be called from any thread.
+
+    Returns:
+        BaseCallbackHandler: The handler, to pass in the `callbacks` of a run config.
+    """
+    return _callback_handler_class()(sink)
+
+
+def figure_event(fig, code: str, preview: bool = False) -> dict:
+    """
+    Build the event announcing a figure.
+
+    Args:
+        fig: The figure.
+        code (str): The code that produced it.
+        preview (bool): Whether it was only rendered on the preview sample.
+
+    Returns:
+        dict: The event.
+    """
+    return {"type": "figure", "fig": fig, "code": code, "preview": preview}
@@ -0,0 +1,193 @@
+"""
+This module contains a stand-in chat model, to run PlotAgent offline in tests and load tests.
+
+ScriptedChatModel replays a script of steps for every user message, instead of calling an LLM:
+  • A tool call step, {"tool": "execute_plotly_code", "args": {"generated_code": "..."}}
+  • A reply step, {"content": "..."}, which ends the agent loop
+
+It works out which step to play from the conversation itself, so one model can be
+shared by many concurrent sessions. Latency is simulated, and token usage is
+estimated from the text, so timings and metrics look like those of a real model.
+Scripts are plain JSON, so recorded conversations can be replayed with from_file().
+"""
+import asyncio
+import json
+import random
+import time
+import uuid
+from typing import Iterator, List
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from plot_agent.profiling import estimate_tokens
+
+
+# A typical session: a failed first attempt, a fix, then a reply with the final code.
+# Expects a dataframe with numeric "x" and "y" columns and a "category" column
+DEFAULT_SCRIPT = [
+    {
+        "tool": "execute_plotly_code",
+        "args": {"generated_code": "fig = px.line(df, x='date', y='value')"},
+    },
+    {
+        "tool": "execute_plotly_code",
+        "args": {
+            "generated_code": (
+                "import plotly.express as px\n\n"
+                "fig = px.line(df, x='x', y='y', color='category', title='y over x by category')\n"
+                "fig.update_layout(legend_title_text='Category')"
+            )
+        },
+    },
+    {
+        "content": (
+            "I created a line chart of y over x, with one line per category:\n\n"
+            "```python\n"
+            "import plotly.express as px\n\n"
+            "fig = px.line(df, x='x', y='y', color='category', title='y over x by category')\n"
+            "fig.update_layout(legend_title_text='Category')\n"
+            "```"
+        )
+    },
+]
+
+
+def _text(message) -> str:
+    """Return the text of a message, including its tool calls."""
+    text = message.content if isinstance(message.content, str) else json.dumps(message.content)
+    for call in getattr(message, "tool_calls", None) or []:
+        text += json.dumps(call.get("args", {}))
+    return text
+
+
+class ScriptedChatModel(BaseChatModel):
+    """
+    A chat model that replays a script of tool calls and replies for every user message.
+
+    Attributes:
+        script (List[dict]): The steps played for each user message, in order.
+        latency (float): Seconds each call takes before its first token.
+        jitter (float): Up to this many seconds are added to the latency at random.
+        seconds_per_token (float): Seconds between streamed tokens of a reply.
+    """
+
+    script: List[dict] = DEFAULT_SCRIPT
+    latency: float = 0.0
+    jitter: float = 0.0
+    seconds_per_token: float = 0.0
+
+    @classmethod
+    def from_file(cls, path: str, **kwargs) -> "ScriptedChatModel":
+        """
+        Load a script from a JSON file holding a list of steps.
+
+        Args:
+            path (str): The path of the JSON file.
+            **kwargs: Other attributes, like latency.
+
+        Returns:
+            ScriptedChatModel: The model.
+        """
+        with open(path) as f:
+            return cls(script=json.load(f), **kwargs)
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted"
+
+    def bind_tools(self, tools, **kwargs):
+        # The script decides which tools are called
+        return self
+
+    def _step(self, messages: list) -> dict:
+        """Pick the step to play: one per model reply since the latest user message."""
+        replies = 0
+        for message in reversed(messages):
+            if isinstance(message, HumanMessage):
+                break
+            # The agent passes earlier replies back as chunks
+            replies += isinstance(message, AIMessage)
+        # Stop at the last step if the agent keeps going past the script
+        return self.script[min(replies, len(self.script) - 1)]
+
+    def _delay(self) -> float:
+        """Pick how long the call takes before its first token."""
+        return self.latency + random.uniform(0, self.jitter)
+
+    def _chunks(self, messages: list) -> Iterator[AIMessageChunk]:
+        """Split the reply into the chunks a streaming model would send."""
+        step = self._step(messages)
+        usage = {
+            "input_tokens": sum(estimate_tokens(_text(message)) for message in messages),
+            "output_tokens": estimate_tokens(step.get("content", "") + json.dumps(step.get("args", {}))),
+        }
+        usage["total_tokens"] = usage["input_tokens"] + usage["output_tokens"]
+
+        if "tool" in step:
+            yield AIMessageChunk(
+                content="",
+                tool_call_chunks=[
+                    {
+                        "name": step["tool"],
+                        "args": json.dumps(step.get("args", {})),
+                        "id": f"call_{uuid.uuid4().hex[:12]}",
+                        "index": 0,
+                    }
+                ],
+                usage_metadata=usage,
+            )
+            return
+
+        words = step["content"].split(" ")
+        for index, word in enumerate(words):
+            last = index == len(words) - 1
+            yield AIMessageChunk(
+                content=word if last else word + " ", usage_metadata=usage if last else None
+            )
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self._delay())
+        for index, message in enumerate(self._chunks(messages)):
+            if index and self.seconds_per_token:
+                time.sleep(self.seconds_per_token)
+            chunk = ChatGenerationChunk(message=message)
+            if run_manager:
+                run_manager.on_llm_new_token(message.content, chunk=chunk)
+            yield chunk
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self._delay())
+        for index, message in enumerate(self._chunks(messages)):
+            if index and self.seconds_per_token:
+                await asyncio.sleep(self.seconds_per_token)
+            chunk = ChatGenerationChunk(message=message)
+            if run_manager:
+                await run_manager.on_llm_new_token(message.content, chunk=chunk)
+            yield chunk
+
+    @staticmethod
+    def _result(chunks: List[ChatGenerationChunk]) -> ChatResult:
+        """Merge streamed chunks into a single reply."""
+        message = None
+        for chunk in chunks:
+            message = chunk.message if message is None else message + chunk.message
+        reply = AIMessage(
+            content=message.content,
+            tool_calls=message.tool_calls,
+            usage_metadata=message.usage_metadata,
+        )
+        return ChatResult(generations=[ChatGeneration(message=reply)])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        # Like real chat models, invoking returns the whole reply, taking as long as streaming it,
+        # and only streaming calls the token callbacks
+        chunks = [ChatGenerationChunk(message=message) for message in self._chunks(messages)]
+        time.sleep(self._delay() + self.seconds_per_token * (len(chunks) - 1))
+        return self._result(chunks)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        chunks = [ChatGenerationChunk(message=message) for message in self._chunks(messages)]
+        await asyncio.sleep(self._delay() + self.seconds_per_token * (len(chunks) - 1))
+        return self._result(chunks)
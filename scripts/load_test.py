@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Offline load test: run concurrent simulated PlotAgent sessions against a scripted stand-in LLM.
+
+Every session sets its own dataframe and sends a number of messages through
+process_message (or aprocess_message with --mode async). The LLM is replaced by
+plot_agent.testing.ScriptedChatModel, so no API is called and LLM latency is
+simulated. Reports throughput, and p50/p99 latency per stage from the message metrics.
+
+    python scripts/load_test.py --sessions 32 --messages 5 --latency 0.8 --jitter 0.4
+    python scripts/load_test.py --mode async --sessions 200 --script recorded_session.json
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Run from a checkout without installing the package
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from plot_agent.agent import PlotAgent  # noqa: E402
+from plot_agent.pool import PlotAgentWorkerPool  # noqa: E402
+from plot_agent.testing import ScriptedChatModel  # noqa: E402
+
+
+def make_df(n_rows: int, seed: int) -> pd.DataFrame:
+    """Create a session dataframe with the columns the default script plots."""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame(
+        {
+            "x": np.arange(n_rows, dtype=float),
+            "y": rng.normal(size=n_rows).cumsum(),
+            "category": rng.choice(["alpha", "beta", "gamma"], n_rows),
+        }
+    )
+
+
+def record(samples: dict, metrics: dict):
+    """Add the stage timings of a message to the samples, by stage."""
+    samples["message"].append(metrics["total_seconds"])
+    for stage, seconds in metrics["stages"].items():
+        samples[stage].append(seconds)
+    samples["llm_call"].extend(call["seconds"] for call in metrics["llm_calls"])
+    samples["execute_code"].extend(execution["seconds"] for execution in metrics["executions"])
+
+
+def run_session(index: int, args, llm, pool, samples: dict) -> int:
+    """Run one session on the current thread, returning the number of failed messages."""
+    agent = PlotAgent(verbose=False, llm=llm, execution_pool=pool)
+    started = time.perf_counter()
+    agent.set_df(make_df(args.rows, index))
+    samples["set_df"].append(time.perf_counter() - started)
+
+    failures = 0
+    for message in range(args.messages):
+        try:
+            agent.process_message(f"Plot y over x by category ({message})")
+            failures += agent.get_figure() is None
+        except Exception:
+            failures += 1
+        record(samples, agent.last_metrics)
+    return failures
+
+
+async def arun_session(index: int, args, llm, pool, samples: dict) -> int:
+    """Run one session on the event loop, returning the number of failed messages."""
+    agent = PlotAgent(verbose=False, llm=llm, execution_pool=pool)
+    started = time.perf_counter()
+    await asyncio.get_running_loop().run_in_executor(None, agent.set_df, make_df(args.rows, index))
+    samples["set_df"].append(time.perf_counter() - started)
+
+    failures = 0
+    for message in range(args.messages):
+        try:
+            await agent.aprocess_message(f"Plot y over x by category ({message})")
+            failures += agent.get_figure() is None
+        except Exception:
+            failures += 1
+        record(samples, agent.last_metrics)
+    return failures
+
+
+def summarize(samples: dict, wall_seconds: float, messages: int, failures: int) -> dict:
+    """Summarize a run: throughput and latency percentiles per stage."""
+    return {
+        "messages": messages,
+        "failures": failures,
+        "wall_seconds": wall_seconds,
+        "messages_per_second": messages / wall_seconds,
+        "stages": {
+            stage: {
+                "count": len(values),
+                "p50": float(np.percentile(values, 50)),
+                "p99": float(np.percentile(values, 99)),
+                "max": float(np.max(values)),
+            }
+            for stage, values in samples.items()
+            if values
+        },
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sessions", type=int, default=8, help="concurrent sessions (default: 8)")
+    parser.add_argument("--messages", type=int, default=3, help="messages per session (default: 3)")
+    parser.add_argument("--rows", type=int, default=10_000, help="rows per session dataframe (default: 10000)")
+    parser.add_argument("--mode", choices=["thread", "async"], default="thread", help="how sessions run")
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds per LLM call (default: 0.5)")
+    parser.add_argument("--jitter", type=float, default=0.2, help="random extra seconds per LLM call")
+    parser.add_argument("--seconds-per-token", type=float, default=0.0, help="delay between streamed tokens")
+    parser.add_argument("--script", help="JSON file with the steps the LLM plays for every message")
+    parser.add_argument("--pool", type=int, default=0, help="run code on a pool of this many worker processes")
+    parser.add_argument("--json", help="also write the summary to this JSON file")
+    args = parser.parse_args(argv)
+
+    options = dict(latency=args.latency, jitter=args.jitter, seconds_per_token=args.seconds_per_token)
+    llm = ScriptedChatModel.from_file(args.script, **options) if args.script else ScriptedChatModel(**options)
+    pool = PlotAgentWorkerPool(max_workers=args.pool) if args.pool else None
+
+    samples = defaultdict(list)
+    started = time.perf_counter()
+    try:
+        if args.mode == "thread":
+            with ThreadPoolExecutor(max_workers=args.sessions) as executor:
+                failures = sum(
+                    executor.map(
+                        lambda index: run_session(index, args, llm, pool, samples), range(args.sessions)
+                    )
+                )
+        else:
+
+            async def run_all():
+                sessions = [arun_session(index, args, llm, pool, samples) for index in range(args.sessions)]
+                return sum(await asyncio.gather(*sessions))
+
+            failures = asyncio.run(run_all())
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    wall_seconds = time.perf_counter() - started
+
+    summary = summarize(samples, wall_seconds, args.sessions * args.messages, failures)
+    print(
+        f"{summary['messages']} messages from {args.sessions} concurrent sessions in {wall_seconds:.2f} s: "
+        f"{summary['messages_per_second']:.2f} messages/s, {failures} failed"
+    )
+    print(f"{'stage':<14}{'count':>8}{'p50 (s)':>10}{'p99 (s)':>10}{'max (s)':>10}")
+    for stage, stats in summary["stages"].items():
+        print(f"{stage:<14}{stats['count']:>8}{stats['p50']:>10.3f}{stats['p99']:>10.3f}{stats['max']:>10.3f}")
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(summary, indent=2) + "\n")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Memory soak test: run many executions in one environment and check that resident memory stays flat.
+
+Cycles through matplotlib and Plotly snippets, including ones that leave pyplot
+figures open and ones that modify df in place, and reports resident memory as it
+goes, from the rss_bytes and rss_delta_bytes execution metrics. Memory grown past
+warm-up is reported as a leak.
+
+    python scripts/memory_soak.py --executions 100000 --report-every 10000
+    python scripts/memory_soak.py --pool 2 --executions 20000
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Run from a checkout without installing the package
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from plot_agent.execution import PlotAgentExecutionEnvironment  # noqa: E402
+from plot_agent.pool import PlotAgentWorkerPool, PooledExecutionEnvironment  # noqa: E402
+
+
+SNIPPETS = [
+    # Figures assigned to fig
+    "fig, ax = plt.subplots()\nax.plot(df['x'], df['y'])\nax.set_title('y over x')",
+    # Figures only drawn with pyplot, plus one left open by accident
+    "plt.figure()\nplt.hist(df['y'], bins=30)\nplt.figure()\nplt.scatter(df['x'], df['y'], s=2)",
+    # Plotly figures
+    "fig = px.scatter(df, x='x', y='y', color='category')",
+    # In-place changes to df
+    "df['z'] = df['y'] * 2\nfig = px.histogram(df, x='z')",
+    # Errors after creating a figure
+    "plt.subplots()\nraise ValueError('broken code')",
+]
+
+
+def make_df(n_rows: int) -> pd.DataFrame:
+    """Create the dataframe the snippets run against."""
+    rng = np.random.default_rng(0)
+    return pd.DataFrame(
+        {
+            "x": np.arange(n_rows, dtype=float),
+            "y": rng.normal(size=n_rows).cumsum(),
+            "category": rng.choice(["alpha", "beta", "gamma"], n_rows),
+        }
+    )
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--executions", type=int, default=10_000, help="executions to run (default: 10000)")
+    parser.add_argument("--rows", type=int, default=1_000, help="rows in the dataframe (default: 1000)")
+    parser.add_argument("--report-every", type=int, default=1_000, help="executions between reports")
+    parser.add_argument("--warmup", type=int, default=500, help="executions before the baseline is taken")
+    parser.add_argument(
+        "--max-growth-mb", type=float, default=50.0, help="growth past warm-up reported as a leak (default: 50)"
+    )
+    parser.add_argument("--pool", type=int, default=0, help="run code on a pool of this many worker processes")
+    parser.add_argument("--json", help="also write the samples to this JSON file")
+    args = parser.parse_args(argv)
+
+    df = make_df(args.rows)
+    pool = PlotAgentWorkerPool(max_workers=args.pool) if args.pool else None
+    env = PooledExecutionEnvironment(df, pool) if pool else PlotAgentExecutionEnvironment(df)
+
+    samples = []
+    baseline = None
+    failures = figures_closed = 0
+    started = time.perf_counter()
+    try:
+        for index in range(1, args.executions + 1):
+            result = env.execute_code(SNIPPETS[index % len(SNIPPETS)])
+            metrics = result["metrics"]
+            failures += not result["success"] and "broken code" not in result["error"]
+            figures_closed += metrics.get("matplotlib_figures_closed", 0)
+            rss_bytes = metrics.get("rss_bytes")
+            if rss_bytes is None:
+                print("Resident memory cannot be read on this platform; install psutil.")
+                return 1
+            if index == args.warmup:
+                baseline = rss_bytes
+            if index % args.report_every == 0:
+                samples.append({"executions": index, "rss_bytes": rss_bytes})
+                print(
+                    f"{index:>9} executions  {rss_bytes / 2**20:8.1f} MB resident  "
+                    f"{index / (time.perf_counter() - started):7.0f} executions/s",
+                    flush=True,
+                )
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    growth_mb = (rss_bytes - baseline) / 2**20 if baseline is not None else 0.0
+    print(
+        f"{args.executions} executions, {failures} unexpected failures, {figures_closed} matplotlib figures "
+        f"closed, {growth_mb:+.1f} MB resident since warm-up"
+    )
+    if args.json:
+        Path(args.json).write_text(json.dumps({"growth_mb": growth_mb, "samples": samples}, indent=2) + "\n")
+    if growth_mb > args.max_growth_mb:
+        print(f"Resident memory grew by more than {args.max_growth_mb} MB: possible leak.")
+        return 1
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
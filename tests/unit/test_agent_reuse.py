@@ -0,0 +1,69 @@
+import pandas as pd
+from plot_agent.agent import PlotAgent
+
+
+def render_prompt(agent):
+    """Render the prompt messages the agent would send for a user message."""
+    from langchain_core.prompts import ChatPromptTemplate
+
+    steps = agent.agent_executor.agent.runnable.steps
+    prompt = next(step for step in steps if isinstance(step, ChatPromptTemplate))
+    inputs = dict(agent._agent_inputs("Plot it"), agent_scratchpad=[])
+    return prompt.invoke(inputs).to_messages()
+
+
+def test_set_df_reuses_agent_executor():
+    """Test that swapping in a new dataframe only rebinds the data."""
+    agent = PlotAgent()
+    agent.set_df(pd.DataFrame({"x": [1, 2], "y": [3, 4]}))
+    executor = agent.agent_executor
+    tools = agent.agent_executor.tools
+
+    agent.set_df(pd.DataFrame({"x": [5, 6], "y": [7, 8]}), sql_query="SELECT x, y FROM daily")
+
+    assert agent.agent_executor is executor
+    assert agent.agent_executor.tools is tools
+    inputs = agent._agent_inputs("Plot it")
+    assert "5" in inputs["df_head"] and "7" in inputs["df_head"]
+    assert "SELECT x, y FROM daily" in inputs["sql_context"]
+
+
+def test_prompt_is_filled_at_invoke_time():
+    """Test that the dataframe description is bound when the prompt is rendered."""
+    agent = PlotAgent()
+    agent.set_df(pd.DataFrame({"x": [1, 2], "y": ["{braces}", "are fine"]}))
+    messages = render_prompt(agent)
+
+    assert "{braces}" in messages[0].content
+    assert "Data columns (total 2 columns)" in messages[0].content
+    assert messages[-1].content == "Plot it"
+
+
+def test_agents_sharing_an_llm_share_the_prepared_agent():
+    """Test that agents with the same LLM and prompt reuse the prepared agent."""
+    first = PlotAgent()
+    first.set_df(pd.DataFrame({"x": [1]}))
+    second = PlotAgent()
+    second.llm = first.llm
+    second.set_df(pd.DataFrame({"y": [2]}))
+
+    assert second.agent_executor is not first.agent_executor
+    assert second.agent_executor.agent.runnable is first.agent_executor.agent.runnable
+    # Each agent's tools still act on its own dataframe
+    second.agent_executor.tools[0].invoke({"generated_code": "fig = px.bar(df, y='y')"})
+    assert second.get_figure() is not None
+    assert first.get_figure() is None
+
+
+def test_changing_system_prompt_rebuilds_agent():
+    """Test that the agent is rebuilt when the system prompt changes."""
+    agent = PlotAgent()
+    agent.set_df(pd.DataFrame({"x": [1]}))
+    executor = agent.agent_executor
+
+    agent.system_prompt = "Custom prompt for {df_info} with literal {{braces}}"
+    agent.set_df(pd.DataFrame({"x": [2]}))
+
+    assert agent.agent_executor is not executor
+    assert render_prompt(agent)[0].content.startswith("Custom prompt for <class")
+    assert render_prompt(agent)[0].content.endswith("literal {braces}")
@@ -0,0 +1,131 @@
+import numpy as np
+import pandas as pd
+import pytest
+from plot_agent.aggregations import bin_histogram, density_grid, resample_timeseries, top_k_groups
+from plot_agent.execution import PlotAgentExecutionEnvironment
+from plot_agent.prompt import DEFAULT_SYSTEM_PROMPT
+
+
+@pytest.fixture
+def df():
+    """A dataframe with numbers, dates with gaps, a category and missing values."""
+    rng = np.random.default_rng(0)
+    n = 10_000
+    frame = pd.DataFrame(
+        {
+            "date": pd.date_range("2024-01-01", periods=n, freq="min"),
+            "x": rng.random(n),
+            "y": rng.normal(size=n),
+            "category": rng.choice(["a", "b", "c", "d", "e"], n, p=[0.4, 0.3, 0.2, 0.07, 0.03]),
+        }
+    )
+    frame.loc[::100, "y"] = np.nan
+    return frame
+
+
+def test_bin_histogram_matches_numpy(df):
+    """Test that bins count every non-missing value, as np.histogram does."""
+    hist = bin_histogram(df, "y", bins=20)
+
+    counts, edges = np.histogram(df["y"].dropna(), bins=20)
+    assert list(hist.columns) == ["bin_start", "bin_end", "bin_center", "count"]
+    np.testing.assert_array_equal(hist["count"], counts)
+    np.testing.assert_allclose(hist["bin_start"], edges[:-1])
+    np.testing.assert_allclose(hist["bin_center"], (edges[:-1] + edges[1:]) / 2)
+
+
+def test_bin_histogram_weights_and_range(df):
+    """Test that weights are summed per bin, within the given range."""
+    hist = bin_histogram(df, "x", bins=2, range=(0, 1), weights="x")
+
+    assert hist["count"].sum() == pytest.approx(df["x"].sum())
+    assert hist["bin_start"].tolist() == [0.0, 0.5]
+
+
+def test_bin_histogram_datetimes(df):
+    """Test that datetime columns are binned into datetime bins."""
+    hist = bin_histogram(df, "date", bins=4)
+
+    assert hist["bin_start"].dtype.kind == "M"
+    assert hist["bin_start"].iloc[0] == df["date"].min()
+    assert hist["count"].sum() == len(df)
+
+
+def test_density_grid(df):
+    """Test that the grid has y along its rows, x along its columns, and counts every row."""
+    grid = density_grid(df, "x", "y", bins=(10, 5))
+
+    assert grid.shape == (5, 10)
+    assert grid.index.name == "y" and grid.columns.name == "x"
+    assert grid.index.is_monotonic_increasing and grid.columns.is_monotonic_increasing
+    assert grid.values.sum() == df["y"].notna().sum()
+
+
+def test_resample_timeseries_picks_a_frequency(df):
+    """Test that without freq, the buckets are sized to stay within max_points."""
+    series = resample_timeseries(df, "date", "y", max_points=200)
+
+    # 10,000 minutes fit in 167 hours
+    assert len(series) <= 200
+    assert (series["date"].diff().dropna() == pd.Timedelta(hours=1)).all()
+    expected = df.set_index("date")["y"].resample("1h").mean()
+    np.testing.assert_allclose(series["y"], expected.to_numpy())
+
+
+def test_resample_timeseries_by_group(df):
+    """Test that groups are resampled separately, with the given frequency and aggregation."""
+    series = resample_timeseries(df, "date", ["x", "y"], freq="1D", agg="count", by="category")
+
+    assert list(series.columns) == ["category", "date", "x", "y"]
+    assert set(series["category"]) == set(df["category"])
+    assert series["x"].sum() == len(df)
+
+
+def test_resample_timeseries_parses_dates(df):
+    """Test that text dates are parsed, and numeric columns are used by default."""
+    text = df.assign(date=df["date"].astype(str))
+
+    series = resample_timeseries(text, "date", freq="1D")
+
+    assert series["date"].dtype.kind == "M"
+    assert list(series.columns) == ["date", "x", "y"]
+
+
+def test_top_k_groups(df):
+    """Test that the largest groups are kept, largest first, with the rest lumped together."""
+    top = top_k_groups(df, "category", k=2)
+
+    counts = df["category"].value_counts()
+    assert top["category"].tolist() == ["a", "b", "Other"]
+    assert top["count"].tolist() == [counts["a"], counts["b"], counts[["c", "d", "e"]].sum()]
+
+
+def test_top_k_groups_non_additive_aggregates(df):
+    """Test that the other row of a mean is the mean of the remaining rows."""
+    top = top_k_groups(df, "category", "x", k=3, agg="mean")
+
+    means = df.groupby("category")["x"].mean().sort_values(ascending=False)
+    assert top["category"].tolist()[:3] == means.index[:3].tolist()
+    rest = df.loc[~df["category"].isin(means.index[:3]), "x"].mean()
+    assert top["x"].iloc[-1] == pytest.approx(rest)
+
+    assert len(top_k_groups(df, "category", "x", k=3, other=None)) == 3
+    assert "Other" not in top_k_groups(df, "category", k=10)["category"].tolist()
+
+
+def test_helpers_are_available_in_the_sandbox(df):
+    """Test that generated code can call the helpers without importing them."""
+    env = PlotAgentExecutionEnvironment(df)
+
+    result = env.execute_code("hist = bin_histogram(df, 'y', bins=30)\nfig = px.bar(hist, x='bin_center', y='count')")
+
+    assert result["success"] is True, result["error"]
+    assert len(result["fig"].data[0].x) == 30
+
+
+def test_prompt_describes_the_helpers():
+    """Test that the system prompt tells the model about every helper, and still formats."""
+    prompt = DEFAULT_SYSTEM_PROMPT.format(df_info="info", df_head="head", sql_context="")
+
+    for name in ("bin_histogram", "density_grid", "resample_timeseries", "top_k_groups"):
+        assert f"{name}(df" in prompt
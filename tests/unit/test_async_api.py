@@ -0,0 +1,109 @@
+import asyncio
+
+import pandas as pd
+from plot_agent.agent import PlotAgent
+from langchain_core.messages import HumanMessage, AIMessage
+
+
+SCATTER_CODE = """import plotly.express as px
+fig = px.scatter(df, x='x', y='y')"""
+
+
+class FakeAgentExecutor:
+    """An agent executor that runs the execute_plotly_code tool once, without an LLM."""
+
+    def __init__(self, agent, code, output="Here is your plot."):
+        self.agent = agent
+        self.code = code
+        self.output = output
+        self.calls = []
+
+    def invoke(self, inputs, config=None):
+        self.calls.append(("invoke", inputs["input"]))
+        self.agent.execute_plotly_code(self.code)
+        return {"output": self.output}
+
+    async def ainvoke(self, inputs, config=None):
+        self.calls.append(("ainvoke", inputs["input"]))
+        await self.agent.aexecute_plotly_code(self.code)
+        return {"output": self.output}
+
+
+def make_agent(code=SCATTER_CODE, output="Here is your plot."):
+    """Create an agent with a dataframe and a fake agent executor."""
+    agent = PlotAgent()
+    agent.set_df(pd.DataFrame({"x": [1, 2, 3, 4, 5], "y": [10, 20, 30, 40, 50]}))
+    agent.agent_executor = FakeAgentExecutor(agent, code, output)
+    return agent
+
+
+def test_aexecute_plotly_code():
+    """Test that aexecute_plotly_code returns the same result as execute_plotly_code."""
+    agent = make_agent()
+
+    result = asyncio.run(agent.aexecute_plotly_code(SCATTER_CODE))
+    assert "Code executed successfully" in result
+    assert agent.get_figure() is not None
+    assert agent.generated_code == SCATTER_CODE
+
+
+def test_aexecute_plotly_code_without_df():
+    """Test that aexecute_plotly_code handles the case when no dataframe is set."""
+    agent = PlotAgent()
+    result = asyncio.run(agent.aexecute_plotly_code("some code"))
+    assert "No dataframe has been set" in result
+
+
+def test_aprocess_message():
+    """Test that aprocess_message uses ainvoke and updates chat history."""
+    agent = make_agent()
+
+    response = asyncio.run(agent.aprocess_message("Create a scatter plot"))
+
+    assert response == "Here is your plot."
+    assert agent.agent_executor.calls == [("ainvoke", "Create a scatter plot")]
+    assert isinstance(agent.chat_history[0], HumanMessage)
+    assert isinstance(agent.chat_history[1], AIMessage)
+    assert agent.get_figure() is not None
+
+
+def test_aprocess_message_without_df():
+    """Test that aprocess_message asks for a dataframe first."""
+    agent = PlotAgent()
+    response = asyncio.run(agent.aprocess_message("Create a scatter plot"))
+    assert "Please set a dataframe first" in response
+
+
+def test_aprocess_message_runs_code_from_response():
+    """Test that aprocess_message falls back to code in the response when no figure exists."""
+    agent = make_agent(
+        code="print('no figure here')",
+        output=f"Here is the code:\n```python\n{SCATTER_CODE}\n```",
+    )
+
+    asyncio.run(agent.aprocess_message("Create a scatter plot"))
+    assert agent.get_figure() is not None
+
+
+def test_process_message_matches_async():
+    """Test that the sync and async paths behave the same."""
+    agent = make_agent()
+
+    response = agent.process_message("Create a scatter plot")
+    assert response == "Here is your plot."
+    assert agent.agent_executor.calls == [("invoke", "Create a scatter plot")]
+    assert agent.get_figure() is not None
+
+
+def test_concurrent_sessions():
+    """Test that many sessions can be processed concurrently on one event loop."""
+    agents = [make_agent() for _ in range(8)]
+
+    async def run_all():
+        return await asyncio.gather(
+            *(agent.aprocess_message(f"Plot {i}") for i, agent in enumerate(agents))
+        )
+
+    responses = asyncio.run(run_all())
+    assert responses == ["Here is your plot."] * 8
+    assert all(agent.get_figure() is not None for agent in agents)
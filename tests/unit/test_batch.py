@@ -0,0 +1,133 @@
+import asyncio
+import threading
+import time
+
+import pandas as pd
+import pytest
+from plot_agent.agent import PlotAgent
+
+
+BAR_CODE = "fig = px.bar(df, x='x', y='y')"
+
+
+class SlowAgentExecutor:
+    """An agent executor that waits like an LLM call would, then runs code, without an LLM."""
+
+    active = 0
+    peak = 0
+    lock = threading.Lock()
+
+    def __init__(self, agent):
+        self.agent = agent
+
+    def _run(self, message):
+        if message == "fail":
+            raise RuntimeError("LLM unavailable")
+        if message != "no figure":
+            self.agent.execute_plotly_code(BAR_CODE)
+        return {"output": f"Done: {message}"}
+
+    def _enter(self):
+        with SlowAgentExecutor.lock:
+            SlowAgentExecutor.active += 1
+            SlowAgentExecutor.peak = max(SlowAgentExecutor.peak, SlowAgentExecutor.active)
+
+    def _exit(self):
+        with SlowAgentExecutor.lock:
+            SlowAgentExecutor.active -= 1
+
+    def invoke(self, inputs, config=None):
+        self._enter()
+        try:
+            time.sleep(0.2)
+            return self._run(inputs["input"])
+        finally:
+            self._exit()
+
+    async def ainvoke(self, inputs, config=None):
+        self._enter()
+        try:
+            await asyncio.sleep(0.2)
+            return self._run(inputs["input"])
+        finally:
+            self._exit()
+
+
+@pytest.fixture
+def agent(monkeypatch):
+    """An agent whose spawned agents use SlowAgentExecutor."""
+
+    def initialize_agent(self):
+        self.agent_executor = SlowAgentExecutor(self)
+
+    monkeypatch.setattr(PlotAgent, "_initialize_agent", initialize_agent)
+    SlowAgentExecutor.active = SlowAgentExecutor.peak = 0
+    agent = PlotAgent()
+    agent.llm = object()
+    return agent
+
+
+def make_jobs(n):
+    """Create n jobs with different dataframes."""
+    return [(pd.DataFrame({"x": ["a", "b"], "y": [i, i + 1]}), f"Plot {i}") for i in range(n)]
+
+
+def test_process_batch_runs_concurrently(agent):
+    """Test that jobs run concurrently under the concurrency limit."""
+    results = list(agent.process_batch(make_jobs(12), max_concurrency=4))
+
+    assert sorted(result["index"] for result in results) == list(range(12))
+    assert all(result["success"] for result in results)
+    assert SlowAgentExecutor.peak == 4
+
+    result = next(result for result in results if result["index"] == 3)
+    assert result["response"] == "Done: Plot 3"
+    assert result["generated_code"] == BAR_CODE
+    assert list(result["fig"].data[0].y) == [3, 4]
+
+
+def test_process_batch_reports_errors_per_job(agent):
+    """Test that a failing job does not stop the others."""
+    df = pd.DataFrame({"x": ["a"], "y": [1]})
+    jobs = [
+        (df, "fail"),
+        {"df": df, "message": "no figure"},
+        {"df": pd.DataFrame(), "message": "empty"},
+        (df, "works", "SELECT x, y FROM t"),
+    ]
+
+    results = {result["index"]: result for result in agent.process_batch(jobs)}
+
+    assert results[0]["error"] == "RuntimeError: LLM unavailable"
+    assert results[1]["error"] == "No figure was created."
+    assert results[1]["response"] == "Done: no figure"
+    assert "AssertionError" in results[2]["error"]
+    assert results[3]["success"] and results[3]["error"] == ""
+
+
+def test_process_batch_pulls_jobs_lazily(agent):
+    """Test that jobs are only pulled from the iterable as capacity frees up."""
+    pulled = []
+
+    def jobs():
+        for i, job in enumerate(make_jobs(6)):
+            pulled.append(i)
+            yield job
+
+    results = agent.process_batch(jobs(), max_concurrency=2)
+    next(results)
+    assert len(pulled) <= 3
+    results.close()
+
+
+def test_aprocess_batch(agent):
+    """Test that the async batch runs jobs concurrently on one event loop."""
+
+    async def run():
+        return [result async for result in agent.aprocess_batch(make_jobs(10), max_concurrency=5)]
+
+    results = asyncio.run(run())
+
+    assert sorted(result["index"] for result in results) == list(range(10))
+    assert all(result["success"] for result in results)
+    assert SlowAgentExecutor.peak == 5
@@ -0,0 +1,65 @@
+import pandas as pd
+from plot_agent.execution import PlotAgentExecutionEnvironment
+
+
+def make_env():
+    return PlotAgentExecutionEnvironment(pd.DataFrame({"x": [1, 2, 3], "y": [4, 5, 6]}))
+
+
+def test_repeated_code_is_compiled_once():
+    """Test that identical code is parsed, validated and compiled only once."""
+    PlotAgentExecutionEnvironment._code_cache.clear()
+    code = "fig = px.scatter(df, x='x', y='y', title='compiled once')"
+
+    first = make_env().execute_code(code)
+    second = make_env().execute_code(code)
+
+    assert first["success"] and second["success"]
+    assert PlotAgentExecutionEnvironment.code_cache_info() == {
+        "hits": 1,
+        "misses": 1,
+        "entries": 1,
+    }
+
+
+def test_rejections_are_cached():
+    """Test that rejected code is still rejected when served from the cache."""
+    PlotAgentExecutionEnvironment._code_cache.clear()
+    env = make_env()
+
+    for _ in range(2):
+        result = env.execute_code("import os\nfig = None")
+        assert result["error"] == "Code rejected on safety grounds: Import of 'os' is not allowed."
+
+    for _ in range(2):
+        result = env.execute_code("fig = px.scatter(df, x='x'")
+        assert "Code rejected on safety grounds: '(' was never closed" in result["error"]
+
+    assert PlotAgentExecutionEnvironment.code_cache_info()["hits"] == 2
+
+
+def test_cached_code_reports_runtime_errors():
+    """Test that runtime errors from cached code still carry a traceback."""
+    env = make_env()
+    code = "fig = px.scatter(df, x='missing', y='y')"
+
+    env.execute_code(code)
+    result = env.execute_code(code)
+
+    assert result["success"] is False
+    assert 'File "<string>", line 1' in result["error"]
+
+
+def test_code_cache_is_bounded():
+    """Test that the code cache evicts old entries."""
+    cache = PlotAgentExecutionEnvironment._code_cache
+    max_entries = cache.max_entries
+    try:
+        cache.clear()
+        cache.max_entries = 2
+        env = make_env()
+        for i in range(5):
+            env.execute_code(f"fig = px.bar(df, y='y', title='{i}')")
+        assert PlotAgentExecutionEnvironment.code_cache_info()["entries"] == 2
+    finally:
+        cache.max_entries = max_entries
@@ -0,0 +1,154 @@
+import numpy as np
+import pandas as pd
+import pytest
+from plot_agent.execution import PlotAgentExecutionEnvironment
+from plot_agent.pool import PlotAgentWorkerPool, PooledExecutionEnvironment
+
+
+def make_df(n_rows=200, n_extra=50):
+    """Create a wide dataframe, with a few named columns and many unused ones."""
+    rng = np.random.default_rng(0)
+    data = {
+        "x": np.arange(n_rows, dtype=float),
+        "y": rng.random(n_rows),
+        "category": rng.choice(["a", "b", "c"], n_rows),
+        "when": pd.date_range("2024-01-01", periods=n_rows, freq="h"),
+    }
+    for i in range(n_extra):
+        data[f"extra_{i}"] = rng.random(n_rows)
+    return pd.DataFrame(data)
+
+
+@pytest.mark.parametrize(
+    "code, columns_used",
+    [
+        # Columns selected by name, or as attributes
+        ("fig = px.scatter(x=df['x'], y=df.y)", 2),
+        ("fig = go.Figure(go.Bar(x=df[['category', 'y']]['category'], y=df['y']))", 2),
+        # px charts given df and the columns to plot
+        ("fig = px.scatter(df, x='x', y='y', color='category')", 3),
+        ("fig = px.scatter(df, 'x', 'y')", 2),
+        ("fig = px.line(data_frame=df, x='when', y='y')", 2),
+        # Rows selected first, also through other names
+        ("recent = df[df['when'] > '2024-01-03']\nfig = px.line(recent.head(50), x='when', y='y')", 2),
+        ("df = df.sort_values('x')\nfig = px.line(df.loc[df['y'] > 0.5, ['x', 'y']], x='x', y='y')", 2),
+        # Grouped selections and aggregation helpers
+        ("fig = px.bar(df.groupby('category', as_index=False)['y'].sum(), x='category', y='y')", 2),
+        ("fig = px.bar(bin_histogram(df, 'y'), x='bin_center', y='count')", 1),
+        ("fig = px.line(resample_timeseries(df, 'when', values='y'), x='when', y='y')", 2),
+        # Uses that may involve any column
+        ("fig = px.box(df.select_dtypes('number'))", 54),
+        ("fig = px.bar(df.groupby('category').mean(numeric_only=True))", 54),
+        ("fig = px.line(resample_timeseries(df, 'when'), x='when', y='y')", 54),
+        ("fig = px.scatter(df.dropna(), x='x', y='y')", 54),
+        ("cols = df.columns[:2]\nfig = px.scatter(df[cols], x='x', y='y')", 54),
+        ("fig = px.scatter(df, x='x', y='y', **dict(color='category'))", 54),
+        # Columns named by values worked out when the code runs
+        ("name = 'CATEGORY'.lower()\nfig = px.scatter(df, x='x', y='y', color=name)", 54),
+        ("column = 'y'\nfig = px.bar(bin_histogram(df, column), x='bin_center', y='count')", 54),
+    ],
+)
+def test_code_gets_only_the_columns_it_uses(code, columns_used):
+    """Test that code is given the columns it uses, and every column when unsure."""
+    env = PlotAgentExecutionEnvironment(make_df())
+    result = env.execute_code(code)
+    assert result["success"], result["error"]
+    assert result["metrics"]["columns_used"] == columns_used
+
+
+def test_computed_column_names_are_kept():
+    """Test that columns named by strings built at run time are still given to the code."""
+    df = pd.DataFrame({"a": [1, 2, 3], "b": [4, 5, 6], "c": [7, 8, 9]})
+    env = PlotAgentExecutionEnvironment(df)
+    result = env.execute_code("name = 'C'.lower()\nfig = px.scatter(df, x='a', y=name)")
+    assert result["success"], result["error"]
+    assert list(result["fig"].data[0].y) == [7, 8, 9]
+
+
+def test_frames_with_non_string_labels_are_not_pruned():
+    """Test that frames with column labels code cannot name as strings are left whole."""
+    df = pd.DataFrame(np.arange(6).reshape(3, 2))
+    env = PlotAgentExecutionEnvironment(df)
+    result = env.execute_code("fig = px.scatter(df, x=0, y=1)")
+    assert result["success"], result["error"]
+    assert result["metrics"]["columns_used"] == 2
+
+    with PlotAgentWorkerPool(max_workers=1, timeout=30) as pool:
+        pooled = PooledExecutionEnvironment(df, pool).execute_code("fig = px.scatter(df, x=0, y=1)")
+    assert pooled["success"], pooled["error"]
+    assert pooled["metrics"]["columns_used"] == 2
+
+
+@pytest.mark.parametrize(
+    "code",
+    [
+        # Dataframe properties named like columns
+        "fig = px.bar(x=['size'], y=[df.size])",
+        "fig = px.bar(x=['rows', 'columns'], y=list(df.values.shape))",
+        "fig = px.bar(x=['rows', 'columns'], y=list(df.shape))",
+        # Charts of arrays, whose x and y are axis labels
+        "fig = px.imshow(df, x=['p', 'q', 'r'])",
+    ],
+)
+def test_whole_frame_uses_are_not_pruned(code):
+    """Test that code using the whole frame, or charting it as an array, gets the same figure as without pruning."""
+    df = pd.DataFrame({"size": [1, 2, 3], "values": [4, 5, 6], "w": [7, 8, 9]})
+    pruned = PlotAgentExecutionEnvironment(df).execute_code(code)
+    whole = PlotAgentExecutionEnvironment(df, isolate_df=False).execute_code(code)
+    assert pruned["success"], pruned["error"]
+    assert pruned["metrics"]["columns_used"] == 3
+    assert pruned["fig"].to_json() == whole["fig"].to_json()
+
+
+def test_pruned_code_gives_the_same_figure():
+    """Test that pruning does not change the figure code produces."""
+    df = make_df()
+    code = "fig = px.scatter(df[df['y'] > 0.5], x='x', y='y', color='category')"
+    pruned = PlotAgentExecutionEnvironment(df).execute_code(code)
+    whole = PlotAgentExecutionEnvironment(df, isolate_df=False).execute_code(code)
+    assert pruned["metrics"]["columns_used"] == 3
+    assert whole["metrics"]["columns_used"] == 54
+    assert pruned["fig"].to_json() == whole["fig"].to_json()
+
+
+def test_pruning_leaves_df_intact():
+    """Test that later executions still see every column of df."""
+    df = make_df()
+    env = PlotAgentExecutionEnvironment(df)
+    assert env.execute_code("df['y'] = 0\nfig = px.scatter(df, x='x', y='y')")["success"]
+    result = env.execute_code("fig = px.bar(x=list(df.columns), y=[1] * len(df.columns))")
+    assert result["success"], result["error"]
+    assert len(result["fig"].data[0].x) == 54
+    assert df["y"].ne(0).any()
+
+
+def test_rejected_code_is_still_rejected():
+    """Test that the column analysis does not get in the way of validation."""
+    env = PlotAgentExecutionEnvironment(make_df())
+    result = env.execute_code("import os\nfig = px.scatter(df, x='x', y='y')")
+    assert not result["success"]
+    assert "not allowed" in result["error"]
+
+
+def test_pool_sends_only_missing_columns():
+    """Test that pool workers are sent the columns code uses, and only once."""
+    with PlotAgentWorkerPool(max_workers=1, timeout=30) as pool:
+        env = PooledExecutionEnvironment(make_df(), pool)
+
+        first = env.execute_code("fig = px.scatter(df, x='x', y='y')")
+        assert first["success"], first["error"]
+        assert first["metrics"]["columns_sent"] == 2
+
+        # The worker has these columns already
+        again = env.execute_code("fig = px.line(df, x='x', y='y')")
+        assert again["success"], again["error"]
+        assert "columns_sent" not in again["metrics"]
+
+        # Only the new column is sent, and then every other one when code needs them all
+        more = env.execute_code("fig = px.scatter(df, x='x', y='y', color='category')")
+        assert more["metrics"]["columns_sent"] == 1
+        whole = env.execute_code("fig = px.bar(x=list(df.columns), y=[1] * len(df.columns))")
+        assert whole["success"], whole["error"]
+        assert whole["metrics"]["columns_sent"] == 51
+        # Columns are in the order of the session dataframe
+        assert list(whole["fig"].data[0].x) == list(make_df().columns)
@@ -0,0 +1,91 @@
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+from plot_agent.agent import PlotAgent
+from plot_agent.decimation import lttb, optimize_figure
+from plot_agent.execution import PlotAgentExecutionEnvironment
+
+
+def test_lttb_keeps_endpoints_and_peaks():
+    """Test that LTTB keeps the first and last points and the extremes of the line."""
+    x = np.arange(10000, dtype=float)
+    y = np.zeros(10000)
+    y[1234] = 100.0
+    y[8765] = -100.0
+
+    positions = lttb(x, y, 100)
+
+    assert len(positions) == 100
+    assert positions[0] == 0 and positions[-1] == 9999
+    assert 1234 in positions and 8765 in positions
+    assert np.all(np.diff(positions) > 0)
+
+
+def test_optimize_figure_downsamples_and_promotes():
+    """Test that oversized scatter traces are downsampled and switched to WebGL."""
+    n = 100000
+    fig = go.Figure(
+        go.Scatter(x=np.arange(n), y=np.sin(np.arange(n) / 100), text=np.arange(n).astype(str), name="sine")
+    )
+
+    changes = optimize_figure(fig, max_points=2000)
+
+    trace = fig.data[0]
+    assert trace.type == "scattergl"
+    assert len(trace.x) == len(trace.y) == len(trace.text) == 2000
+    assert changes == [
+        "trace 0 ('sine'): downsampled from 100000 to 2000 points with LTTB",
+        "trace 0 ('sine'): switched to Scattergl for WebGL rendering",
+    ]
+
+
+def test_optimize_figure_unordered_and_dates():
+    """Test that unordered points are sampled and date axes are supported."""
+    n = 50000
+    rng = np.random.default_rng(1)
+    fig = go.Figure(
+        [
+            go.Scatter(x=rng.random(n), y=rng.random(n), mode="markers", marker_color=rng.random(n)),
+            go.Scatter(x=pd.date_range("2024-01-01", periods=n, freq="min"), y=rng.random(n)),
+        ]
+    )
+
+    changes = optimize_figure(fig, max_points=1000)
+
+    assert "random sampling" in changes[0]
+    assert len(fig.data[0].marker.color) == 1000
+    assert "LTTB" in changes[2]
+    assert len(fig.data[1].x) == 1000
+
+
+def test_optimize_figure_leaves_small_and_other_figures_alone():
+    """Test that small traces, other trace types and non-Plotly figures are not changed."""
+    fig = go.Figure([go.Scatter(y=[1, 2, 3]), go.Bar(y=np.arange(100000))])
+
+    assert optimize_figure(fig, max_points=1000) == []
+    assert fig.data[0].type == "scatter"
+    assert len(fig.data[1].y) == 100000
+    assert optimize_figure(object()) == []
+
+
+def test_execute_code_reports_optimizations():
+    """Test that execute_code post-processes the figure and reports the changes."""
+    df = pd.DataFrame({"x": np.arange(200000), "y": np.random.rand(200000)})
+    env = PlotAgentExecutionEnvironment(df, figure_max_points=5000)
+
+    result = env.execute_code("fig = go.Figure(go.Scatter(x=df['x'], y=df['y']))")
+
+    assert result["success"]
+    assert len(result["optimizations"]) == 2
+    assert "Large traces were optimized for display" in result["output"]
+    assert len(env.fig.data[0].y) == 5000
+
+
+def test_agent_figure_max_points():
+    """Test that the agent passes figure_max_points to its execution environment."""
+    agent = PlotAgent(figure_max_points=1000)
+    agent.set_df(pd.DataFrame({"x": np.arange(5000), "y": np.arange(5000)}))
+
+    agent.execute_plotly_code("fig = px.line(df, x='x', y='y')")
+
+    assert len(agent.get_figure().data[0].y) == 1000
@@ -0,0 +1,161 @@
+import numpy as np
+import pandas as pd
+import pytest
+from plot_agent.execution import PlotAgentExecutionEnvironment
+
+
+def make_df(n=1000):
+    """Create a dataframe with a few columns of different types."""
+    return pd.DataFrame(
+        {
+            "x": np.arange(n, dtype=float),
+            "y": np.arange(n),
+            "label": [f"item {i % 10}" for i in range(n)],
+            "maybe": [None if i % 3 == 0 else float(i) for i in range(n)],
+        }
+    )
+
+
+MUTATIONS = [
+    "df['x'] = 0",
+    "df['new'] = 1",
+    "df.loc[0, 'x'] = -1",
+    "df.dropna(inplace=True)",
+    "df.fillna(0, inplace=True)",
+    "df.sort_values('x', ascending=False, inplace=True)",
+    "df.rename(columns={'x': 'renamed'}, inplace=True)",
+    "df.set_index('label', inplace=True)",
+    "df.drop(columns=['y'], inplace=True)",
+    "del df['y']",
+    "df.index.name = 'row'",
+]
+
+
+@pytest.mark.parametrize("mutation", MUTATIONS)
+def test_in_place_changes_are_discarded(mutation):
+    """Test that in-place changes to df are detected and never leak into the shared dataframe."""
+    df = make_df()
+    expected = df.copy(deep=True)
+    env = PlotAgentExecutionEnvironment(df)
+
+    result = env.execute_code(f"{mutation}\nfig = px.scatter(df, y=df.columns[0])")
+
+    assert result["success"], result["error"]
+    assert result["metrics"]["df_modified"] is True
+    assert "changes were discarded" in result["output"]
+    pd.testing.assert_frame_equal(df, expected)
+    assert df.index.name is None
+
+    # Later executions see the original dataframe
+    result = env.execute_code(
+        "if list(df.columns) != ['x', 'y', 'label', 'maybe'] or len(df) != 1000 or df['x'].iloc[0] != 0:\n"
+        "    raise ValueError('df was modified')\n"
+        "fig = px.scatter(df, x='x')"
+    )
+    assert result["success"], result["error"]
+
+
+@pytest.mark.parametrize("mutation", MUTATIONS)
+def test_in_place_changes_are_detected_without_copy_on_write(monkeypatch, mutation):
+    """Test that in-place changes are detected on the deep copies made when pandas has no copy-on-write."""
+    monkeypatch.setattr("plot_agent.execution._copy_on_write_enabled", lambda: False)
+    monkeypatch.setattr("plot_agent.execution._copy_on_write_available", lambda: False)
+    df = make_df()
+    expected = df.copy(deep=True)
+    env = PlotAgentExecutionEnvironment(df, isolate_df=True)
+
+    result = env.execute_code(f"{mutation}\nfig = px.scatter(df, y=df.columns[0])")
+    assert result["success"], result["error"]
+    assert result["metrics"]["df_modified"] is True
+    pd.testing.assert_frame_equal(df, expected)
+
+    result = env.execute_code("fig = px.scatter(df, x='x', y=df['y'] * 2)")
+    assert result["success"], result["error"]
+    assert result["metrics"]["df_modified"] is False
+
+
+def test_copy_on_write_is_on_while_code_runs(monkeypatch):
+    """Test that where pandas has copy-on-write but it is off, as in pandas 2, it is on only while code runs."""
+    options = {"mode.copy_on_write": False}
+    history = []
+    monkeypatch.setattr(pd, "get_option", options.__getitem__)
+    monkeypatch.setattr(pd, "set_option", lambda name, value: history.append(value) or options.update({name: value}))
+    monkeypatch.setattr("plot_agent.execution._copy_on_write_enabled", lambda: options["mode.copy_on_write"] is True)
+    df = make_df()
+    expected = df.copy(deep=True)
+    env = PlotAgentExecutionEnvironment(df)
+    assert env.isolate_df
+
+    result = env.execute_code("df['x'] = 0\nfig = px.scatter(df, x='x', y='y')")
+    assert result["success"], result["error"]
+    assert result["metrics"]["df_modified"] is True
+    assert history == [True, False]
+    pd.testing.assert_frame_equal(df, expected)
+
+    # Left alone when turned on by someone else
+    options["mode.copy_on_write"] = True
+    assert env.execute_code("fig = px.scatter(df, x='x', y='y')")["success"]
+    assert history == [True, False]
+
+
+def test_isolation_is_off_by_default_without_copy_on_write(monkeypatch):
+    """Test that pandas without copy-on-write only copies df on every execution when asked to."""
+    monkeypatch.setattr("plot_agent.execution._copy_on_write_enabled", lambda: False)
+    monkeypatch.setattr("plot_agent.execution._copy_on_write_available", lambda: False)
+    assert not PlotAgentExecutionEnvironment(make_df()).isolate_df
+    assert PlotAgentExecutionEnvironment(make_df(), isolate_df=True).isolate_df
+
+
+def test_reads_are_not_reported_as_changes():
+    """Test that code only reading df is not reported as modifying it, and allocates no df data."""
+    env = PlotAgentExecutionEnvironment(make_df())
+
+    result = env.execute_code(
+        "summary = df.groupby('label')['x'].mean().reset_index()\n"
+        "filtered = df[df['x'] > 10].copy()\n"
+        "filtered['z'] = 1\n"
+        "fig = px.bar(summary, x='label', y='x')"
+    )
+
+    assert result["success"]
+    assert result["metrics"]["df_modified"] is False
+    assert result["metrics"]["df_allocated_bytes"] == 0
+    assert "discarded" not in result["output"]
+
+
+@pytest.mark.skipif(int(pd.__version__.split(".")[0]) < 3, reason="Needs copy-on-write")
+def test_only_written_columns_are_copied():
+    """Test that isolation only allocates the columns code writes to."""
+    n = 100_000
+    df = pd.DataFrame({f"c{i}": np.random.default_rng(i).random(n) for i in range(10)})
+    env = PlotAgentExecutionEnvironment(df)
+
+    result = env.execute_code(
+        "df['c0'] = df['c0'] * 2\ndf.loc[0, 'c3'] = 0\nfig = px.histogram(df.head(100), x='c0')"
+    )
+
+    assert result["metrics"]["df_modified"] is True
+    assert result["metrics"]["df_allocated_bytes"] == 2 * n * 8
+
+
+def test_no_isolation_shares_the_dataframe():
+    """Test that without isolation the code works on the shared dataframe, as before."""
+    df = make_df()
+    env = PlotAgentExecutionEnvironment(df, isolate_df=False)
+
+    result = env.execute_code("df['new'] = 1\nfig = px.scatter(df, x='x')")
+
+    assert result["success"]
+    assert "df_modified" not in result["metrics"]
+    assert "new" in df.columns
+
+
+def test_preview_executions_are_isolated():
+    """Test that in-place changes on the preview sample do not leak either."""
+    env = PlotAgentExecutionEnvironment(make_df(), preview_rows=100)
+    sample = env.preview_df.copy(deep=True)
+
+    result = env.execute_code("df.dropna(inplace=True)\nfig = px.scatter(df, x='x')", preview=True)
+
+    assert result["metrics"]["df_modified"] is True
+    pd.testing.assert_frame_equal(env.preview_df, sample)
@@ -0,0 +1,129 @@
+import pandas as pd
+from plot_agent.agent import PlotAgent
+
+
+BAR_CODE = "fig = px.bar(df, x='x', y='y')"
+LINE_CODE = "fig = px.line(df, x='x', y='y')"
+BROKEN_CODE = "fig = px.bar(df, x='missing')"
+
+
+class ScriptedAgentExecutor:
+    """An agent executor that calls the execute tool with fixed code, then replies, without an LLM."""
+
+    def __init__(self, agent, tool_calls, output="Done", preview=False):
+        self.agent = agent
+        self.tool_calls = tool_calls
+        self.output = output
+        self.preview = preview
+
+    def invoke(self, inputs, config=None):
+        for code in self.tool_calls:
+            self.agent.execute_plotly_code(code, preview=self.preview)
+        return {"output": self.output}
+
+
+def make_agent(tool_calls, output="Done", preview=False, **kwargs):
+    """Create an agent with a scripted executor and a dataframe."""
+    agent = PlotAgent(verbose=False, **kwargs)
+    agent.set_df(pd.DataFrame({"x": list("abcdefgh"), "y": range(8)}))
+    agent.agent_executor = ScriptedAgentExecutor(agent, tool_calls, output, preview)
+    return agent
+
+
+def executed(agent):
+    """Count the executions actually run during the last message."""
+    return len(agent.last_metrics["executions"])
+
+
+def test_failed_code_is_not_rerun_by_fallbacks():
+    """Test that the last code is not run again after the agent, if it already failed."""
+    agent = make_agent([BROKEN_CODE], output=f"Try:\n```python\n{BROKEN_CODE}\n```")
+
+    agent.process_message("Plot it")
+
+    assert executed(agent) == 1
+    assert agent.last_metrics["skipped_executions"] == 2
+    assert agent.get_figure() is None
+    assert agent.figure_code is None
+
+
+def test_repeated_tool_calls_reuse_known_outcomes():
+    """Test that resubmitted code returns its known result without running again."""
+    agent = make_agent([BROKEN_CODE, BROKEN_CODE, BAR_CODE, BAR_CODE])
+
+    agent.process_message("Plot it")
+
+    assert executed(agent) == 2
+    assert agent.last_metrics["skipped_executions"] == 2
+    assert agent.figure_code == BAR_CODE
+
+
+def test_equivalent_code_counts_as_known():
+    """Test that code differing only in comments and formatting is recognized."""
+    agent = make_agent([BROKEN_CODE, "# try again\nfig = px.bar(df,  x='missing')"])
+
+    agent.process_message("Plot it")
+
+    assert executed(agent) == 1
+
+
+def test_successful_code_reruns_once_replaced():
+    """Test that successful code runs again if other code replaced its figure."""
+    agent = make_agent([BAR_CODE, LINE_CODE, BAR_CODE])
+
+    agent.process_message("Plot it")
+
+    assert executed(agent) == 3
+    assert agent.figure_code == BAR_CODE
+    assert agent.get_figure().data[0].type == "bar"
+
+
+def test_figure_code_reports_the_snippet_behind_the_figure():
+    """Test that figure_code names the code behind the figure, not the last code tried."""
+    agent = make_agent([BAR_CODE, BROKEN_CODE])
+
+    agent.process_message("Plot it")
+
+    assert agent.generated_code == BROKEN_CODE
+    assert agent.figure_code == BAR_CODE
+    assert agent.last_metrics["figure_code_hash"] == agent.last_metrics["executions"][0]["code_hash"]
+
+
+def test_response_code_is_run_when_new():
+    """Test that a code block in the response still runs if it was never tried."""
+    agent = make_agent([], output=f"Here you go:\n```python\n{LINE_CODE}\n```")
+
+    agent.process_message("Plot it")
+
+    assert executed(agent) == 1
+    assert agent.figure_code == LINE_CODE
+
+
+def test_failed_preview_is_not_rerun_on_full_dataframe():
+    """Test that code that failed on the preview sample is not retried on the full dataframe."""
+    agent = make_agent([BROKEN_CODE], preview=True, preview_rows=4)
+
+    agent.process_message("Plot it")
+
+    assert [execution["preview"] for execution in agent.last_metrics["executions"]] == [True]
+
+
+def test_accepted_preview_runs_once_on_full_dataframe():
+    """Test that accepted preview code runs once on the full dataframe, and not again after."""
+    agent = make_agent([BAR_CODE], preview=True, preview_rows=4)
+
+    agent.process_message("Plot it")
+
+    assert [execution["preview"] for execution in agent.last_metrics["executions"]] == [True, False]
+    assert len(agent.get_figure().data[0].x) == 8
+    assert agent.figure_code == BAR_CODE
+
+
+def test_outcomes_are_forgotten_between_messages():
+    """Test that each message starts without known outcomes."""
+    agent = make_agent([BROKEN_CODE])
+
+    agent.process_message("Plot it")
+    agent.process_message("Plot it again")
+
+    assert executed(agent) == 1
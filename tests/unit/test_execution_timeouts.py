@@ -0,0 +1,135 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+from plot_agent.execution import PlotAgentExecutionEnvironment
+
+
+INFINITE_LOOP = """
+counter = 0
+while True:
+    counter += 1
+"""
+
+
+def make_env(timeout=1):
+    """Create an execution environment with a short timeout."""
+    env = PlotAgentExecutionEnvironment(pd.DataFrame({"x": [1, 2, 3]}))
+    env.TIMEOUT_SECONDS = timeout
+    return env
+
+
+def test_timeout_in_worker_thread():
+    """Test that runaway code is stopped when executed outside the main thread."""
+    env = make_env()
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        result = executor.submit(env.execute_code, INFINITE_LOOP).result(timeout=10)
+
+    assert result["success"] is False
+    assert "timed out" in result["error"]
+
+
+def test_concurrent_timeouts():
+    """Test that several runaway executions time out independently."""
+    envs = [make_env() for _ in range(4)]
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(lambda env: env.execute_code(INFINITE_LOOP), envs))
+
+    assert all("timed out" in result["error"] for result in results)
+    assert time.monotonic() - start < 10
+
+
+def test_cancel_from_another_thread():
+    """Test that cancel() interrupts an execution running in another thread."""
+    env = make_env(timeout=30)
+    results = []
+
+    thread = threading.Thread(target=lambda: results.append(env.execute_code(INFINITE_LOOP)))
+    thread.start()
+
+    # Wait until the execution has started, then cancel it
+    deadline = time.monotonic() + 10
+    while not env.cancel() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    thread.join(timeout=10)
+
+    assert results and results[0]["error"] == "Code execution was cancelled."
+
+
+def test_cancel_when_idle():
+    """Test that cancel() is a no-op when nothing is running."""
+    env = make_env()
+    assert env.cancel() is False
+
+    # The environment still works afterwards
+    result = env.execute_code("fig = px.bar(df, y='x')")
+    assert result["success"] is True
+
+
+def test_timeout_from_event_loop():
+    """Test that timeouts work for executions scheduled from an asyncio event loop."""
+    env = make_env()
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, env.execute_code, INFINITE_LOOP)
+
+    result = asyncio.run(run())
+    assert "timed out" in result["error"]
+
+
+def test_concurrent_output_capture():
+    """Test that output printed by concurrent executions is captured separately."""
+    envs = [make_env(timeout=10) for _ in range(8)]
+
+    def run(index):
+        return envs[index].execute_code(f"for i in range(200):\n    print('run-{index}')")
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(run, range(8)))
+
+    for index, result in enumerate(results):
+        lines = set(result["output"].split())
+        assert lines == {f"run-{index}"}
+
+
+def test_timeout_not_swallowed_by_generated_code():
+    """Test that generated code catching Exception cannot swallow the timeout."""
+    env = make_env()
+
+    code = """
+while True:
+    try:
+        total = sum(range(1000))
+    except Exception:
+        pass
+"""
+    result = env.execute_code(code)
+    assert "timed out" in result["error"]
+
+
+def test_timeout_caught_by_generated_code():
+    """Test that code catching the timeout itself still times out, and its thread finishes."""
+    env = make_env()
+
+    code = """
+try:
+    while True:
+        pass
+except BaseException:
+    pass
+"""
+    before = threading.active_count()
+    result = env.execute_code(code)
+    assert "timed out" in result["error"]
+
+    # The sandbox thread exits once the code finishes, instead of waiting for another interrupt
+    deadline = time.monotonic() + 5
+    while threading.active_count() > before and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert threading.active_count() == before
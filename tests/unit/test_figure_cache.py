@@ -0,0 +1,116 @@
+import pandas as pd
+import plotly.graph_objects as go
+from plot_agent.agent import PlotAgent
+from plot_agent.cache import FigureCache, code_hash, dataframe_fingerprint
+from plot_agent.execution import PlotAgentExecutionEnvironment
+
+
+SCATTER_CODE = """import plotly.express as px
+fig = px.scatter(df, x='x', y='y')"""
+
+
+def make_df():
+    return pd.DataFrame({"x": [1, 2, 3, 4, 5], "y": [10, 20, 30, 40, 50]})
+
+
+def test_code_hash_ignores_formatting():
+    """Test that comments and whitespace do not change the code hash."""
+    reformatted = """import plotly.express as px
+
+# Scatter plot of x vs y
+fig = px.scatter( df, x = 'x', y = 'y' )
+"""
+    assert code_hash(SCATTER_CODE) == code_hash(reformatted)
+    assert code_hash(SCATTER_CODE) != code_hash(SCATTER_CODE.replace("'y'", "'x'"))
+
+
+def test_dataframe_fingerprint():
+    """Test that the fingerprint tracks the dataframe's contents."""
+    df = make_df()
+    assert dataframe_fingerprint(df) == dataframe_fingerprint(df.copy())
+
+    changed = df.copy()
+    changed.loc[0, "y"] = 99
+    assert dataframe_fingerprint(df) != dataframe_fingerprint(changed)
+
+
+def test_execution_uses_cache():
+    """Test that re-running identical code returns the cached figure."""
+    cache = FigureCache()
+    env = PlotAgentExecutionEnvironment(make_df(), cache=cache)
+
+    first = env.execute_code(SCATTER_CODE)
+    second = env.execute_code("# same plot\n" + SCATTER_CODE)
+
+    assert first["success"] and second["success"]
+    assert cache.cache_info()["hits"] == 1
+    assert second["fig"] == first["fig"]
+    # Hits are independent copies
+    assert second["fig"] is not first["fig"]
+
+
+def test_cache_is_keyed_by_dataframe():
+    """Test that the same code against a different dataframe is not a hit."""
+    cache = FigureCache()
+    PlotAgentExecutionEnvironment(make_df(), cache=cache).execute_code(SCATTER_CODE)
+
+    other = make_df()
+    other["y"] = other["y"] * 2
+    result = PlotAgentExecutionEnvironment(other, cache=cache).execute_code(SCATTER_CODE)
+
+    assert result["success"]
+    assert cache.cache_info()["hits"] == 0
+    assert len(cache) == 2
+
+
+def test_failures_are_not_cached():
+    """Test that failed executions are not cached."""
+    cache = FigureCache()
+    env = PlotAgentExecutionEnvironment(make_df(), cache=cache)
+
+    env.execute_code("fig = px.scatter(df, x='missing', y='y')")
+    assert len(cache) == 0
+
+
+def test_lru_eviction_by_count_and_size():
+    """Test that the cache evicts least recently used entries to stay within bounds."""
+    cache = FigureCache(max_entries=2)
+    cache.put("a", go.Figure())
+    cache.put("b", go.Figure())
+    cache.get("a")
+    cache.put("c", go.Figure())
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.cache_info()["evictions"] == 1
+
+    small = FigureCache(max_bytes=1)
+    small.put("a", go.Figure())
+    assert len(small) == 0
+
+
+def test_persistent_cache(tmp_path):
+    """Test that entries persisted to disk are available to a new cache."""
+    cache = FigureCache(directory=str(tmp_path))
+    key = FigureCache.key(SCATTER_CODE, "fingerprint")
+    cache.put(key, go.Figure(go.Bar(y=[1, 2, 3])))
+
+    reloaded = FigureCache(directory=str(tmp_path))
+    assert len(reloaded) == 1
+    fig = reloaded.get(key)
+    assert list(fig.data[0].y) == [1, 2, 3]
+
+    reloaded.clear()
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_agent_with_figure_cache():
+    """Test that PlotAgent passes its figure cache to the execution environment."""
+    cache = FigureCache()
+    agent = PlotAgent(figure_cache=cache)
+    agent.set_df(make_df())
+
+    assert "Code executed successfully" in agent.execute_plotly_code(SCATTER_CODE)
+    assert "Code executed successfully" in agent.execute_plotly_code(SCATTER_CODE)
+    assert cache.cache_info()["hits"] == 1
+    assert agent.get_figure() is not None
@@ -0,0 +1,116 @@
+import pandas as pd
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from plot_agent.agent import PlotAgent
+from plot_agent.history import compact_history
+from plot_agent.profiling import estimate_tokens
+from plot_agent.testing import ScriptedChatModel
+
+
+def code_block(i):
+    """A long, commented code block like the ones the prompt asks for."""
+    comments = "\n".join(f"# Step {j} of version {i}: explain what this does in detail" for j in range(30))
+    return f"```python\n{comments}\nfig = px.line(df, x='x', y='y{i}')\n```"
+
+
+def make_history(turns):
+    """Create a chat history of iterative plotting turns."""
+    messages = []
+    for i in range(turns):
+        messages.append(HumanMessage(content=f"Change the plot, version {i}"))
+        messages.append(AIMessage(content=f"Here is version {i}:\n{code_block(i)}"))
+    return messages
+
+
+def total_tokens(messages):
+    """Estimate the tokens of a list of messages."""
+    return sum(estimate_tokens(message.content) for message in messages)
+
+
+def test_short_history_is_kept():
+    """Test that a history within budget is kept verbatim."""
+    messages = make_history(2)
+
+    compacted = compact_history(messages, token_budget=100000)
+
+    assert compacted == messages
+
+
+def test_long_history_is_compacted_within_budget():
+    """Test that older turns are summarized and only the latest code is kept."""
+    messages = make_history(40)
+
+    compacted = compact_history(messages, token_budget=2000)
+
+    assert total_tokens(compacted) <= 2000
+    assert isinstance(compacted[0], SystemMessage)
+    assert compacted[0].content.startswith("Summary of the earlier conversation:")
+    assert "User: Change the plot, version 37 | Assistant: Here is version 37: [code]" in compacted[0].content
+    # The two most recent turns are kept, with code only in the latest message
+    assert [message.content.split("\n")[0] for message in compacted[1:]] == [
+        "Change the plot, version 38",
+        "Here is version 38:",
+        "Change the plot, version 39",
+        "Here is version 39:",
+    ]
+    assert "```" not in compacted[2].content
+    assert compacted[4].content == messages[-1].content
+    # The input is not modified
+    assert "```" in messages[-3].content
+
+
+def test_compaction_size_is_flat():
+    """Test that the compacted history stops growing with the number of turns."""
+    sizes = [total_tokens(compact_history(make_history(n), token_budget=1500)) for n in (80, 320, 1280)]
+
+    assert max(sizes) <= 1500
+    assert max(sizes) - min(sizes) < 100
+
+
+def test_latest_code_is_kept_once():
+    """Test that the latest working code is added if no kept message contains it."""
+    messages = [
+        HumanMessage(content="Plot it"),
+        AIMessage(content=f"Done.\n{code_block(0)}"),
+        HumanMessage(content="Thanks, now make it red"),
+    ]
+    latest_code = "fig = px.line(df, x='x', y='y', color_discrete_sequence=['red'])"
+
+    compacted = compact_history(messages, token_budget=300, recent_turns=1, latest_code=latest_code)
+
+    assert sum(latest_code in message.content for message in compacted) == 1
+    assert compacted[-1].content == "Thanks, now make it red"
+
+
+def test_agent_sends_compacted_history():
+    """Test that the agent compacts the history it sends, but keeps the full history."""
+    agent = PlotAgent(history_token_budget=1000)
+    agent.set_df(pd.DataFrame({"x": [1, 2], "y": [3, 4]}))
+    agent.chat_history = make_history(30)
+
+    inputs = agent._agent_inputs("Next", latest_code="fig = px.bar(df, x='x', y='y')")
+
+    assert total_tokens(inputs["chat_history"]) <= 1000
+    assert len(agent.chat_history) == 60
+
+
+def test_agent_keeps_the_code_of_the_figure():
+    """Test that the history keeps the code that built the figure, not failed code tried after it."""
+    good = "fig = px.bar(df, x='x', y='y')"
+    bad = "fig = px.bar(df, x='nope', y='y')"
+    llm = ScriptedChatModel(script=[])
+    agent = PlotAgent(llm=llm, history_token_budget=1000, verbose=False)
+    agent.set_df(pd.DataFrame({"x": [1, 2], "y": [3, 4]}))
+    latest_codes = []
+    agent_inputs = agent._agent_inputs
+    agent._agent_inputs = lambda message, latest_code=None: (
+        latest_codes.append(latest_code) or agent_inputs(message, latest_code)
+    )
+
+    # A working attempt, then a failing one, then a message without code
+    for code in (good, bad, None):
+        llm.script = [{"tool": "execute_plotly_code", "args": {"generated_code": code}}] if code else []
+        llm.script.append({"content": "Done."})
+        agent.process_message("Plot it")
+
+    assert agent.generated_code is None
+    assert latest_codes == [None, good, good]
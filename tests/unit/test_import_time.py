@@ -0,0 +1,70 @@
+import json
+import subprocess
+import sys
+
+
+# Seconds that importing plot_agent may add on top of pandas and numpy
+IMPORT_TIME_BUDGET_SECONDS = 0.5
+
+# Modules that must only be loaded once an agent is built or code is executed
+HEAVY_MODULES = [
+    "langchain",
+    "langchain_core",
+    "langchain_openai",
+    "openai",
+    "matplotlib",
+    "plotly",
+]
+
+IMPORT_SCRIPT = """
+import json, sys, time
+import numpy, pandas
+start = time.perf_counter()
+import plot_agent.agent
+elapsed = time.perf_counter() - start
+loaded = sorted({name.split('.')[0] for name in sys.modules})
+print(json.dumps({"elapsed": elapsed, "loaded": loaded}))
+"""
+
+
+def run_import():
+    """Import plot_agent.agent in a fresh interpreter and report what it cost."""
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_SCRIPT], capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def test_import_does_not_load_heavy_dependencies():
+    """Test that importing plot_agent.agent loads neither LLM nor plotting libraries."""
+    loaded = set(run_import()["loaded"])
+    assert loaded.isdisjoint(HEAVY_MODULES), loaded & set(HEAVY_MODULES)
+
+
+def test_import_time_budget():
+    """Test that importing plot_agent.agent stays within its time budget."""
+    # Best of a few runs, to ignore noise from a busy machine
+    elapsed = min(run_import()["elapsed"] for _ in range(3))
+    assert elapsed < IMPORT_TIME_BUDGET_SECONDS, f"import took {elapsed:.3f}s"
+
+
+def test_sandbox_resolves_libraries_lazily():
+    """Test that plotting libraries are imported only when executed code uses them."""
+    script = """
+import json, sys
+import pandas as pd
+from plot_agent.execution import PlotAgentExecutionEnvironment
+env = PlotAgentExecutionEnvironment(pd.DataFrame({"x": [1, 2, 3]}))
+env.execute_code("total = df['x'].sum()")
+before = "plotly" in sys.modules
+result = env.execute_code("fig = px.bar(df, y='x')")
+print(json.dumps({"before": before, "after": "plotly" in sys.modules, "success": result["success"]}))
+"""
+    output = subprocess.run(
+        [sys.executable, "-c", script], capture_output=True, text=True, check=True
+    ).stdout
+    assert json.loads(output.strip().splitlines()[-1]) == {
+        "before": False,
+        "after": True,
+        "success": True,
+    }
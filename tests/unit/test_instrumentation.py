@@ -0,0 +1,174 @@
+import asyncio
+import time
+
+import pandas as pd
+import pytest
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from plot_agent.agent import PlotAgent
+from plot_agent.execution import PlotAgentExecutionEnvironment
+from plot_agent.instrumentation import MessageMetrics, flatten_metrics, track_peak_memory
+
+
+BAR_CODE = "fig = px.bar(df, x='x', y='y')"
+
+
+class ScriptedChatModel(BaseChatModel):
+    """A chat model that replies with a fixed list of messages, in order."""
+
+    replies: list
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(0.01)
+        return ChatResult(generations=[ChatGeneration(message=self.replies.pop(0))])
+
+
+def tool_call_reply(code, input_tokens=100, output_tokens=20):
+    """A reply calling execute_plotly_code."""
+    return AIMessage(
+        content="",
+        tool_calls=[{"name": "execute_plotly_code", "args": {"generated_code": code}, "id": "call_1"}],
+        usage_metadata={
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens,
+        },
+    )
+
+
+def final_reply(content="Here is your plot."):
+    """A final reply."""
+    return AIMessage(
+        content=content, usage_metadata={"input_tokens": 150, "output_tokens": 5, "total_tokens": 155}
+    )
+
+
+def make_agent(replies, **kwargs):
+    """Create an agent with a scripted chat model and a dataframe."""
+    agent = PlotAgent(verbose=False, **kwargs)
+    agent.llm = ScriptedChatModel(replies=replies)
+    agent.set_df(pd.DataFrame({"x": ["a", "b"], "y": [1, 2]}))
+    return agent
+
+
+def test_execute_code_reports_metrics():
+    """Test that execute_code reports the time of each stage and optionally peak memory."""
+    env = PlotAgentExecutionEnvironment(pd.DataFrame({"x": [1, 2]}), track_memory=True)
+
+    metrics = env.execute_code("big = list(range(100000))\nfig = px.bar(df, y='x')")["metrics"]
+
+    assert metrics["preview"] is False and metrics["cached"] is False
+    assert 0 < metrics["validate_seconds"] < metrics["seconds"]
+    assert 0 < metrics["exec_seconds"] < metrics["seconds"]
+    assert metrics["peak_memory_bytes"] > 100000 * 8
+
+    rejected = env.execute_code("import os")["metrics"]
+    assert "validate_seconds" in rejected and "exec_seconds" not in rejected
+
+
+def test_process_message_metrics():
+    """Test that process_message reports stages, LLM calls, tokens and executions."""
+    received = []
+    agent = make_agent(
+        [tool_call_reply("fig = px.bar(df, x='missing')"), tool_call_reply(BAR_CODE), final_reply()],
+        metrics_callbacks=[received.append],
+    )
+
+    agent.process_message("Plot it")
+
+    metrics = agent.last_metrics
+    assert received == [metrics]
+    assert metrics["iterations"] == 3
+    assert metrics["tool_calls"] == 2
+    assert metrics["input_tokens"] == 350 and metrics["output_tokens"] == 45
+    assert all(call["seconds"] >= 0.01 for call in metrics["llm_calls"])
+    assert [execution["stage"] for execution in metrics["executions"]] == ["agent", "agent"]
+    assert set(metrics["stages"]) == {"agent", "fallback"}
+    assert metrics["total_seconds"] >= metrics["stages"]["agent"] >= metrics["llm_seconds"]
+    assert metrics["error"] is None
+
+
+def test_fallback_executions_are_tagged():
+    """Test that executions run after the agent loop are attributed to the fallback stage."""
+    agent = make_agent([final_reply(f"Try this:\n```python\n{BAR_CODE}\n```")])
+
+    agent.process_message("Plot it")
+
+    assert agent.last_metrics["iterations"] == 1
+    assert [execution["stage"] for execution in agent.last_metrics["executions"]] == ["fallback"]
+    assert agent.get_figure() is not None
+
+
+def test_async_process_message_metrics():
+    """Test that aprocess_message reports the same metrics."""
+    agent = make_agent([tool_call_reply(BAR_CODE), final_reply()])
+
+    asyncio.run(agent.aprocess_message("Plot it"))
+
+    assert agent.last_metrics["iterations"] == 2
+    assert agent.last_metrics["tool_calls"] == 1
+    assert agent.last_metrics["input_tokens"] == 250
+
+
+def test_failed_message_still_reports_metrics():
+    """Test that metrics are published with the error when process_message fails."""
+    received = []
+    agent = make_agent([], metrics_callbacks=[received.append])
+
+    with pytest.raises(IndexError):
+        agent.process_message("Plot it")
+
+    assert received[0]["error"].startswith("IndexError")
+
+
+def test_broken_callback_does_not_break_request():
+    """Test that a failing metrics callback only warns."""
+
+    def broken(metrics):
+        raise RuntimeError("exporter down")
+
+    agent = make_agent([final_reply()], metrics_callbacks=[broken])
+
+    with pytest.warns(UserWarning, match="exporter down"):
+        assert agent.process_message("Plot it") == "Here is your plot."
+
+
+def test_flatten_metrics():
+    """Test that metrics flatten into numbers for exporters."""
+    metrics = MessageMetrics()
+    with metrics.stage("agent"):
+        metrics.record_llm_call(0.5, 100, 10)
+        metrics.record_execution({"seconds": 0.25, "peak_memory_bytes": 1024})
+    metrics.finish()
+
+    flat = flatten_metrics(metrics.to_dict())
+
+    assert flat["plot_agent.iterations"] == 1
+    assert flat["plot_agent.input_tokens"] == 100
+    assert flat["plot_agent.execution_seconds"] == 0.25
+    assert flat["plot_agent.peak_memory_bytes"] == 1024
+    assert flat["plot_agent.executions"] == 1
+    assert flat["plot_agent.errors"] == 0
+    assert "plot_agent.stage.agent.seconds" in flat
+    assert all(isinstance(value, (int, float)) for value in flat.values())
+
+
+def test_track_peak_memory_leaves_tracemalloc_off():
+    """Test that memory tracking only runs tracemalloc while needed."""
+    import tracemalloc
+
+    metrics = {}
+    with track_peak_memory(metrics):
+        data = bytearray(10 * 1024 * 1024)
+        del data
+
+    assert metrics["peak_memory_bytes"] >= 10 * 1024 * 1024
+    assert not tracemalloc.is_tracing()
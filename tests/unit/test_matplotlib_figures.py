@@ -0,0 +1,167 @@
+import os
+import subprocess
+import sys
+import threading
+
+import pandas as pd
+import pytest
+from plot_agent.agent import PlotAgent
+from plot_agent.execution import PlotAgentExecutionEnvironment
+from plot_agent.instrumentation import MessageMetrics, flatten_metrics
+from plot_agent.matplotlib_figures import figure_to_png, import_pyplot, track_figures
+from plot_agent.testing import ScriptedChatModel
+
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+@pytest.fixture
+def env():
+    """An execution environment with a small dataframe."""
+    return PlotAgentExecutionEnvironment(pd.DataFrame({"x": [1, 2, 3], "y": [10, 20, 30]}))
+
+
+def test_figures_are_closed_after_each_run(env):
+    """Test that pyplot's registry does not grow, whatever the code leaves open."""
+    plt = import_pyplot()
+    open_before = plt.get_fignums()
+
+    for _ in range(20):
+        result = env.execute_code("fig, ax = plt.subplots()\nax.plot(df['x'], df['y'])\nplt.figure()")
+        assert result["success"] is True
+        assert result["metrics"]["matplotlib_figures_closed"] == 2
+
+    assert plt.get_fignums() == open_before
+
+
+def test_figures_are_closed_when_code_fails(env):
+    """Test that figures created before an error are closed too."""
+    plt = import_pyplot()
+    open_before = plt.get_fignums()
+
+    result = env.execute_code("plt.subplots()\nraise ValueError('broken')")
+
+    assert result["success"] is False
+    assert result["metrics"]["matplotlib_figures_closed"] == 1
+    assert plt.get_fignums() == open_before
+
+
+def test_matplotlib_results_are_accepted(env):
+    """Test that figures, axes and arrays of axes are all accepted as `fig`."""
+    for code in (
+        "fig = plt.figure()\nplt.plot(df['x'], df['y'])",
+        "_, fig = plt.subplots()\nfig.plot(df['x'], df['y'])",
+        "_, fig = plt.subplots(2)\nfig[0].plot(df['x'], df['y'])",
+        "import matplotlib.pyplot as pyplot\nfig, ax = pyplot.subplots()",
+    ):
+        result = env.execute_code(code)
+        assert result["success"] is True, code
+        assert type(result["fig"]).__name__ == "Figure", code
+        assert env.fig is result["fig"]
+
+
+def test_drawn_figure_is_used_without_fig(env):
+    """Test that code only drawing with pyplot produces the last figure it created."""
+    result = env.execute_code("plt.figure()\nplt.bar(df['x'], df['y'])\nplt.figure()\nplt.plot(df['x'], df['y'])")
+
+    assert result["success"] is True
+    assert "last matplotlib figure" in result["output"]
+    assert result["fig"].axes[0].lines
+
+
+def test_other_runs_figures_are_left_open():
+    """Test that a run closes only its own figures, not those of other threads or earlier runs."""
+    plt = import_pyplot()
+    created = []
+
+    def untracked():
+        created.append(plt.figure())
+
+    def tracked():
+        with track_figures() as figures:
+            plt.figure()
+        created.append(figures)
+
+    try:
+        # A figure of the application, on a thread that may share its id with a later run's
+        thread = threading.Thread(target=untracked)
+        thread.start()
+        thread.join()
+        thread = threading.Thread(target=tracked)
+        thread.start()
+        thread.join()
+
+        application_figure, closed = created
+        assert len(closed) == 1
+        assert application_figure.number in plt.get_fignums()
+        assert closed[0].number not in plt.get_fignums()
+    finally:
+        plt.close(created[0])
+
+
+def test_figure_registration_is_restored():
+    """Test that pyplot's figure registration is only wrapped while runs are going on."""
+    from matplotlib._pylab_helpers import Gcf
+
+    import_pyplot()
+    original = Gcf.__dict__["_set_new_active_manager"]
+    with track_figures():
+        assert Gcf.__dict__["_set_new_active_manager"] is not original
+    assert Gcf.__dict__["_set_new_active_manager"] is original
+
+
+def test_sandbox_backend_is_only_set_when_unchosen():
+    """Test that importing pyplot for sandboxed code keeps a backend the application chose."""
+    code = (
+        "import matplotlib\n"
+        "matplotlib.use('svg')\n"
+        "from plot_agent.matplotlib_figures import import_pyplot\n"
+        "import_pyplot()\n"
+        "print(matplotlib.get_backend())"
+    )
+    env = {key: value for key, value in os.environ.items() if key != "MPLBACKEND"}
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, env=env, check=True)
+    assert output.stdout.strip() == "svg"
+
+    # Without a choice, the headless backend is selected
+    code = code.replace("matplotlib.use('svg')\n", "")
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, env=env, check=True)
+    assert output.stdout.strip().lower() == "agg"
+
+
+def test_figure_to_png(env):
+    """Test that closed figures still rasterize to PNG."""
+    result = env.execute_code("fig, ax = plt.subplots(figsize=(4, 3))\nax.plot(df['x'], df['y'])")
+
+    png = figure_to_png(result["fig"], dpi=50)
+
+    assert png.startswith(PNG_SIGNATURE)
+    # The image size is in the IHDR chunk
+    assert int.from_bytes(png[16:20], "big") == 200
+    assert int.from_bytes(png[20:24], "big") == 150
+
+
+def test_agent_exports_matplotlib_figures_as_png(tmp_path):
+    """Test that export_figure writes matplotlib figures as PNG images."""
+    agent = PlotAgent(llm=ScriptedChatModel(), verbose=False)
+    agent.set_df(pd.DataFrame({"x": [1, 2, 3], "y": [10, 20, 30]}))
+    agent.execution_env.execute_code("fig, ax = plt.subplots()\nax.plot(df['x'], df['y'])")
+
+    png = agent.export_figure()
+    assert png.startswith(PNG_SIGNATURE)
+    assert agent.export_figure(tmp_path / "figure.png") == len(png)
+    assert (tmp_path / "figure.png").read_bytes().startswith(PNG_SIGNATURE)
+
+
+def test_resident_memory_is_reported(env):
+    """Test that executions report the resident memory of the process, and its change."""
+    result = env.execute_code("fig = px.line(df, x='x', y='y')")
+    assert result["metrics"]["rss_bytes"] > 0
+    assert isinstance(result["metrics"]["rss_delta_bytes"], int)
+
+    metrics = MessageMetrics()
+    metrics.record_execution({"seconds": 0.1, "rss_delta_bytes": 4096})
+    metrics.record_execution({"seconds": 0.1, "rss_delta_bytes": -1024})
+    metrics.finish()
+    assert metrics.to_dict()["rss_delta_bytes"] == 3072
+    assert flatten_metrics(metrics.to_dict())["plot_agent.rss_delta_bytes"] == 3072
@@ -0,0 +1,100 @@
+import numpy as np
+import pandas as pd
+from plot_agent.agent import PlotAgent
+from plot_agent.execution import PlotAgentExecutionEnvironment
+from plot_agent.sampling import sample_dataframe
+
+
+LENGTH_CODE = """import plotly.graph_objects as go
+fig = go.Figure(go.Scatter(x=df['x'], y=df['y']), layout_title_text=str(len(df)))"""
+
+
+def make_df(n_rows=10000):
+    """Create a dataframe with a rare category."""
+    category = np.where(np.arange(n_rows) == n_rows // 2, "rare", "common")
+    return pd.DataFrame({"x": np.arange(n_rows), "y": np.arange(n_rows) * 2, "category": category})
+
+
+def test_sample_dataframe():
+    """Test that samples have the requested size and keep rows in order."""
+    df = make_df()
+
+    sample = sample_dataframe(df, 100)
+
+    assert len(sample) == 100
+    assert sample["x"].is_monotonic_increasing
+    assert sample_dataframe(df, 100).equals(sample)
+    assert sample_dataframe(df, len(df)) is df
+
+
+def test_sample_dataframe_stratified():
+    """Test that stratified samples represent every group."""
+    df = make_df()
+
+    sample = sample_dataframe(df, 100, stratify_by="category")
+
+    assert set(sample["category"]) == {"common", "rare"}
+    assert 100 <= len(sample) <= 101
+
+
+def test_preview_execution_leaves_fig_untouched():
+    """Test that preview executions run on the sample and do not set fig."""
+    env = PlotAgentExecutionEnvironment(make_df(), preview_rows=100)
+
+    result = env.execute_code(LENGTH_CODE, preview=True)
+
+    assert result["success"]
+    assert "preview sample of 100 of the 10000 rows" in result["output"]
+    assert env.preview_fig.layout.title.text == "100"
+    assert env.fig is None
+    assert env.accepted_code == LENGTH_CODE
+
+
+def test_finalize_preview_renders_on_full_dataframe():
+    """Test that finalize_preview runs the accepted code on the full dataframe once."""
+    env = PlotAgentExecutionEnvironment(make_df(), preview_rows=100)
+    env.execute_code(LENGTH_CODE, preview=True)
+
+    result = env.finalize_preview()
+
+    assert result["success"]
+    assert env.fig.layout.title.text == "10000"
+    assert env.accepted_code is None
+    assert env.finalize_preview() is None
+
+
+def test_failed_preview_is_not_accepted():
+    """Test that code failing on the preview sample is not accepted."""
+    env = PlotAgentExecutionEnvironment(make_df(), preview_rows=100)
+
+    result = env.execute_code("fig = df['missing']", preview=True)
+
+    assert not result["success"]
+    assert env.accepted_code is None
+
+
+def test_preview_without_preview_rows_runs_on_full_dataframe():
+    """Test that preview executions use the full dataframe when preview mode is off."""
+    env = PlotAgentExecutionEnvironment(make_df())
+
+    env.execute_code(LENGTH_CODE, preview=True)
+
+    assert env.fig.layout.title.text == "10000"
+
+
+def test_agent_tool_loop_uses_preview():
+    """Test that the agent's tool previews code and the final figure uses the full dataframe."""
+    agent = PlotAgent(preview_rows=100)
+    agent.set_df(make_df())
+    tool = next(t for t in agent.agent_executor.tools if t.name == "execute_plotly_code")
+
+    # A failing attempt after the accepted one does not replace the figure
+    assert "preview sample" in tool.invoke({"generated_code": LENGTH_CODE})
+    assert "Error" in tool.invoke({"generated_code": "fig = df['missing']"})
+    assert agent.does_fig_exist() == "A figure is available for display."
+    assert agent.get_figure() is None
+
+    agent._run_fallback_executions("Here is your plot.")
+
+    assert agent.get_figure().layout.title.text == "10000"
+    assert agent.generated_code == LENGTH_CODE
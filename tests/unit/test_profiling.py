@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+from plot_agent.agent import PlotAgent
+from plot_agent.profiling import estimate_tokens, profile_dataframe
+
+
+def test_profile_small_dataframe():
+    """Test that a small dataframe is described in full."""
+    df = pd.DataFrame({"x": [1, 2, 3, 4, 5], "y": [1.5, None, 2.5, 3.0, None]})
+
+    df_info, df_head = profile_dataframe(df)
+
+    assert "RangeIndex: 5 entries" in df_info
+    assert "Data columns (total 2 columns):" in df_info
+    assert "more columns not shown" not in df_info
+    # Null and unique counts for y
+    assert "float64  2      3" in df_info
+    assert df_head.splitlines()[0].split() == ["x", "y"]
+    assert len(df_head.splitlines()) == 6
+
+
+def test_profile_wide_dataframe_stays_within_budget():
+    """Test that a very wide dataframe is capped to the token budget."""
+    df = pd.DataFrame(np.random.rand(100, 5000))
+
+    df_info, df_head = profile_dataframe(df, token_budget=2000)
+
+    assert estimate_tokens(df_info) + estimate_tokens(df_head) <= 2000
+    assert "Data columns (total 5000 columns):" in df_info
+    assert "more columns not shown" in df_info
+    assert "dtypes: float64(5000)" in df_info
+
+
+def test_profile_truncates_long_text():
+    """Test that long text cells are truncated."""
+    df = pd.DataFrame({"text": ["word " * 10000, "short"]})
+
+    df_info, df_head = profile_dataframe(df, max_cell_chars=40)
+
+    assert len(df_info) < 1000
+    assert len(df_head) < 1000
+    assert "..." in df_info
+
+
+def test_profile_tall_dataframe_is_sampled():
+    """Test that nulls and cardinality of tall dataframes are estimated from a sample."""
+    df = pd.DataFrame({"category": np.arange(1_000_000) % 7, "value": np.nan})
+
+    df_info, _ = profile_dataframe(df, sample_rows=1000)
+
+    assert "RangeIndex: 1000000 entries" in df_info
+    assert "estimated from 1000 sampled rows" in df_info
+    assert "~100%" in df_info
+    assert "int64    ~0%    7" in df_info
+
+
+def test_profile_size_is_flat_as_frame_grows():
+    """Test that the profile size does not grow with the number of columns."""
+    sizes = [
+        sum(map(estimate_tokens, profile_dataframe(pd.DataFrame(np.zeros((10, n))))))
+        for n in (200, 2000, 8000)
+    ]
+    assert max(sizes) - min(sizes) < 50
+
+
+def test_set_df_uses_token_budget():
+    """Test that set_df describes the dataframe within the agent's token budget."""
+    df = pd.DataFrame(np.random.rand(10, 3000))
+
+    agent = PlotAgent(prompt_token_budget=1000)
+    agent.set_df(df)
+
+    assert estimate_tokens(agent.df_info) + estimate_tokens(agent.df_head) <= 1000
@@ -0,0 +1,133 @@
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+from plot_agent.agent import PlotAgent
+from plot_agent.testing import DEFAULT_SCRIPT, ScriptedChatModel
+
+
+def make_df(n=100):
+    """Create a dataframe with the columns the default script plots."""
+    return pd.DataFrame(
+        {"x": np.arange(n, dtype=float), "y": np.arange(n) ** 0.5, "category": ["a", "b"] * (n // 2)}
+    )
+
+
+def make_agent(llm):
+    """Create an agent using the given chat model."""
+    agent = PlotAgent(verbose=False, llm=llm)
+    agent.set_df(make_df())
+    return agent
+
+
+def test_default_script_end_to_end(monkeypatch):
+    """Test that the default script drives a full session without an API key."""
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    agent = make_agent(ScriptedChatModel())
+
+    response = agent.process_message("Plot y over x by category")
+
+    assert response == DEFAULT_SCRIPT[-1]["content"]
+    assert agent.get_figure() is not None
+    assert agent.figure_code == DEFAULT_SCRIPT[1]["args"]["generated_code"]
+    metrics = agent.last_metrics
+    assert metrics["iterations"] == 3
+    assert metrics["tool_calls"] == 2
+    assert metrics["input_tokens"] > 0 and metrics["output_tokens"] > 0
+
+
+def test_script_replays_for_every_message():
+    """Test that each message replays the script from its first step."""
+    agent = make_agent(ScriptedChatModel())
+
+    for _ in range(3):
+        agent.process_message("Plot it")
+        assert agent.last_metrics["iterations"] == 3
+
+
+def test_latency_is_simulated():
+    """Test that LLM calls take the configured latency."""
+    agent = make_agent(ScriptedChatModel(script=[{"content": "Done"}], latency=0.2))
+
+    started = time.perf_counter()
+    agent.process_message("Plot it")
+
+    assert time.perf_counter() - started >= 0.2
+    assert agent.last_metrics["llm_calls"][0]["seconds"] >= 0.2
+
+
+def test_shared_model_across_concurrent_sessions():
+    """Test that one model serves concurrent sessions, each following the script."""
+    llm = ScriptedChatModel(latency=0.05, jitter=0.05)
+    agents = [make_agent(llm) for _ in range(8)]
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(lambda agent: agent.process_message("Plot it"), agents))
+
+    assert all(agent.get_figure() is not None for agent in agents)
+    assert all(agent.last_metrics["iterations"] == 3 for agent in agents)
+
+
+def test_async_sessions_overlap():
+    """Test that async sessions wait on the simulated LLM concurrently."""
+    llm = ScriptedChatModel(script=[{"content": "Done"}], latency=0.3)
+    agents = [make_agent(llm) for _ in range(10)]
+
+    async def run_all():
+        await asyncio.gather(*(agent.aprocess_message("Plot it") for agent in agents))
+
+    started = time.perf_counter()
+    asyncio.run(run_all())
+
+    assert time.perf_counter() - started < 10 * 0.3 / 2
+
+
+def test_recorded_script_from_file(tmp_path):
+    """Test that scripts can be replayed from JSON files."""
+    path = tmp_path / "session.json"
+    path.write_text(
+        json.dumps(
+            [
+                {"tool": "execute_plotly_code", "args": {"generated_code": "fig = px.bar(df, x='category', y='y')"}},
+                {"content": "Here is a bar chart."},
+            ]
+        )
+    )
+    agent = make_agent(ScriptedChatModel.from_file(str(path)))
+
+    assert agent.process_message("Plot it") == "Here is a bar chart."
+    assert agent.get_figure().data[0].type == "bar"
+
+
+def test_replies_are_streamed():
+    """Test that replies are streamed token by token."""
+    agent = make_agent(ScriptedChatModel(script=[{"content": "A bar chart of y."}]))
+
+    tokens = [event["text"] for event in agent.stream_message("Plot it") if event["type"] == "token"]
+
+    assert tokens == ["A ", "bar ", "chart ", "of ", "y."]
+
+
+def test_invoked_replies_do_not_call_token_callbacks():
+    """Test that, like real chat models, the model only calls token callbacks when streamed."""
+    from langchain_core.callbacks import BaseCallbackHandler
+
+    class Tokens(BaseCallbackHandler):
+        def __init__(self):
+            self.tokens = []
+
+        def on_llm_new_token(self, token, **kwargs):
+            self.tokens.append(token)
+
+    llm = ScriptedChatModel(script=[{"content": "A bar chart of y."}])
+    handler = Tokens()
+    assert llm.invoke("Plot it", config={"callbacks": [handler]}).content == "A bar chart of y."
+    assert handler.tokens == []
+
+    assert "".join(chunk.content for chunk in llm.stream("Plot it", config={"callbacks": [handler]})) == (
+        "A bar chart of y."
+    )
+    assert handler.tokens == ["A ", "bar ", "chart ", "of ", "y."]
@@ -0,0 +1,96 @@
+import base64
+import io
+import json
+import socket
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+import plotly.io as pio
+from plot_agent import serialization
+from plot_agent.agent import PlotAgent
+from plot_agent.serialization import figure_to_json, write_figure
+
+
+def decode(spec):
+    """Decode a typed array spec."""
+    return np.frombuffer(base64.b64decode(spec["bdata"]), dtype="<" + spec["dtype"])
+
+
+def make_figure():
+    """Create a figure with numpy arrays, a plain list of numbers and dates."""
+    return go.Figure(
+        [
+            go.Scatter(x=np.arange(1000), y=np.linspace(0, 1, 1000)),
+            go.Scatter(y=[float(i) for i in range(100)]),
+            go.Scatter(x=pd.date_range("2024-01-01", periods=3), y=[1, float("nan"), 3]),
+        ],
+        layout_title_text="Compact",
+    )
+
+
+def test_figure_to_json_uses_typed_arrays():
+    """Test that numeric arrays and lists are written as typed arrays."""
+    figure = json.loads(figure_to_json(make_figure()))
+
+    assert figure["data"][0]["x"]["dtype"] == "i4"
+    np.testing.assert_array_equal(decode(figure["data"][0]["y"]), np.linspace(0, 1, 1000))
+    np.testing.assert_array_equal(decode(figure["data"][1]["y"]), np.arange(100.0))
+    assert figure["data"][2]["x"][0].startswith("2024-01-01T00:00:00")
+    assert figure["data"][2]["y"] == [1, None, 3]
+    assert figure["layout"]["title"]["text"] == "Compact"
+    assert len(pio.from_json(figure_to_json(make_figure()).decode()).data) == 3
+
+
+def test_figure_to_json_float32_is_smaller():
+    """Test that float32 output halves the size of float arrays."""
+    fig = go.Figure(go.Scatter(y=np.random.rand(100000)))
+
+    full = figure_to_json(fig)
+    compact = figure_to_json(fig, float32=True)
+
+    assert json.loads(compact)["data"][0]["y"]["dtype"] == "f4"
+    assert len(compact) < 0.6 * len(full)
+    assert len(full) < len(fig.to_json())
+
+
+def test_figure_to_json_without_orjson(monkeypatch):
+    """Test that the standard library encoder gives the same result."""
+    fast = figure_to_json(make_figure())
+    monkeypatch.setattr(serialization, "orjson", None)
+
+    assert json.loads(figure_to_json(make_figure())) == json.loads(fast)
+
+
+def test_write_figure_streams_to_files_and_sockets(tmp_path):
+    """Test that write_figure writes the same JSON to paths, file objects and sockets."""
+    expected = figure_to_json(make_figure())
+
+    path = tmp_path / "figure.json"
+    assert write_figure(make_figure(), path) == len(expected)
+    assert path.read_bytes() == expected
+
+    buffer = io.BytesIO()
+    write_figure(make_figure(), buffer)
+    assert buffer.getvalue() == expected
+
+    sender, receiver = socket.socketpair()
+    with sender, receiver:
+        receiver.settimeout(5)
+        written = write_figure(make_figure(), sender)
+        sender.shutdown(socket.SHUT_WR)
+        received = b""
+        while len(received) < written:
+            received += receiver.recv(65536)
+    assert received == expected
+
+
+def test_agent_export_figure():
+    """Test that export_figure exports the current figure, if there is one."""
+    agent = PlotAgent()
+    assert agent.export_figure() is None
+
+    agent.set_df(pd.DataFrame({"x": [1, 2, 3], "y": [10, 20, 30]}))
+    agent.execute_plotly_code("fig = px.scatter(df, x='x', y='y')")
+
+    assert json.loads(agent.export_figure())["data"][0]["type"] == "scatter"
@@ -0,0 +1,174 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pytest
+from plot_agent.sessions import SessionManager, dataframe_bytes, figure_bytes
+from plot_agent.testing import ScriptedChatModel
+
+
+BAR_CODE = "fig = px.bar(df, x='category', y='y')"
+SCRIPT = [
+    {"tool": "execute_plotly_code", "args": {"generated_code": BAR_CODE}},
+    {"content": "Here is a bar chart."},
+]
+
+
+def make_df(n=1000, seed=0):
+    """Create a session dataframe."""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({"y": rng.random(n), "category": rng.choice(["a", "b", "c"], n)})
+
+
+def make_manager(**kwargs):
+    """Create a session manager whose sessions use a scripted LLM."""
+    return SessionManager(llm=ScriptedChatModel(script=SCRIPT), verbose=False, **kwargs)
+
+
+def test_sessions_share_resources():
+    """Test that sessions share the LLM client and are independent otherwise."""
+    manager = make_manager()
+    first = manager.create_session(make_df(seed=1))
+    second = manager.create_session(make_df(seed=2))
+
+    assert manager.process_message(first, "Plot it") == "Here is a bar chart."
+    with manager.session(first) as agent_1, manager.session(second) as agent_2:
+        assert agent_1.llm is agent_2.llm
+        assert agent_1.get_figure() is not None
+        assert agent_2.get_figure() is None
+        assert len(agent_1.chat_history) == 2 and agent_2.chat_history == []
+    assert len(manager) == 2 and first in manager
+
+
+def test_memory_is_accounted():
+    """Test that the manager tracks the memory of dataframes and figures."""
+    manager = make_manager()
+    df = make_df()
+    session_id = manager.create_session(df)
+
+    assert manager.memory_usage() == dataframe_bytes(df)
+
+    manager.process_message(session_id, "Plot it")
+    fig = manager.get_figure(session_id)
+    assert figure_bytes(fig) > 0
+    assert manager.memory_usage() == dataframe_bytes(df) + figure_bytes(fig)
+
+    manager.close_session(session_id)
+    assert manager.memory_usage() == 0
+    assert session_id not in manager
+
+
+def test_idle_sessions_are_evicted_in_lru_order():
+    """Test that exceeding the budget evicts the least recently used sessions' data."""
+    df_bytes = dataframe_bytes(make_df())
+    manager = make_manager(memory_budget_bytes=int(df_bytes * 2.5))
+    sessions = [manager.create_session(make_df(seed=i)) for i in range(3)]
+
+    # The first session is the least recently used one
+    assert manager.stats()["evicted"] == 1
+    assert manager.memory_usage() <= manager.memory_budget_bytes
+    with manager.session(sessions[1]) as agent:
+        assert agent.df is not None
+
+    # Using the second session made the third the least recently used one
+    manager.create_session(make_df(seed=3))
+    stats = manager.stats()
+    assert stats["evicted"] == 2 and stats["evictions"] == 2
+    assert manager._sessions[sessions[2]].evicted
+
+
+def test_evicted_sessions_are_rehydrated():
+    """Test that evicted sessions reload their dataframe and figure, keeping their history."""
+    frames = {}
+    evicted = []
+
+    def rehydrate(session_id):
+        return frames[session_id]
+
+    manager = make_manager(
+        memory_budget_bytes=int(dataframe_bytes(make_df()) * 2.5),
+        rehydrate=rehydrate,
+        on_evict=lambda session_id, agent: evicted.append((session_id, agent.df is not None)),
+    )
+    first = manager.create_session(session_id="first")
+    frames[first] = make_df(seed=1)
+    manager.set_df(first, frames[first])
+    manager.process_message(first, "Plot it")
+
+    second = manager.create_session(make_df(seed=2))
+    assert evicted == [(first, True)]
+    assert manager._sessions[first].evicted
+
+    # Using the first session brings back its data, and evicts the second one
+    fig = manager.get_figure(first)
+    assert fig is not None and fig.data[0].type == "bar"
+    with manager.session(first) as agent:
+        assert agent.df is frames[first]
+        assert agent.figure_code == BAR_CODE
+        assert len(agent.chat_history) == 2
+    assert manager.stats()["rehydrations"] == 1
+    assert manager._sessions[second].evicted
+
+
+def test_evicted_sessions_without_rehydrate_need_a_dataframe():
+    """Test that without a rehydrate hook, evicted sessions keep their history but need set_df."""
+    manager = make_manager(memory_budget_bytes=int(dataframe_bytes(make_df()) * 2.5))
+    first = manager.create_session(make_df(seed=1))
+    manager.process_message(first, "Plot it")
+    manager.create_session(make_df(seed=2))
+    assert manager._sessions[first].evicted
+
+    assert manager.process_message(first, "Plot it") == "Please set a dataframe first using set_df() method."
+
+    manager.set_df(first, make_df(seed=1))
+    assert manager.process_message(first, "Plot it") == "Here is a bar chart."
+    assert not manager._sessions[first].evicted
+
+
+def test_sessions_in_use_are_not_evicted():
+    """Test that a session in use keeps its data even when over budget."""
+    manager = make_manager(memory_budget_bytes=1)
+    session_id = manager.create_session()
+
+    with manager.session(session_id) as agent:
+        agent.set_df(make_df())
+        manager.create_session(make_df(seed=2))
+        assert agent.df is not None
+
+    assert manager._sessions[session_id].evicted
+
+
+def test_many_sessions_concurrently():
+    """Test that many sessions can be served at once within the budget."""
+    df_bytes = dataframe_bytes(make_df(200))
+    manager = make_manager(memory_budget_bytes=df_bytes * 10, rehydrate=lambda session_id: make_df(200))
+    sessions = [manager.create_session(make_df(200)) for _ in range(50)]
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        responses = list(executor.map(lambda session_id: manager.process_message(session_id, "Plot it"), sessions))
+
+    assert responses == ["Here is a bar chart."] * 50
+    stats = manager.stats()
+    assert stats["sessions"] == 50 and stats["in_use"] == 0
+    assert manager.memory_usage() <= manager.memory_budget_bytes
+    assert stats["resident"] <= 10
+
+
+def test_async_process_message():
+    """Test that sessions can be served from an event loop."""
+    manager = make_manager(rehydrate=lambda session_id: make_df())
+    sessions = [manager.create_session(make_df()) for _ in range(5)]
+
+    async def run_all():
+        return await asyncio.gather(*(manager.aprocess_message(session_id, "Plot it") for session_id in sessions))
+
+    assert asyncio.run(run_all()) == ["Here is a bar chart."] * 5
+
+
+def test_unknown_session():
+    """Test that unknown session ids raise a KeyError."""
+    manager = make_manager()
+
+    with pytest.raises(KeyError):
+        manager.process_message("missing", "Plot it")
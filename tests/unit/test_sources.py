@@ -0,0 +1,224 @@
+import pickle
+
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("pyarrow")
+
+from plot_agent.agent import PlotAgent  # noqa: E402
+from plot_agent.execution import PlotAgentExecutionEnvironment  # noqa: E402
+from plot_agent.pool import PlotAgentWorkerPool, PooledExecutionEnvironment  # noqa: E402
+from plot_agent.profiling import profile_source  # noqa: E402
+from plot_agent.sessions import SessionManager  # noqa: E402
+from plot_agent.sources import ArrowFileSource, open_source  # noqa: E402
+from plot_agent.testing import ScriptedChatModel  # noqa: E402
+
+
+BAR_CODE = "fig = px.bar(x=df['category'], y=df['y'])"
+
+
+def make_df(n=1000):
+    """Create the dataframe written to the source files."""
+    rng = np.random.default_rng(0)
+    return pd.DataFrame(
+        {
+            "x": np.arange(n, dtype=float),
+            "y": rng.random(n),
+            "category": rng.choice(["a", "b", "c"], n),
+            "when": pd.date_range("2024-01-01", periods=n, freq="h"),
+        }
+    )
+
+
+@pytest.fixture(params=["parquet", "feather"])
+def path(request, tmp_path):
+    """Write the dataframe to a Parquet or Feather file."""
+    path = tmp_path / f"data.{request.param}"
+    df = make_df()
+    if request.param == "parquet":
+        df.to_parquet(path, row_group_size=250)
+    else:
+        df.to_feather(path)
+    return path
+
+
+def test_source_reads_metadata_only(path):
+    """Test that opening a source reads its schema and row count, and no columns."""
+    source = open_source(path)
+    assert isinstance(source, ArrowFileSource)
+    assert source.columns == ["x", "y", "category", "when"]
+    assert len(source) == 1000
+    assert source.memory_usage() == 0
+    assert open_source(source) is source
+
+
+def test_source_detects_format_from_content(path, tmp_path):
+    """Test that the format of files without a known extension is told from their bytes."""
+    renamed = tmp_path / "data.bin"
+    renamed.write_bytes(path.read_bytes())
+    assert ArrowFileSource(renamed).file_format == ArrowFileSource(path).file_format
+
+    unknown = tmp_path / "data.csv"
+    unknown.write_text("x,y\n1,2\n")
+    with pytest.raises(ValueError):
+        ArrowFileSource(unknown)
+
+
+def test_source_reads_columns_on_demand(path):
+    """Test that columns are read as asked for, once, and released."""
+    source = ArrowFileSource(path)
+    df = source.read(["y", "x"])
+    assert list(df.columns) == ["x", "y"]
+    pd.testing.assert_frame_equal(df, make_df()[["x", "y"]])
+    loaded = source.memory_usage()
+    assert loaded > 0
+
+    # Columns already read are reused
+    assert source.read(["x"])["x"] is not None
+    assert source.memory_usage() == loaded
+    pd.testing.assert_frame_equal(source.read(), make_df())
+
+    source.release()
+    assert source.memory_usage() == 0
+
+
+def test_source_restores_index(tmp_path):
+    """Test that an index pandas stored in the file is restored."""
+    path = tmp_path / "indexed.parquet"
+    df = make_df().set_index("when")
+    df.to_parquet(path)
+
+    source = ArrowFileSource(path)
+    assert source.columns == ["x", "y", "category"]
+    pd.testing.assert_frame_equal(source.read(["y"]), df[["y"]])
+
+
+def test_source_pickles_as_path(path):
+    """Test that a pickled source reopens its file, without the columns read so far."""
+    source = ArrowFileSource(path)
+    source.read()
+    copy = pickle.loads(pickle.dumps(source))
+    assert len(pickle.dumps(source)) < 1000
+    assert copy.memory_usage() == 0
+    assert copy.fingerprint == source.fingerprint
+    pd.testing.assert_frame_equal(copy.read(["y"]), source.read(["y"]))
+
+
+def test_parquet_column_statistics(tmp_path):
+    """Test that column statistics come from the Parquet metadata."""
+    path = tmp_path / "data.parquet"
+    df = make_df()
+    df.loc[::10, "y"] = np.nan
+    df.to_parquet(path, row_group_size=250)
+
+    statistics = ArrowFileSource(path).column_statistics()
+    assert statistics["x"] == {"nulls": 0, "min": 0.0, "max": 999.0}
+    assert statistics["y"]["nulls"] == 100
+    assert statistics["category"]["min"] == "a"
+
+
+def test_profile_source(path):
+    """Test that a source is profiled without reading its columns."""
+    source = ArrowFileSource(path)
+    df_info, df_head = profile_source(source)
+    assert "1000" in df_info
+    for column in source.columns:
+        assert column in df_info
+        assert column in df_head
+    assert source.memory_usage() == 0
+
+
+def test_execution_reads_only_used_columns(path):
+    """Test that executions read only the columns the code uses."""
+    source = ArrowFileSource(path)
+    env = PlotAgentExecutionEnvironment(source)
+    result = env.execute_code(BAR_CODE)
+    assert result["success"], result["error"]
+    assert result["metrics"]["columns_loaded"] == 2
+    assert "load_seconds" in result["metrics"]
+    assert set(source._loaded) == {"y", "category"}
+
+
+def test_execution_reads_whole_frame_when_unsure(path):
+    """Test that every column is read when the code uses the dataframe as a whole."""
+    source = ArrowFileSource(path)
+    env = PlotAgentExecutionEnvironment(source)
+    result = env.execute_code("fig = px.bar(df.describe().T, y='mean')")
+    assert result["success"], result["error"]
+    assert result["metrics"]["columns_loaded"] == 4
+
+
+def test_preview_reads_only_used_columns(path):
+    """Test that previews of a source read the columns their code uses, not the whole source."""
+    source = ArrowFileSource(path)
+    env = PlotAgentExecutionEnvironment(source, preview_rows=100, preview_stratify_by="category")
+    result = env.execute_code(BAR_CODE, preview=True)
+    assert result["success"], result["error"]
+    assert result["metrics"]["columns_loaded"] == 2
+    assert set(source._loaded) == {"y", "category"}
+    assert "100 of the 1000 rows" in result["output"]
+    assert len(result["fig"].data[0].x) == len(env.preview_df)
+    assert set(result["fig"].data[0].x) == {"a", "b", "c"}
+
+
+def test_preview_on_pool_with_source(path):
+    """Test that a sampled source is sent to pool workers, which read its columns themselves."""
+    source = ArrowFileSource(path)
+    with PlotAgentWorkerPool(max_workers=1, timeout=30) as pool:
+        env = PooledExecutionEnvironment(source, pool, preview_rows=100)
+        result = env.execute_code(BAR_CODE, preview=True)
+    assert result["success"], result["error"]
+    assert result["metrics"]["columns_loaded"] == 2
+    assert source.memory_usage() == 0
+
+
+def test_execution_on_pool_with_source(path):
+    """Test that a source is sent to pool workers, which read the columns themselves."""
+    source = ArrowFileSource(path)
+    with PlotAgentWorkerPool(max_workers=1, timeout=30) as pool:
+        env = PooledExecutionEnvironment(source, pool)
+        result = env.execute_code(BAR_CODE)
+    assert result["success"], result["error"]
+    assert result["metrics"]["columns_loaded"] == 2
+    # The columns were read on the worker, not here
+    assert source.memory_usage() == 0
+
+
+def test_agent_with_source(path):
+    """Test that an agent can plot a data source it was given instead of a dataframe."""
+    script = [
+        {"tool": "execute_plotly_code", "args": {"generated_code": BAR_CODE}},
+        {"content": "Here is a bar chart."},
+    ]
+    agent = PlotAgent(llm=ScriptedChatModel(script=script), verbose=False)
+    agent.set_source(path)
+    assert agent.df is None
+    assert "category" in agent.df_info
+
+    assert agent.process_message("Plot y by category") == "Here is a bar chart."
+    assert agent.get_figure() is not None
+    assert agent.source.memory_usage() > 0
+
+
+def test_session_with_source_is_evicted_and_rehydrated(path):
+    """Test that evicting a session with a source releases its columns and keeps the source."""
+    script = [
+        {"tool": "execute_plotly_code", "args": {"generated_code": BAR_CODE}},
+        {"content": "Here is a bar chart."},
+    ] * 2
+    manager = SessionManager(memory_budget_bytes=1, llm=ScriptedChatModel(script=script), verbose=False)
+    source = ArrowFileSource(path)
+    session_id = manager.create_session()
+    manager.set_source(session_id, source)
+    manager.process_message(session_id, "Plot y by category")
+
+    # Over the tiny budget, the idle session is evicted, and its columns released
+    assert manager.stats()["evicted"] == 1
+    assert source.memory_usage() == 0
+
+    # The figure is rebuilt from the kept source, without a rehydrate hook
+    with manager.session(session_id) as agent:
+        assert agent.source is source
+        assert agent.get_figure() is not None
+    assert manager.stats()["rehydrations"] == 1
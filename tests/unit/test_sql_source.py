@@ -0,0 +1,302 @@
+import functools
+import pickle
+import sqlite3
+import threading
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from plot_agent import aggregations
+from plot_agent.agent import PlotAgent
+from plot_agent.execution import PlotAgentExecutionEnvironment
+from plot_agent.sessions import SessionManager
+from plot_agent.sources import QueryCache, SqlSource, normalize_sql
+from plot_agent.testing import ScriptedChatModel
+
+
+QUERY = "SELECT * FROM sales"
+
+
+def make_df(n=1000):
+    """Create the dataframe written to the database, with missing values and uneven groups."""
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(
+        {
+            "x": np.arange(n, dtype=float),
+            "y": rng.random(n),
+            "category": rng.choice(list("abcdefghijkl"), n, p=np.arange(1, 13) / 78),
+            "region": rng.choice(["north", "south"], n),
+        }
+    )
+    df.loc[::10, "y"] = np.nan
+    return df
+
+
+@pytest.fixture
+def connect(tmp_path):
+    """Write the dataframe to a SQLite file, returning a function that connects to it."""
+    path = tmp_path / "sales.db"
+    with sqlite3.connect(path) as connection:
+        make_df().to_sql("sales", connection, index=False)
+    return functools.partial(sqlite3.connect, str(path), check_same_thread=False)
+
+
+def test_normalize_sql():
+    """Test that formatting, comments and the case of keywords do not change normalized SQL."""
+    assert normalize_sql("SELECT  *\n  FROM Sales -- all of it\n;") == normalize_sql("select * from sales")
+    assert normalize_sql("SELECT /* x */ a FROM t") == "select a from t"
+    # Quoted strings and identifiers keep their case and spacing
+    assert normalize_sql("SELECT 'A  b' FROM t") != normalize_sql("SELECT 'a b' FROM t")
+    assert normalize_sql('SELECT "Col" FROM t') == 'select "Col" from t'
+
+
+def test_source_reads_schema_without_data(connect):
+    """Test that a source learns its columns, length and statistics from queries."""
+    source = SqlSource(connect, QUERY + ";", statistics=True)
+    assert source.columns == ["x", "y", "category", "region"]
+    assert len(source) == 1000
+
+    statistics = source.column_statistics()
+    assert statistics["x"] == {"nulls": 0, "min": 0.0, "max": 999.0}
+    assert statistics["y"]["nulls"] == 100
+    assert statistics["category"]["min"] == "a"
+    pd.testing.assert_frame_equal(source.head(3), make_df().head(3))
+
+
+def test_statistics_are_only_queried_when_asked_for(connect):
+    """Test that setting a query does not scan every column for statistics, unless asked to."""
+    statements = []
+
+    def traced():
+        connection = connect()
+        connection.set_trace_callback(statements.append)
+        return connection
+
+    agent = PlotAgent(llm=ScriptedChatModel(script=[]), verbose=False)
+    agent.set_sql(traced, QUERY)
+    assert not any("MIN(" in statement for statement in statements)
+    assert "north to south" not in agent.df_info
+
+    agent.set_sql(traced, QUERY, statistics=True)
+    assert any("MIN(" in statement for statement in statements)
+    assert "north to south" in agent.df_info
+    assert pickle.loads(pickle.dumps(SqlSource(connect, QUERY, statistics=True))).statistics
+
+
+def test_source_reads_columns_on_demand(connect):
+    """Test that columns are queried as asked for, in their order in the query."""
+    source = SqlSource(connect(), QUERY)
+    pd.testing.assert_frame_equal(source.read(["y", "x"]), make_df()[["x", "y"]])
+    assert source.read([]).shape == (1000, 0)
+    assert source.memory_usage() > 0
+    source.release()
+    assert source.memory_usage() == 0
+
+
+def test_query_results_are_cached_by_normalized_sql(connect):
+    """Test that the same query, however it is written, is run once."""
+    cache = QueryCache()
+    first = SqlSource(connect, QUERY, name="sales", query_cache=cache)
+    first.read(["x"])
+    misses = cache.cache_info()["misses"]
+
+    # A second source on the same database, with the query written differently
+    second = SqlSource(connect, "select *\n  from SALES -- again", name="sales", query_cache=cache)
+    assert second.fingerprint == first.fingerprint
+    pd.testing.assert_frame_equal(second.read(["x"]), first.read(["x"]))
+    info = cache.cache_info()
+    assert info["misses"] == misses
+    assert info["hits"] >= 2
+    # Shared results are not counted as any one source's
+    assert first.memory_usage() == 0
+
+
+def test_cached_results_are_not_changed_by_code(connect):
+    """Test that code changing df in place leaves the cached query result, shared by sources, as it was."""
+    cache = QueryCache()
+    env = PlotAgentExecutionEnvironment(SqlSource(connect, QUERY, name="sales", query_cache=cache), isolate_df=False)
+    result = env.execute_code("df['x'] = df['x'] * 100\nfig = px.scatter(df, x='x', y='y')")
+    assert result["success"], result["error"]
+
+    other = SqlSource(connect, QUERY, name="sales", query_cache=cache)
+    pd.testing.assert_series_equal(other.read(["x", "y"])["x"], make_df()["x"])
+    head = other.head()
+    head["x"] = -1
+    assert other.head()["x"].iloc[0] == 0
+
+
+def test_sources_without_a_name_do_not_share_results(connect):
+    """Test that unnamed sources, which cannot tell their databases apart, never share cached results."""
+    cache = QueryCache()
+    first = SqlSource(connect(), QUERY, query_cache=cache)
+    second = SqlSource(connect(), QUERY, query_cache=cache)
+    assert first.name != second.name
+    assert first.fingerprint != second.fingerprint
+    # A pickled copy is the same source, so it keeps its name
+    source = SqlSource(connect, QUERY)
+    assert pickle.loads(pickle.dumps(source)).name == source.name
+
+
+def test_query_cache_evicts_and_expires():
+    """Test that the cache keeps within its size, least recently used first, and expires entries."""
+    result = pd.DataFrame({"a": np.arange(100)})
+    size = int(result.memory_usage(index=True, deep=True).sum())
+    cache = QueryCache(max_bytes=2 * size)
+    for key in ("a", "b", "c"):
+        cache.put(key, result)
+    assert len(cache) == 2
+    assert cache.get("a") is None
+    assert cache.cache_info()["evictions"] == 1
+
+    expiring = QueryCache(ttl_seconds=0)
+    expiring.put("a", result)
+    assert expiring.get("a") is None
+
+
+@pytest.mark.parametrize(
+    "helper, args, kwargs",
+    [
+        ("aggregate", ("category",), {}),
+        ("aggregate", ("category", "y"), {"agg": "mean"}),
+        ("aggregate", (["region", "category"], ["x", "y"]), {}),
+        ("top_k_groups", ("category",), {"k": 5}),
+        ("top_k_groups", ("category", "x"), {"k": 3}),
+        ("top_k_groups", ("category", "y"), {"agg": "max", "other": None}),
+        ("bin_histogram", ("y",), {"bins": 7}),
+        ("bin_histogram", ("y",), {"bins": 10, "weights": "x"}),
+        ("bin_histogram", ("x",), {"range": (100, 500)}),
+    ],
+)
+def test_helpers_run_in_the_database(connect, helper, args, kwargs):
+    """Test that the aggregation helpers give the same result on a source as on the dataframe."""
+    source = SqlSource(connect, QUERY)
+    expected = getattr(aggregations, helper)(make_df(), *args, **kwargs)
+    result = getattr(aggregations, helper)(source, *args, **kwargs)
+    pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+    # Only aggregates were fetched, never whole columns
+    assert all(len(entry[2]) <= 1000 // 10 for entry in source.query_cache._entries.values())
+
+
+def test_histogram_of_values_rounded_past_the_last_bin(tmp_path):
+    """Test that values just below the top of the range, which rounding puts past the last bin, go in it."""
+    low, high = -9.669447289429417, -1.5348775998186959
+    df = pd.DataFrame({"x": [low, np.nextafter(high, low), high]})
+    path = tmp_path / "edge.db"
+    with sqlite3.connect(path) as connection:
+        df.to_sql("edge", connection, index=False)
+    source = SqlSource(functools.partial(sqlite3.connect, str(path)), "SELECT * FROM edge")
+    expected = aggregations.bin_histogram(df, "x", bins=5, range=(low, high))
+    pd.testing.assert_frame_equal(source.bin_histogram("x", bins=5, range=(low, high)), expected)
+
+
+def test_helpers_fall_back_to_pandas(connect):
+    """Test that aggregations SQL cannot run are done in pandas on the columns they use."""
+    source = SqlSource(connect, QUERY)
+    expected = aggregations.top_k_groups(make_df(), "category", "y", k=3, agg="median")
+    pd.testing.assert_frame_equal(aggregations.top_k_groups(source, "category", "y", k=3, agg="median"), expected)
+
+
+def test_execution_pushes_helpers_down(connect):
+    """Test that code only passing df to the helpers runs them in the database."""
+    env = PlotAgentExecutionEnvironment(SqlSource(connect, QUERY))
+    result = env.execute_code("totals = aggregate(df, 'category', 'y')\nfig = px.bar(totals, x='category', y='y')")
+    assert result["success"], result["error"]
+    assert result["metrics"]["pushdown"]
+    assert result["metrics"]["columns_loaded"] == 0
+    expected = aggregations.aggregate(make_df(), "category", "y")
+    np.testing.assert_allclose(result["fig"].data[0].y, expected["y"])
+
+
+@pytest.mark.parametrize(
+    "code, columns_loaded",
+    [
+        # df used some other way as well
+        ("top = top_k_groups(df, 'category')\nfig = px.bar(top, x='category', y='count', title=str(len(df)))", 1),
+        ("fig = px.bar(aggregate(df[df['x'] > 10], 'category'), x='category', y='count')", 2),
+        # The helper replaced by code
+        ("def aggregate(data, by):\n    return data.groupby(by).size().reset_index(name='count')\n"
+         "fig = px.bar(aggregate(df, 'category'), x='category', y='count')", 4),
+    ],
+)
+def test_execution_reads_columns_when_not_pushed_down(connect, code, columns_loaded):
+    """Test that code using df in other ways gets a dataframe, read from the source."""
+    env = PlotAgentExecutionEnvironment(SqlSource(connect, QUERY))
+    result = env.execute_code(code)
+    assert result["success"], result["error"]
+    assert "pushdown" not in result["metrics"]
+    assert result["metrics"]["columns_loaded"] == columns_loaded
+
+
+def test_preview_of_a_sql_source(connect):
+    """Test that previews read the sampled rows of the columns used, and still push helpers down."""
+    env = PlotAgentExecutionEnvironment(SqlSource(connect, QUERY), preview_rows=100)
+    result = env.execute_code("fig = px.scatter(x=df['x'], y=df['y'])", preview=True)
+    assert result["success"], result["error"]
+    assert result["metrics"]["columns_loaded"] == 2
+    assert len(result["fig"].data[0].x) == 100
+
+    # Aggregating every row in the database costs about as little as sampling
+    result = env.execute_code("fig = px.bar(aggregate(df, 'category'), x='category', y='count')", preview=True)
+    assert result["success"], result["error"]
+    assert result["metrics"]["pushdown"]
+    assert sum(result["fig"].data[0].y) == 1000
+
+
+def test_source_on_a_connection_is_thread_safe(connect):
+    """Test that queries from many threads share one connection safely."""
+    source = SqlSource(connect(), QUERY)
+    results, errors = [], []
+
+    def run(column):
+        try:
+            results.append(source.aggregate("category", column, agg="max"))
+        except Exception as e:  # pragma: no cover - reported below
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(["x", "y"][i % 2],)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    assert len(results) == 8
+
+
+def test_source_pickles_with_a_connection_function(connect):
+    """Test that a source opening its own connections pickles, and one on a connection does not."""
+    source = SqlSource(connect, QUERY)
+    copy = pickle.loads(pickle.dumps(source))
+    assert copy.fingerprint == source.fingerprint
+    pd.testing.assert_frame_equal(copy.read(["y"]), source.read(["y"]))
+
+    with pytest.raises(TypeError):
+        pickle.dumps(SqlSource(connect(), QUERY))
+
+
+def test_agent_with_sql(connect):
+    """Test that an agent can plot the result of a SQL query."""
+    code = "fig = px.bar(top_k_groups(df, 'category', k=5), x='category', y='count')"
+    script = [
+        {"tool": "execute_plotly_code", "args": {"generated_code": code}},
+        {"content": "Here is a bar chart."},
+    ]
+    agent = PlotAgent(llm=ScriptedChatModel(script=script), verbose=False)
+    agent.set_sql(connect, QUERY)
+    assert agent.df is None
+    assert agent.sql_query == QUERY
+    assert "category" in agent.df_info
+    assert "aggregate()" in agent.df_info
+
+    assert agent.process_message("Plot the largest categories") == "Here is a bar chart."
+    assert len(agent.get_figure().data[0].x) == 6
+
+
+def test_sessions_share_query_results(connect):
+    """Test that sessions on the same database share the manager's query cache."""
+    manager = SessionManager(llm=ScriptedChatModel(script=[]), verbose=False)
+    first, second = manager.create_session(), manager.create_session()
+    manager.set_sql(first, connect, QUERY, name="sales")
+    misses = manager.query_cache.cache_info()["misses"]
+    manager.set_sql(second, connect, "select * from sales", name="sales")
+    assert manager.query_cache.cache_info()["misses"] == misses
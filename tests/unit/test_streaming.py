@@ -0,0 +1,185 @@
+import asyncio
+import json
+import time
+
+import pandas as pd
+import pytest
+from langchain_core.language_models import BaseChatModel
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from plot_agent.agent import PlotAgent
+from plot_agent.streaming import streaming_callback_handler
+
+
+BAR_CODE = "fig = px.bar(df, x='x', y='y')"
+
+
+class StreamingChatModel(BaseChatModel):
+    """A chat model that streams a fixed list of replies, in order: text word by word, tool calls whole."""
+
+    replies: list
+    delay: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted-streaming"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _chunks(self):
+        reply = self.replies.pop(0)
+        if isinstance(reply, dict):
+            # A call of execute_plotly_code
+            yield AIMessageChunk(
+                content="",
+                tool_call_chunks=[
+                    {"name": "execute_plotly_code", "args": json.dumps(reply), "id": "call_1", "index": 0}
+                ],
+            )
+            return
+        for word in reply.split(" "):
+            yield AIMessageChunk(content=word + " ")
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        for message in self._chunks():
+            time.sleep(self.delay)
+            chunk = ChatGenerationChunk(message=message)
+            if run_manager:
+                run_manager.on_llm_new_token(message.content, chunk=chunk)
+            yield chunk
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        # Like real chat models, the whole reply at once, without token callbacks
+        message = None
+        for chunk in self._stream(messages, stop):
+            message = chunk.message if message is None else message + chunk.message
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(**message.model_dump()))])
+
+
+def make_agent(replies, delay=0.0, **kwargs):
+    """Create an agent with a streaming chat model and a dataframe."""
+    agent = PlotAgent(verbose=False, **kwargs)
+    agent.llm = StreamingChatModel(replies=replies, delay=delay)
+    agent.set_df(pd.DataFrame({"x": ["a", "b"], "y": [1, 2]}))
+    return agent
+
+
+def test_stream_message_events():
+    """Test that stream_message yields tool calls, the figure, tokens and the response, in order."""
+    agent = make_agent([{"generated_code": BAR_CODE}, "Here is your bar chart."])
+
+    events = list(agent.stream_message("Plot it"))
+
+    types = [event["type"] for event in events]
+    assert types == ["tool_start", "figure", "tool_end"] + ["token"] * 5 + ["response"]
+    assert events[0]["name"] == "execute_plotly_code"
+    assert events[1]["code"] == BAR_CODE and events[1]["preview"] is False
+    assert events[1]["fig"] is agent.get_figure()
+    assert events[2]["output"].startswith("Success")
+    assert "".join(event["text"] for event in events if event["type"] == "token").strip() == (
+        "Here is your bar chart."
+    )
+    assert events[-1]["output"] == "Here is your bar chart. "
+    assert agent.chat_history[-1].content == events[-1]["output"]
+
+
+class FakeChatModel(GenericFakeChatModel):
+    """LangChain's fake chat model, which only calls token callbacks when it is streamed."""
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+
+def test_handler_streams_invoked_models():
+    """Test that chat models invoked with the streaming handler stream their replies through it."""
+    events = []
+    llm = FakeChatModel(messages=iter([AIMessage(content="A bar chart."), AIMessage(content="A pie chart.")]))
+
+    llm.invoke("Plot it", config={"callbacks": [streaming_callback_handler(events.append)]})
+    assert [event["text"] for event in events] == ["A", " ", "bar", " ", "chart."]
+
+    events.clear()
+    asyncio.run(llm.ainvoke("Plot it", config={"callbacks": [streaming_callback_handler(events.append)]}))
+    assert "".join(event["text"] for event in events) == "A pie chart."
+
+
+@pytest.mark.parametrize("asynchronous", [False, True])
+def test_stream_message_streams_invoked_models(asynchronous):
+    """Test that chat models the agent invokes stream their replies when the message is streamed."""
+    agent = PlotAgent(verbose=False)
+    agent.llm = FakeChatModel(messages=iter([AIMessage(content="Here is your bar chart.")]))
+    agent.set_df(pd.DataFrame({"x": ["a", "b"], "y": [1, 2]}))
+
+    async def collect():
+        return [event async for event in agent.astream_message("Plot it")]
+
+    events = asyncio.run(collect()) if asynchronous else list(agent.stream_message("Plot it"))
+
+    tokens = [event["text"] for event in events if event["type"] == "token"]
+    assert "".join(tokens) == "Here is your bar chart."
+    assert len(tokens) > 1
+    assert events[-1] == {"type": "response", "output": "Here is your bar chart."}
+
+
+def test_stream_message_yields_figure_before_the_loop_ends():
+    """Test that the figure arrives while the LLM is still writing its reply."""
+    agent = make_agent([{"generated_code": BAR_CODE}, "word " * 20], delay=0.05)
+
+    started = time.perf_counter()
+    for event in agent.stream_message("Plot it"):
+        if event["type"] == "figure":
+            figure_seconds = time.perf_counter() - started
+    total_seconds = time.perf_counter() - started
+
+    assert figure_seconds < total_seconds - 0.5
+
+
+def test_stream_message_reports_fallback_figures():
+    """Test that figures from fallback executions are streamed too."""
+    agent = make_agent([f"Try:\n```python\n{BAR_CODE}\n```"])
+
+    events = list(agent.stream_message("Plot it"))
+
+    assert [event["type"] for event in events][-2:] == ["figure", "response"]
+
+
+def test_stream_message_raises_errors():
+    """Test that an error processing the message is raised from the generator."""
+    agent = make_agent([])
+
+    with pytest.raises(IndexError):
+        list(agent.stream_message("Plot it"))
+
+    assert agent._event_sink is None
+
+
+def test_astream_message_events():
+    """Test that astream_message yields the same events as stream_message."""
+    agent = make_agent([{"generated_code": BAR_CODE}, "Here is your bar chart."])
+
+    async def collect():
+        return [event async for event in agent.astream_message("Plot it")]
+
+    events = asyncio.run(collect())
+
+    assert [event["type"] for event in events] == (
+        ["tool_start", "figure", "tool_end"] + ["token"] * 5 + ["response"]
+    )
+    assert events[-1]["output"] == "Here is your bar chart. "
+
+
+def test_astream_message_closed_early():
+    """Test that closing the async generator early cancels the message."""
+    agent = make_agent(["word " * 50], delay=0.02)
+
+    async def first_token():
+        stream = agent.astream_message("Plot it")
+        event = await stream.__anext__()
+        await stream.aclose()
+        return event
+
+    assert asyncio.run(first_token())["type"] == "token"
+    assert agent._event_sink is None
+    assert agent.last_metrics["error"].startswith("CancelledError")
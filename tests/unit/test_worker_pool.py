@@ -0,0 +1,174 @@
+import threading
+import time
+
+import pytest
+import pandas as pd
+from plot_agent.agent import PlotAgent
+from plot_agent.pool import PlotAgentWorkerPool, PooledExecutionEnvironment
+
+
+@pytest.fixture(scope="module")
+def pool():
+    """A small worker pool shared by the tests in this module."""
+    pool = PlotAgentWorkerPool(max_workers=2, timeout=10)
+    yield pool
+    pool.shutdown()
+
+
+def test_pool_executes_code(pool):
+    """Test that the pool returns the same result dict as the in-process environment."""
+    df = pd.DataFrame({"x": [1, 2, 3], "y": [10, 20, 30]})
+
+    env = PooledExecutionEnvironment(df, pool)
+    result = env.execute_code("fig = px.scatter(df, x='x', y='y')")
+
+    assert result["success"] is True
+    assert result["error"] == ""
+    assert result["fig"] is not None
+    assert env.fig is not None
+
+
+def test_pool_reports_errors(pool):
+    """Test that errors raised on a worker come back in the result."""
+    df = pd.DataFrame({"x": [1, 2, 3], "y": [10, 20, 30]})
+
+    env = PooledExecutionEnvironment(df, pool)
+    result = env.execute_code("fig = px.scatter(df, x='missing', y='y')")
+    assert result["success"] is False
+    assert "Error executing code" in result["error"]
+    assert env.fig is None
+
+    result = env.execute_code("import os")
+    assert "Code rejected on safety grounds" in result["error"]
+
+
+def test_pool_preview_mode(pool):
+    """Test that preview executions run on the sample on a worker, and finalize on the full dataframe."""
+    df = pd.DataFrame({"x": range(1000), "y": range(1000)})
+    code = "fig = px.scatter(df, x='x', y='y', title=str(len(df)))"
+
+    env = PooledExecutionEnvironment(df, pool, preview_rows=10)
+    result = env.execute_code(code, preview=True)
+    assert result["success"] is True
+    assert env.preview_fig.layout.title.text == "10"
+    assert env.fig is None
+
+    env.finalize_preview()
+    assert env.fig.layout.title.text == "1000"
+
+
+def test_pool_optimizes_figures_on_worker(pool):
+    """Test that figures are downsampled on the worker before being sent back."""
+    df = pd.DataFrame({"x": range(10000), "y": range(10000)})
+
+    env = PooledExecutionEnvironment(df, pool, figure_max_points=100)
+    result = env.execute_code("fig = px.line(df, x='x', y='y')")
+
+    assert result["optimizations"] == ["trace 0: downsampled from 10000 to 100 points with LTTB"]
+    assert env.fig is not None
+
+
+def test_pool_discards_in_place_changes(pool):
+    """Test that in-place changes to df on a worker do not leak into later executions."""
+    env = PooledExecutionEnvironment(pd.DataFrame({"x": range(10)}), pool)
+
+    result = env.execute_code("df.drop(index=[0, 1], inplace=True)\nfig = px.line(df, y='x')")
+    assert result["metrics"]["df_modified"] is True
+
+    result = env.execute_code("fig = px.line(df, y='x', title=str(len(df)))")
+    assert result["fig"].layout.title.text == "10"
+
+
+def test_pool_serves_many_sessions(pool):
+    """Test that each session's code runs against its own dataframe."""
+    envs = [
+        PooledExecutionEnvironment(pd.DataFrame({"x": range(n + 1)}), pool)
+        for n in range(4)
+    ]
+    for n, env in enumerate(envs):
+        result = env.execute_code("fig = px.line(df, y='x', title=str(len(df)))")
+        assert result["success"] is True
+        assert result["fig"].layout.title.text == str(n + 1)
+
+
+def test_pool_replaces_stuck_worker():
+    """Test that a worker stuck past the pool timeout is killed and replaced."""
+    df = pd.DataFrame({"x": [1, 2, 3]})
+
+    with PlotAgentWorkerPool(max_workers=1, timeout=3) as pool:
+        env = PooledExecutionEnvironment(df, pool)
+        result = env.execute_code("while True:\n    pass")
+        assert result["success"] is False
+        assert "timed out" in result["error"]
+
+        # The replacement worker picks up where the old one left off
+        result = env.execute_code("fig = px.bar(df, y='x')")
+        assert result["success"] is True
+
+
+def test_pool_replaces_worker_after_unexpected_reply(monkeypatch):
+    """Test that a worker whose replies are out of step is replaced, rather than reused."""
+    df = pd.DataFrame({"x": [1, 2, 3]})
+
+    with PlotAgentWorkerPool(max_workers=1, timeout=10) as pool:
+        env = PooledExecutionEnvironment(df, pool)
+        with monkeypatch.context() as patch:
+            # The worker keeps asking for the dataframe, even once it is sent
+            patch.setattr(pool, "_receive", lambda worker: ("missing", None))
+            with pytest.raises(RuntimeError, match="'missing'"):
+                env.execute_code("fig = px.bar(df, y='x')")
+
+        # The replies left in the old worker's pipe are not read as this one's
+        result = env.execute_code("fig = px.line(df, y='x')")
+        assert result["success"] is True
+        assert result["fig"].data[0].type == "scatter"
+
+
+def test_pool_cancel():
+    """Test that cancel() kills the worker running an environment's code, which is then replaced."""
+    df = pd.DataFrame({"x": [1, 2, 3]})
+
+    with PlotAgentWorkerPool(max_workers=1, timeout=30) as pool:
+        env = PooledExecutionEnvironment(df, pool)
+        assert env.cancel() is False
+        results = []
+        thread = threading.Thread(target=lambda: results.append(env.execute_code("while True:\n    pass")))
+        thread.start()
+
+        # Wait until the execution has started, then cancel it
+        deadline = time.monotonic() + 10
+        while not env.cancel() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        thread.join(timeout=10)
+        assert results and results[0]["error"] == "Code execution was cancelled."
+
+        result = env.execute_code("fig = px.bar(df, y='x')")
+        assert result["success"] is True
+
+
+def test_agent_with_execution_pool(pool):
+    """Test that PlotAgent runs its code on the pool when given one."""
+    df = pd.DataFrame({"x": [1, 2, 3, 4, 5], "y": [10, 20, 30, 40, 50]})
+
+    agent = PlotAgent(execution_pool=pool)
+    agent.set_df(df)
+    assert isinstance(agent.execution_env, PooledExecutionEnvironment)
+
+    result = agent.execute_plotly_code(
+        "import plotly.express as px\nfig = px.scatter(df, x='x', y='y')"
+    )
+    assert "Code executed successfully" in result
+    assert agent.get_figure() is not None
+
+
+def test_pool_closes_matplotlib_figures(pool):
+    """Test that matplotlib figures come back from workers, and that workers close them."""
+    df = pd.DataFrame({"x": [1, 2, 3], "y": [10, 20, 30]})
+
+    env = PooledExecutionEnvironment(df, pool)
+    result = env.execute_code("fig, ax = plt.subplots()\nax.plot(df['x'], df['y'])\nplt.figure()")
+
+    assert result["success"] is True
+    assert type(result["fig"]).__name__ == "Figure"
+    assert result["metrics"]["matplotlib_figures_closed"] == 2
+    assert "rss_delta_bytes" in result["metrics"]